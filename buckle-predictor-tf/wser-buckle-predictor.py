@@ -11,7 +11,7 @@ Original file is located at
 ######## PACKAGES AND USEFUL FUNCTIONS ########
 # Import packages
 # %tensorflow_version 2.x
-import warnings, logging, os
+import warnings, logging, os, sys
 logging.disable(logging.WARNING)
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
@@ -20,20 +20,16 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import tensorflow as tf
 from sklearn.preprocessing import StandardScaler
 
-# Function to format times
-def getHours(strTime):
-  if "-" in strTime:
-    strTime = strTime[0:str.find(strTime,"-")]
-  if " " in strTime:
-    strTime= strTime[0:str.find(strTime," ")]
-  if strTime == "nan" or len(strTime) == 0:
-      return 30.0
-  else:
-      strTime = str.split(strTime,':')
-      return float(strTime[0]) + float(strTime[1])/60.0 + float(strTime[2])/3600.0
+# Time parsing (scalar getHours for typed-in splits) and cached feature building
+from wserTimes import getHours
+from wserFeatures import buildFeatures, featureNames, allAidStations
+from wserModels import modelKey, saveModel, removeModel
+from wserInference import hasWeights, loadNumpyModel, SoftmaxModel
+
+# Usage: python wser-buckle-predictor.py [--retrain]
+retrain = "--retrain" in sys.argv
 
 ######## DEFINE FEATURES AND LABELS ########
 
@@ -50,7 +46,6 @@ elif modelType ==2:                                   # simplified model
   aidStationNames = ['Robinson Flat', "Devil's Thumb", "Michigan Bluff"]
   neurons = 8
 else:
-  allAidStations = ['Lyon Ridge', 'Red Star Ridge', 'Duncan Canyon', 'Robinson Flat', "Miller's Defeat", 'Dusty Corners', "Last Chance", "Devil's Thumb", "El Dorado Creek", "Michigan Bluff", "Foresthill", "Rucky Chucky", "Auburn Lake Trails"]
   print("Select Latest Aid Station: ")
   for i in range(0, len(allAidStations)):
     print(f"({i+1}) {allAidStations[i]}")
@@ -58,100 +53,74 @@ else:
   neurons = 8 + np.ceil(len(aidStationNames) / 3.0).astype(int)
 
 # Define features and labels
-features = np.concatenate([['Gender', 'Age', 'MinTemp', 'MaxTemp'], aidStationNames])
+features = featureNames(aidStationNames)
 labels=['Buckle']
 
 ######## LOAD TRAINING AND TESTING DATA ########
 
-# Temperature data
-temps = {
-    2024: [94, 63],
-    2023: [80, 51],
-    2022: [97, 70],
-    2021: [101, 73],
-    2020: [93, 66],
-    2019: [83, 57],
-    2018: [98, 61],
-    2017: [95, 75],
-    2016: [93, 60],
-    2015: [91, 73],
-    2014: [89, 59],
-    2013: [102, 73],
-    2012: [71, 51],
-    2011: [82, 60],
-    2010: [91, 66]
-}
-
 # Define time ranges for available data
 startTrain = 2016
 endTrain = 2023
 testYear = 2022
 
-# Populate training dataframe
-df_individual = []
-for year in range(startTrain,endTrain+1):
-  if year != testYear and year != 2020:
-    df = pd.read_csv(f'wser{year}.csv')
-    df = df.rename(columns={"Devils Thumb": "Devil's Thumb", "Foresthill School": "Foresthill", "Millers Defeat": "Miller's Defeat"})
-    df['MaxTemp'] = temps[year][0]
-    df['MinTemp'] = temps[year][1]
-    df_individual.append(df)
-df_train = pd.concat(df_individual)
-
-# Populate test dataframe
-df_test = pd.read_csv(f'wser{testYear}.csv')
-df_test['MaxTemp'] = temps[year][0]
-df_test['MinTemp'] = temps[year][1]
-
-# Format everything as an int/float
-relevantSplits = np.concatenate([aidStationNames, ["Time"]])
-df_train['Gender'] = df_train['Gender'].apply(lambda x: 1.0 if x == 'M' else 0.0)
-df_test['Gender'] = df_test['Gender'].apply(lambda x: 1.0 if x == 'M' else 0.0)
-for i in range(0, len(relevantSplits)):
-    df_train[relevantSplits[i]] = df_train[relevantSplits[i]].apply(lambda x: getHours(str(x)))
-    df_test[relevantSplits[i]] = df_test[relevantSplits[i]].apply(lambda x: getHours(str(x)))
-
-# Input data (features) in desired format
-input_train = df_train[features].copy().to_numpy(dtype=float)
-input_test = df_test[features].copy().to_numpy(dtype=float)
+# Parsed features and finish times (hours) for every runner, cached on disk until a splits file changes
+input_train, time_train, input_test, time_test = buildFeatures(aidStationNames, startTrain, endTrain, testYear)
 print(input_train.shape)
 
 # Output data (labels) in desired format
 buckleNames = ['silver', 'bronze', 'no buckle'];
 silver = 24
 bronze = 30
-output_train = df_train["Time"].apply(lambda x: np.where([x < silver, silver <= x and x < bronze, x >= bronze])[0]).astype(int)
-output_test= df_test['Time'].apply(lambda x: np.where([x < silver, silver <= x and x < bronze, x >= bronze])[0]).astype(int)
-output_train = output_train.copy().to_numpy(dtype=int)
-output_test = output_test.copy().to_numpy(dtype=int)
-
-# Normalize
-scaler = StandardScaler()
-input_train = scaler.fit_transform(input_train)
-input_test = scaler.transform(input_test)
-
-######## BUILD AND COMPILE MODEL ########
-model = tf.keras.Sequential([
-    tf.keras.layers.Dense(neurons, activation='relu'),
-    tf.keras.layers.Dense(3)
-])
-model.compile(optimizer='adam',
-              loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
-              metrics=['accuracy'])
-
-######## TRAIN MODEL ########
-
-# Train
-print("Training model...")
-num_epochs=40
-model.fit(input_train, output_train, epochs=num_epochs)
+output_train = np.digitize(time_train, [silver, bronze])
+output_test = np.digitize(time_test, [silver, bronze])
 
-# Evaluate accuracy
-test_loss, test_accuracy = model.evaluate(input_test, output_test, verbose=0)
-print(f"Done training. Model Accuracy = {100*test_accuracy}%, Loss = {test_loss}")
-
-# Convert output to probabilities
-probability_model = tf.keras.Sequential([model, tf.keras.layers.Softmax()])
+# Trained models are kept in the registry, keyed by model configuration and training data
+num_epochs=40
+modelName = modelKey('buckle', aidStationNames, startTrain, endTrain, testYear, neurons=int(neurons), epochs=num_epochs)
+if retrain:
+  removeModel(modelName)
+
+if hasWeights(modelName):
+  ######## LOAD TRAINED MODEL ########
+  # Scored with the NumPy engine, so TensorFlow is not even imported
+  model, scaler, modelDetails = loadNumpyModel(modelName)
+  input_test = scaler.transform(input_test)
+  probability_model = SoftmaxModel(model)
+  print(f"Loaded trained model {modelName}. Model Accuracy = {100*modelDetails['accuracy']}%, Loss = {modelDetails['loss']}")
+else:
+  import tensorflow as tf
+
+  # Normalize
+  scaler = StandardScaler()
+  input_train = scaler.fit_transform(input_train)
+  input_test = scaler.transform(input_test)
+
+  ######## BUILD AND COMPILE MODEL ########
+  model = tf.keras.Sequential([
+      tf.keras.layers.Dense(neurons, activation='relu'),
+      tf.keras.layers.Dense(3)
+  ])
+  model.compile(optimizer='adam',
+                loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+                metrics=['accuracy'])
+
+  ######## TRAIN MODEL ########
+
+  # Train
+  print("Training model...")
+  model.fit(input_train, output_train, epochs=num_epochs)
+
+  # Evaluate accuracy
+  test_loss, test_accuracy = model.evaluate(input_test, output_test, verbose=0)
+  print(f"Done training. Model Accuracy = {100*test_accuracy}%, Loss = {test_loss}")
+
+  # Register the trained model, scaler and station list for the next run
+  saveModel(modelName, {'stations': list(aidStationNames), 'features': list(features), 'neurons': int(neurons),
+                        'epochs': num_epochs, 'startTrain': startTrain, 'endTrain': endTrain, 'testYear': testYear,
+                        'accuracy': test_accuracy, 'loss': test_loss}, model=model, scaler=scaler)
+
+  # Convert output to probabilities
+  probability_model = tf.keras.Sequential([model, tf.keras.layers.Softmax()])
 
 ######## MAKE PREDICTIONS USING TEST DATA ########
 showTestCases = str.upper(input('Show sample outputs from test data? Y/N: ')).strip()
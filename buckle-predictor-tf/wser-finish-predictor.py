@@ -8,37 +8,26 @@ Original file is located at
 """
 
 # Import packages
-import warnings, logging, os
+import warnings, logging, os, sys
 logging.disable(logging.WARNING)
-os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
-os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from tensorflow import feature_column as fc
-import tensorflow as tf
-
-# Function to format times
-def getHours(strTime):
-    if " " in strTime:
-      strTime= strTime[0:str.find(strTime," ")]
-    if strTime == "nan" or "-" in strTime:
-        return 30.0
-    else:
-        strTime = str.split(strTime,':')
-        return float(strTime[0]) + float(strTime[1])/60.0 + float(strTime[2])/3600.0
-
-# Function to create input function to convert data to a tf.data.Dataset object
-def make_input_fn(data_df, label_df, num_epochs=100, shuffle=True, batch_size=32):
-    def input_function():
-        ds = tf.data.Dataset.from_tensor_slices((dict(data_df),label_df))
-        if shuffle:
-            ds = ds.shuffle(1000)   # randomize order of data
-        ds = ds.batch(batch_size).repeat(num_epochs)    # split into batches
-        return ds
-    return input_function
+from sklearn import metrics
+
+# Time parsing (a "-" anywhere in the time means the split is missing) and cached feature building
+from wserTimes import getHoursDashMissing as getHours
+from wserFeatures import buildFeatures, featureNames
+from wserModels import modelKey, isRegistered, saveModel, loadModel, removeModel
+# Logistic model fitted in-process (one-hot Gender plus numeric columns, as the old tf.estimator.LinearClassifier)
+from wserLogistic import fitLogistic, predictLogistic, evaluateLogistic, cutoffColumn, saveLogistic, loadLogistic, hasLogistic, standardCutoffs
+# Distribution of finish time (P(finish < t) for any t, from one model)
+from wserDistribution import fitDistribution, evaluateDistribution, probabilityUnder, quantileHours, cutoffGrid
+
+# Usage: python wser-finish-predictor.py [--retrain]
+retrain = "--retrain" in sys.argv
 
 # Get user input for what type of model we want to run
 print("---- SELECT MODEL TYPE ----")
@@ -54,89 +43,57 @@ print("M1 Cougar/Beat Jim: 14.15")
 print("F1 Cougar/Beat Courtney: 15.48")
 cutoff = float(input("Finish Time (Hours): "))
 
-# Temperature data
-temps = {
-    2024: [94, 63],
-    2023: [80, 51],
-    2022: [97, 70],
-    2021: [101, 73],
-    2020: [93, 66],
-    2019: [83, 57],
-    2018: [98, 61],
-    2017: [95, 75],
-    2016: [93, 60],
-    2015: [91, 73],
-    2014: [89, 59],
-    2013: [102, 73],
-    2012: [71, 51],
-    2011: [82, 60],
-    2010: [91, 66]
-}
-
 # Splits, features, labels
 if modelType == 1:    # detailed model
   aidStationNames = ['Lyon Ridge', 'Red Star Ridge', 'Duncan Canyon', 'Robinson Flat', "Miller's Defeat", 'Dusty Corners', "Last Chance", "Devil's Thumb", "El Dorado Creek", "Michigan Bluff", "Foresthill"]
 else:                 # simplified model
   aidStationNames = ['Robinson Flat', "Devil's Thumb", "Michigan Bluff"]
 
-CATEGORICAL_COLUMNS = ['Gender']
-NUMERIC_COLUMNS = np.concatenate([['Age', 'MinTemp', 'MaxTemp'], aidStationNames])
-features = np.concatenate([CATEGORICAL_COLUMNS, NUMERIC_COLUMNS])
-labels=['Time']
+features = featureNames(aidStationNames)
 
-# Load data
+# Load data (parsed features are cached on disk until a splits file changes)
 startTrain = 2016
 endTrain = 2023
 testYear = 2022
-
-df_individual = []
-for year in range(startTrain,endTrain+1):
-  if year != testYear and year != 2020:
-    df = pd.read_csv(f'wser{year}.csv')
-    df['MaxTemp'] = temps[year][0]
-    df['MinTemp'] = temps[year][1]
-    df_individual.append(df)
-df_train = pd.concat(df_individual)
-
-df_test = pd.read_csv(f'wser{testYear}.csv')
-df_test['MaxTemp'] = temps[year][0]
-df_test['MinTemp'] = temps[year][1]
-
-# Format times
-relevantSplits = np.concatenate([aidStationNames, labels])
-for i in range(0, len(relevantSplits)):
-    df_train[relevantSplits[i]] = df_train[relevantSplits[i]].apply(lambda x: getHours(str(x)))
-    df_test[relevantSplits[i]] = df_test[relevantSplits[i]].apply(lambda x: getHours(str(x)))
-
-# Split into features and labels for training and testing data
-input_train = df_train[features].copy()
-input_test = df_test[features].copy()
-output_train = (df_train[labels].copy() < cutoff).astype(int)
-output_test = (df_test[labels].copy() < cutoff).astype(int)
-
-# Split into feature columns
-feature_columns = []
-
-for feature_name in CATEGORICAL_COLUMNS:
-    vocabulary = input_train[feature_name].unique()
-    feature_columns.append(tf.feature_column.categorical_column_with_vocabulary_list(feature_name,vocabulary))
-
-for feature_name in NUMERIC_COLUMNS:
-    feature_columns.append(tf.feature_column.numeric_column(feature_name, dtype=tf.float32))
-
-# Create input data
-input_train_fn = make_input_fn(input_train, output_train)
-input_test_fn = make_input_fn(input_test, output_test, num_epochs=1, shuffle=False)
-
-# Create linear classifier object which creates a model for us
-linear_est = tf.estimator.LinearClassifier(feature_columns=feature_columns)
-
-# Train the model!
-print("Training Model...")
-linear_est.train(input_train_fn)
-
-# Evaluate the model!
-result = linear_est.evaluate(input_test_fn)
+input_train, time_train, input_test, time_test = buildFeatures(aidStationNames, startTrain, endTrain, testYear, dashIsMissing=True)
+
+# The chosen cutoff is fitted together with the standard ones (one solve for all of them)
+cutoffs = sorted(set(standardCutoffs + [cutoff]), reverse=True)
+
+# Trained models are kept in the registry, keyed by model configuration, cutoffs and training data
+modelName = modelKey('finish', aidStationNames, startTrain, endTrain, testYear, dashIsMissing=True, solver='irls', cutoffs=cutoffs)
+if retrain:
+  removeModel(modelName)
+
+if isRegistered(modelName) and hasLogistic(modelName):
+  model = loadLogistic(modelName)
+  _, _, modelDetails = loadModel(modelName)
+  print(f"Loaded trained model {modelName}")
+else:
+  # Train the model!
+  print("Training Model...")
+  model = fitLogistic(input_train, time_train, cutoffs)
+
+  # Evaluate the model on the test year (accuracy and confusion matrix for every cutoff) and register it
+  modelDetails = {'stations': list(aidStationNames), 'features': list(features), 'cutoffs': cutoffs,
+                  'results': {str(fitted): result for fitted, result in evaluateLogistic(model, input_test, time_test).items()}}
+  saveLogistic(modelName, model)
+  saveModel(modelName, modelDetails)
+result = modelDetails['results'][str(float(cutoff))]
+
+# The distribution model does not depend on the cutoff, so it is registered once per set of splits
+distributionName = modelKey('distribution', aidStationNames, startTrain, endTrain, testYear, dashIsMissing=True, solver='irls', grid=cutoffGrid.tolist())
+if retrain:
+  removeModel(distributionName)
+
+if isRegistered(distributionName) and hasLogistic(distributionName):
+  distribution = loadLogistic(distributionName)
+else:
+  print("Training Distribution Model...")
+  distribution = fitDistribution(input_train, time_train)
+  saveLogistic(distributionName, distribution)
+  saveModel(distributionName, {'stations': list(aidStationNames), 'features': list(features), 'grid': cutoffGrid.tolist(),
+                                'results': {str(fitted): result for fitted, result in evaluateDistribution(distribution, input_test, time_test, cutoffs).items()}})
 
 # Report results
 print("---- MODEL DETAILS ----")
@@ -146,17 +103,8 @@ print(f"Training Set Size: {len(input_train)}")
 print(f"Target Cutoff: {cutoff} hrs")
 print(f"Accuracy: {result['accuracy']}")
 
-# Generate confusion matrix
-from sklearn import metrics
-result = list(linear_est.predict(input_test_fn))
-actual = []
-predicted = []
-for i in range(0, len(result)):
-  finisher = result[i]
-  predicted.append(int(round(finisher['probabilities'][1])))
-  actual.append(int(df_test['Time'][i] < cutoff))
-confusion_matrix = metrics.confusion_matrix(actual,predicted, normalize='true')
-cm_display = metrics.ConfusionMatrixDisplay(confusion_matrix = confusion_matrix,
+# Plot confusion matrix
+cm_display = metrics.ConfusionMatrixDisplay(confusion_matrix = np.array(result['confusionMatrix']),
                                             display_labels=[f'Over {cutoff}', f'Sub-{cutoff}'])
 cm_display.plot()
 plt.title(f'WSER Sub-{cutoff} Hour Predictor\nConfusion Matrix')
@@ -165,20 +113,23 @@ plt.show()
 # Let user make a prediction
 print("---- PREDICT FINISH ----")
 
-input_dict = {}
-input_dict['Gender'] = input("Gender Category (M/F): ")
-input_dict['Age'] = int(input("Age: "))
-input_dict['MinTemp'] = float(input("Low Temperature (F): "))
-input_dict['MaxTemp'] = float(input("High Temperature (F): "))
+# User inputs features in order: gender, age, min temp, max temp, aid stations
+inputFeatures = []
+inputFeatures.append(1.0 if str.upper(input("Gender Category (M/F): ")).strip() == 'M' else 0.0)
+inputFeatures.append(int(input("Age: ")))
+inputFeatures.append(float(input("Low Temperature (F): ")))
+inputFeatures.append(float(input("High Temperature (F): ")))
 
 for aid in range(0, len(aidStationNames)):
-  input_dict[aidStationNames[aid]] = getHours(input(f"Split at {aidStationNames[aid]} (hh:mm:ss):"))
-
-df_test_input = pd.DataFrame([input_dict])
-
-input_user_fn = make_input_fn(df_test_input, output_test.loc[0,:].copy(), num_epochs=1, shuffle=False)
-
-result = list(linear_est.predict(input_user_fn))
-
-finisher = result[0]
-print(f"Probability of Sub-{cutoff} Finish: {finisher['probabilities'][1]}")
\ No newline at end of file
+  inputFeatures.append(getHours(input(f"Split at {aidStationNames[aid]} (hh:mm:ss):")))
+
+probability = predictLogistic(model, np.array(inputFeatures))[0, cutoffColumn(model, cutoff)]
+print(f"Probability of Sub-{cutoff} Finish: {probability}")
+
+# Every cutoff at once from the distribution model
+print("---- FINISH TIME DISTRIBUTION ----")
+distributionCutoffs = sorted(set(standardCutoffs + [cutoff]))
+for target, p in zip(distributionCutoffs, probabilityUnder(distribution, np.array(inputFeatures), distributionCutoffs)[0]):
+  print(f"P(Sub-{target}): {p:.3f}")
+median = quantileHours(distribution, np.array([inputFeatures]))[0]
+print(f"Median Predicted Finish: {median:.2f} hrs" if not np.isnan(median) else "Median Predicted Finish: over 30 hrs")
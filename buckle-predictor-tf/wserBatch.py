@@ -0,0 +1,132 @@
+### IMPORTS
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from wserTimes import parseSeconds
+from wserFeatures import frameFeatures, readSplitsCsv, allAidStations, temps
+from wserModels import findModel
+from wserLogistic import loadLogistic, predictLogistic, cutoffColumn
+from wserInference import loadBuckleModel, softmax
+from wserSplits import splitsFileYear
+
+### GLOBAL VARIABLES
+buckleNames = ['silver', 'bronze', 'no buckle']
+runnerColumns = ['Bib', 'First Name', 'Last Name', 'Gender', 'Age']     # copied from the input file into the scores
+
+### FUNCTIONS
+# Stations every runner reached: the length of the allAidStations prefix ending at the runner's latest split (0: none)
+def reachedCounts(df, dashIsMissing=False):
+    reached = np.zeros(len(df), dtype=int)
+    for k, station in enumerate(allAidStations):
+        if station in df:
+            reached[~parseSeconds(df[station], dashIsMissing)[1]] = k + 1
+    return reached
+
+# Registered model for every allAidStations prefix length that has one, as {k: key}
+def prefixModels(modelType, accept=None):
+    keys = {k: findModel(modelType, allAidStations[0:k], accept=accept) for k in range(1, len(allAidStations) + 1)}
+    return {k: key for k, key in keys.items() if key is not None}
+
+# Buckle probabilities (silver, bronze, no buckle) from a loaded model and scaler, in one predict call
+def buckleProbabilities(model, scaler, matrix):
+    return softmax(model.predict(scaler.transform(matrix), batch_size=len(matrix), verbose=0))
+
+# Buckle probabilities for every row of a feature matrix, using a registered model (without TensorFlow if its weights were exported)
+def scoreBuckle(matrix, key):
+    model, scaler, _ = loadBuckleModel(key)
+    return buckleProbabilities(model, scaler, matrix)
+
+# Sub-cutoff probability for every row of a feature matrix, using a registered logistic model
+def scoreFinish(matrix, key, cutoff):
+    model = loadLogistic(key)
+    return predictLogistic(model, matrix)[:, cutoffColumn(model, cutoff)]
+
+# Writes scores as Parquet (.parquet) or CSV (anything else)
+def writeScores(scores, output):
+    if output.endswith(".parquet"):
+        scores.to_parquet(output, index=False)
+    else:
+        scores.to_csv(output, index=False)
+
+# Scores every runner in a splits CSV (same layout as splits/wserYYYY.csv, splits may stop at any station)
+# each runner is scored with the richest registered model that needs no split beyond the runner's latest station
+# (as wserStream.RaceState does), one predict call per model; aidStationNames scores everyone with that one model
+# modelType 'buckle' gives buckle probabilities, 'finish' gives the probability of finishing under `cutoff`
+# temperatures is [high, low]; by default it is looked up from the year in a wserYYYY.csv file name
+def scoreFile(path, modelType='buckle', cutoff=30.0, aidStationNames=None, temperatures=None, output=None):
+    df = readSplitsCsv(path)
+    dashIsMissing = modelType == 'finish'
+    if temperatures is None:
+        try:
+            temperatures = temps[splitsFileYear(path)]
+        except (ValueError, KeyError):
+            print("No race-day temperatures for {}; pass --temps HIGH LOW".format(path))
+            return None
+    fitted = lambda metadata: modelType != 'finish' or any(np.isclose(cutoff, metadata.get('cutoffs', [])))
+    reached = reachedCounts(df, dashIsMissing)
+
+    # Stations and model of every group of runners scored together
+    groups = []
+    if aidStationNames is not None:
+        key = findModel(modelType, aidStationNames, accept=fitted)
+        if key is None:
+            print("No trained {} model for {}; train one with wser-{}-predictor.py first".format(modelType, ", ".join(aidStationNames), modelType))
+            return None
+        groups.append((list(aidStationNames), key, np.arange(len(df))))
+    else:
+        keys = prefixModels(modelType, fitted)
+        if len(keys) == 0:
+            print("No trained {} model for any aid station prefix; train one with wser-{}-predictor.py first".format(modelType, modelType))
+            return None
+        modelFor = np.zeros(len(allAidStations) + 1, dtype=int)        # richest model for each number of stations reached
+        for k in range(1, len(allAidStations) + 1):
+            modelFor[k] = k if k in keys else modelFor[k - 1]
+        prefixes = modelFor[reached]
+        groups = [(allAidStations[0:prefix], keys[prefix], np.flatnonzero(prefixes == prefix)) for prefix in np.unique(prefixes) if prefix > 0]
+
+    # One vectorized feature pass and one predict call per group
+    start = time.perf_counter()
+    scores = df[[column for column in runnerColumns if column in df]].copy()
+    scores['LatestStation'] = [allAidStations[k - 1] if k > 0 else "" for k in reached]
+    scores['ModelStations'] = 0
+    if modelType == 'buckle':
+        probabilities = np.full((len(df), len(buckleNames)), np.nan)
+    else:
+        probabilities = np.full(len(df), np.nan)
+    for stations, key, rows in groups:
+        matrix, _ = frameFeatures(df.iloc[rows], stations, temperatures, dashIsMissing)
+        probabilities[rows] = scoreBuckle(matrix, key) if modelType == 'buckle' else scoreFinish(matrix, key, cutoff)
+        scores.iloc[rows, scores.columns.get_loc('ModelStations')] = len(stations)
+    scored = scores['ModelStations'].to_numpy() > 0
+    if modelType == 'buckle':
+        for i, name in enumerate(buckleNames):
+            scores[name] = probabilities[:, i]
+        scores['Expected'] = np.where(scored, np.array(buckleNames)[np.argmax(np.nan_to_num(probabilities), axis=1)], "")
+    else:
+        scores['Sub{}'.format(cutoff)] = probabilities
+    elapsed = time.perf_counter() - start
+
+    if output is not None:
+        writeScores(scores, output)
+    print("Scored {} runners with {} model(s) in {:.3f} s ({:.0f} runners/s){}".format(
+        scored.sum(), len(groups), elapsed, scored.sum() / max(elapsed, 1e-9),
+        "; {} runners have no split a registered model covers".format((~scored).sum()) if (~scored).any() else ""))
+    return scores
+
+# Usage: python wserBatch.py runners.csv [--finish CUTOFF] [--stations K] [--temps HIGH LOW] [--output scores.csv|scores.parquet]
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    option = lambda name, count=1: arguments[arguments.index(name) + 1:arguments.index(name) + 1 + count] if name in arguments else None
+    path = arguments[0]
+    cutoff = option("--finish")
+    stations = option("--stations")
+    temperatures = option("--temps", 2)
+    output = option("--output")
+    scoreFile(path,
+              modelType='finish' if cutoff else 'buckle',
+              cutoff=float(cutoff[0]) if cutoff else 30.0,
+              aidStationNames=allAidStations[0:int(stations[0])] if stations else None,
+              temperatures=[float(value) for value in temperatures] if temperatures else None,
+              output=output[0] if output else os.path.splitext(os.path.basename(path))[0] + "-scores.csv")
@@ -0,0 +1,88 @@
+### IMPORTS
+import sys
+import time
+import numpy as np
+from wserFeatures import buildFeatures, allAidStations
+from wserLogistic import fitLogistic, predictLogistic, standardCutoffs
+
+### GLOBAL VARIABLES
+cutoffGrid = np.round(np.arange(14.0, 30.0001, 0.25), 2)        # finish times (hours) the distribution is fitted at
+
+### MODEL
+# Fits the conditional distribution of finish time: one logistic model for P(finish < t) at every t on the grid,
+# all solved together by wserLogistic (distribution regression); the result is stored like any wserLogistic model
+def fitDistribution(matrix, finishHours, grid=cutoffGrid):
+    return fitLogistic(matrix, finishHours, np.sort(grid))
+
+# P(finish < t) at every grid point, as a (runners x grid) matrix made non-decreasing in t
+def gridProbabilities(model, matrix):
+    return np.maximum.accumulate(predictLogistic(model, matrix), axis=1)
+
+# P(finish < t) for any cutoffs (hours), interpolated linearly between grid points, as a (runners x cutoffs) matrix
+# cutoffs outside the grid get the probability at the nearest end (nobody finishes under 14 hours or after 30)
+def probabilityUnder(model, matrix, cutoffs):
+    grid = model['cutoffs']
+    probabilities = gridProbabilities(model, matrix)
+    cutoffs = np.clip(np.atleast_1d(np.asarray(cutoffs, dtype=float)), grid[0], grid[-1])
+    upper = np.clip(np.searchsorted(grid, cutoffs), 1, len(grid) - 1)
+    weight = (cutoffs - grid[upper - 1]) / (grid[upper] - grid[upper - 1])
+    return probabilities[:, upper - 1] * (1.0 - weight) + probabilities[:, upper] * weight
+
+# Finish time (hours) at which P(finish < t) reaches q for every runner (the median by default);
+# NaN when the runner is not expected to reach q before the 30 hour cutoff
+def quantileHours(model, matrix, q=0.5):
+    grid = model['cutoffs']
+    probabilities = gridProbabilities(model, matrix)
+    reached = probabilities >= q
+    upper = np.argmax(reached, axis=1)
+    lower = np.maximum(upper - 1, 0)
+    rows = np.arange(len(probabilities))
+    span = probabilities[rows, upper] - probabilities[rows, lower]
+    weight = np.where(span > 0, (q - probabilities[rows, lower]) / np.where(span > 0, span, 1.0), 1.0)
+    hours = np.where(upper == 0, grid[0], grid[lower] + weight * (grid[upper] - grid[lower]))
+    return np.where(reached.any(axis=1), hours, np.nan)
+
+### EVALUATION
+# Accuracy (at the 0.5 threshold) and Brier score of the distribution model at some cutoffs, keyed like wserLogistic.evaluateLogistic
+def evaluateDistribution(model, matrix, finishHours, cutoffs=standardCutoffs):
+    probabilities = probabilityUnder(model, matrix, cutoffs)
+    results = {}
+    for c, cutoff in enumerate(cutoffs):
+        actual = (finishHours < cutoff).astype(float)
+        results[float(cutoff)] = {'accuracy': float(np.mean((probabilities[:, c] >= 0.5) == actual)),
+                                  'brier': float(np.mean((probabilities[:, c] - actual) ** 2))}
+    return results
+
+# Compares the distribution model with separately fitted binary classifiers on the test year, cutoff by cutoff
+# (accuracy at the 0.5 threshold and Brier score), and times both fits
+def compareWithClassifiers(aidStationNames, cutoffs=standardCutoffs, startTrain=2016, endTrain=2023, testYear=2022):
+    input_train, time_train, input_test, time_test = buildFeatures(aidStationNames, startTrain, endTrain, testYear, dashIsMissing=True)
+    start = time.perf_counter()
+    distribution = fitDistribution(input_train, time_train)
+    distributionSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    classifiers = fitLogistic(input_train, time_train, cutoffs)
+    classifierSeconds = time.perf_counter() - start
+
+    fromDistribution = probabilityUnder(distribution, input_test, cutoffs)
+    fromClassifiers = predictLogistic(classifiers, input_test)
+    print("Distribution model: {} grid points in {:.1f} ms; binary classifiers: {} cutoffs in {:.1f} ms".format(
+        len(distribution['cutoffs']), 1000 * distributionSeconds, len(cutoffs), 1000 * classifierSeconds))
+    print("{:>8}  {:>21}  {:>21}".format("cutoff", "distribution acc/Brier", "classifier acc/Brier"))
+    comparison = {}
+    for c, cutoff in enumerate(cutoffs):
+        actual = (time_test < cutoff).astype(float)
+        scores = []
+        for probabilities in (fromDistribution[:, c], fromClassifiers[:, c]):
+            scores.append((np.mean((probabilities >= 0.5) == actual), np.mean((probabilities - actual) ** 2)))
+        comparison[cutoff] = scores
+        print("{:>8}  {:>10.3f} / {:<8.4f}  {:>10.3f} / {:<8.4f}".format(cutoff, scores[0][0], scores[0][1], scores[1][0], scores[1][1]))
+    finishers = time_test < 30.0
+    medians = quantileHours(distribution, input_test[finishers])
+    print("Median predicted finish within 1 hour of actual for {:.1%} of {} finishers".format(
+        np.mean(np.abs(medians - time_test[finishers]) <= 1.0), finishers.sum()))
+    return comparison
+
+# Usage: python wserDistribution.py [K]  (compares on the allAidStations[0:K] feature set, detailed model by default)
+if __name__ == "__main__":
+    compareWithClassifiers(allAidStations[0:int(sys.argv[1]) if len(sys.argv) > 1 else 11])
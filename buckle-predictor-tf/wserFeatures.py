@@ -0,0 +1,156 @@
+### IMPORTS
+import glob
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from wserTimes import parseClockHours, missingHours
+
+### GLOBAL VARIABLES
+moduleDirectory = os.path.dirname(os.path.abspath(__file__))
+splitsDirectory = os.path.join(moduleDirectory, "splits")               # wserYYYY.csv files
+cacheDirectory = os.path.join(moduleDirectory, "feature-cache")         # cached feature matrices (.npz)
+cacheVersion = 2                                                        # bump when the way features are built changes
+
+# Temperature data (high, low) on race day
+temps = {
+    2024: [94, 63],
+    2023: [80, 51],
+    2022: [97, 70],
+    2021: [101, 73],
+    2020: [93, 66],
+    2019: [83, 57],
+    2018: [98, 61],
+    2017: [95, 75],
+    2016: [93, 60],
+    2015: [91, 73],
+    2014: [89, 59],
+    2013: [102, 73],
+    2012: [71, 51],
+    2011: [82, 60],
+    2010: [91, 66]
+}
+
+# Aid stations the models can use, in course order (station-prefix models use allAidStations[0:k])
+allAidStations = ['Lyon Ridge', 'Red Star Ridge', 'Duncan Canyon', 'Robinson Flat', "Miller's Defeat", 'Dusty Corners', "Last Chance", "Devil's Thumb", "El Dorado Creek", "Michigan Bluff", "Foresthill", "Rucky Chucky", "Auburn Lake Trails"]
+
+# Columns that were named differently in some years (aid stations, and the runner columns before 2014)
+columnRenames = {"Devils Thumb": "Devil's Thumb", "Foresthill School": "Foresthill", "Millers Defeat": "Miller's Defeat",
+                 "Rucky Chucky (near)": "Rucky Chucky", "Gen": "Gender", "Elapsed Time": "Time"}
+runnerFeatures = ['Gender', 'Age', 'MinTemp', 'MaxTemp']               # features ahead of the aid station splits
+featureArrays = ['input_train', 'time_train', 'input_test', 'time_test']
+
+### FUNCTIONS
+# Years used for training (the test year and 2020, when the race was cancelled, are left out)
+def trainingYears(startTrain, endTrain, testYear):
+    return [year for year in range(startTrain, endTrain + 1) if year != testYear and year != 2020]
+
+# Path of one year's splits file
+def splitsPath(year, directory=splitsDirectory):
+    return os.path.join(directory, f"wser{year}.csv")
+
+# Column names of a feature matrix
+def featureNames(aidStationNames):
+    return runnerFeatures + list(aidStationNames)
+
+# SHA-256 of a file's content
+def fileHash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as dataFile:
+        for block in iter(lambda: dataFile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Cache key: everything the feature matrices depend on, including the content of every source file
+def featureKey(years, aidStationNames, testYear, dashIsMissing=False, directory=splitsDirectory):
+    sourceYears = years + [testYear]
+    description = {
+        "version": cacheVersion,
+        "years": years,
+        "stations": list(aidStationNames),
+        "testYear": testYear,
+        "dashIsMissing": dashIsMissing,
+        "temps": {str(year): temps[year] for year in sourceYears},
+        "files": {str(year): fileHash(splitsPath(year, directory)) for year in sourceYears}
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+# Builds a feature matrix (one row per runner) and finish times in hours from a splits dataframe
+# missing splits and DNFs are 30 hours, as in getHours; temperatures is [high, low]
+# elapsed times written on a 12-hour clock (2017, 2018) are read as 24-hour times and moved past midnight
+# when they fall before the runner's previous split
+def frameFeatures(df, aidStationNames, temperatures, dashIsMissing=False):
+    df = df.rename(columns=columnRenames)
+    matrix = np.empty((len(df), len(runnerFeatures) + len(aidStationNames)))
+    matrix[:, 0] = (df['Gender'] == 'M').astype(float)
+    matrix[:, 1] = df['Age']
+    matrix[:, 2] = temperatures[1]
+    matrix[:, 3] = temperatures[0]
+    previous = np.zeros(len(df))
+    for j, column in enumerate(list(aidStationNames) + ['Time']):
+        if column in df:
+            hours, isClock, isMissing = parseClockHours(df[column], dashIsMissing=dashIsMissing)
+            hours = hours + 24.0 * (isClock & (hours < previous))
+            previous = np.where(isMissing, previous, hours)
+        else:
+            hours = np.full(len(df), missingHours)
+        if column == 'Time':
+            return matrix, hours
+        matrix[:, len(runnerFeatures) + j] = hours
+
+# Reads a splits file, keeping only runner rows (some older files have blank rows and a repeated header row)
+def readSplitsCsv(path):
+    df = pd.read_csv(path).rename(columns=columnRenames)
+    df = df[df['Gender'].isin(['M', 'F'])].reset_index(drop=True)
+    df['Age'] = pd.to_numeric(df['Age'])
+    return df
+
+# Reads one year's splits file (runner rows only)
+def readSplits(year, directory=splitsDirectory):
+    return readSplitsCsv(splitsPath(year, directory))
+
+# Reads one year's splits file into a feature matrix and finish times
+def yearFeatures(year, aidStationNames, dashIsMissing=False, directory=splitsDirectory):
+    return frameFeatures(readSplits(year, directory), aidStationNames, temps[year], dashIsMissing)
+
+# Builds the training and test feature matrices, or loads them from the cache when nothing they depend on has changed
+# returns input_train, time_train, input_test, time_test (columns of the inputs are featureNames(aidStationNames))
+def buildFeatures(aidStationNames, startTrain=2016, endTrain=2023, testYear=2022, dashIsMissing=False,
+                  directory=splitsDirectory, cache=True):
+    start = time.perf_counter()
+    years = trainingYears(startTrain, endTrain, testYear)
+    cachePath = os.path.join(cacheDirectory, "features-{}.npz".format(featureKey(years, aidStationNames, testYear, dashIsMissing, directory)[:24]))
+    if cache and os.path.exists(cachePath):
+        with np.load(cachePath) as cached:
+            arrays = tuple(cached[name] for name in featureArrays)
+        print("Loaded features from cache in {:.1f} ms".format(1000 * (time.perf_counter() - start)))
+        return arrays
+
+    training = [yearFeatures(year, aidStationNames, dashIsMissing, directory) for year in years]
+    input_train = np.concatenate([matrix for matrix, _ in training])
+    time_train = np.concatenate([finish for _, finish in training])
+    input_test, time_test = yearFeatures(testYear, aidStationNames, dashIsMissing, directory)
+    arrays = (input_train, time_train, input_test, time_test)
+    if cache:
+        os.makedirs(cacheDirectory, exist_ok=True)
+        partialPath = cachePath + ".partial"
+        with open(partialPath, 'wb') as cacheFile:          # written under another name first so a crash never leaves a broken cache
+            np.savez(cacheFile, **dict(zip(featureArrays, arrays)))
+        os.replace(partialPath, cachePath)
+    print("Built features for {} training years in {:.1f} ms".format(len(years), 1000 * (time.perf_counter() - start)))
+    return arrays
+
+# Deletes every cached feature matrix
+def clearFeatureCache():
+    for path in glob.glob(os.path.join(cacheDirectory, "features-*.npz")):
+        os.remove(path)
+
+# Usage: python wserFeatures.py (builds the detailed model's features twice: once from CSV, once from the cache)
+if __name__ == "__main__":
+    stations = allAidStations[0:11]
+    clearFeatureCache()
+    built = buildFeatures(stations)
+    loaded = buildFeatures(stations)
+    print("Cache matches: {}".format(all(np.array_equal(a, b) for a, b in zip(built, loaded))))
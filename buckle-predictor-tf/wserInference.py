@@ -0,0 +1,141 @@
+### IMPORTS
+import json
+import os
+import sys
+import time
+import numpy as np
+from wserModels import entryDirectory, isRegistered, listModels, loadModel, saveWeights
+
+### GLOBAL VARIABLES
+weightsFile = "weights.npz"         # written by wserModels.saveWeights next to the Keras model
+
+### MODELS
+# NumPy stand-in for the buckle model's Dense(relu) -> ... -> Dense stack; predict() returns logits like model.predict
+class DenseModel:
+    def __init__(self, kernels, biases):
+        self.kernels = kernels
+        self.biases = biases
+
+    def predict(self, matrix, batch_size=None, verbose=0):
+        values = np.asarray(matrix, dtype=float)
+        for layer, (kernel, bias) in enumerate(zip(self.kernels, self.biases)):
+            values = values @ kernel + bias
+            if layer < len(self.kernels) - 1:
+                values = np.maximum(values, 0.0)
+        return values
+
+# NumPy stand-in for the fitted StandardScaler (transform only)
+class Standardizer:
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+
+    def transform(self, matrix):
+        return (np.asarray(matrix, dtype=float) - self.mean_) / self.scale_
+
+# Wraps a model so predict() returns probabilities (the NumPy counterpart of Sequential([model, Softmax()]))
+class SoftmaxModel:
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, matrix, batch_size=None, verbose=0):
+        return softmax(self.model.predict(matrix))
+
+### FUNCTIONS
+# Row-wise softmax of a logits matrix
+def softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    probabilities = np.exp(logits)
+    return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+# Path of a registered model's exported weights
+def weightsPath(key):
+    return os.path.join(entryDirectory(key), weightsFile)
+
+# Checks whether a registered model can be scored without TensorFlow
+def hasWeights(key):
+    return isRegistered(key) and os.path.exists(weightsPath(key))
+
+# Loads exported weights as (DenseModel, Standardizer, metadata)
+def loadNumpyModel(key):
+    with np.load(weightsPath(key)) as arrays:
+        layers = len([name for name in arrays.files if name.startswith("kernel_")])
+        model = DenseModel([arrays['kernel_{}'.format(layer)] for layer in range(layers)],
+                           [arrays['bias_{}'.format(layer)] for layer in range(layers)])
+        scaler = Standardizer(arrays['mean'], arrays['scale'])
+    return model, scaler, readMetadata(key)
+
+# Metadata of a registered model, without loading the model itself
+def readMetadata(key):
+    with open(os.path.join(entryDirectory(key), "metadata.json")) as metadataFile:
+        return json.load(metadataFile)
+
+# Loads a registered buckle model for scoring: the NumPy engine if its weights were exported, Keras otherwise
+def loadBuckleModel(key):
+    if hasWeights(key):
+        return loadNumpyModel(key)
+    return loadModel(key)
+
+# Buckle probabilities (silver, bronze, no buckle) for one runner's feature vector or a matrix of runners
+def predictBuckle(model, scaler, features):
+    matrix = np.atleast_2d(features)
+    probabilities = softmax(model.predict(scaler.transform(matrix)))
+    return probabilities[0] if np.ndim(features) == 1 else probabilities
+
+### EXPORT AND CHECKS (these need TensorFlow)
+# Exports the weights of registered Keras models that were saved before weights were written alongside them
+def exportWeights():
+    for metadata in listModels():
+        key = metadata['key']
+        if key.startswith("buckle-") and not hasWeights(key):
+            model, scaler, _ = loadModel(key)
+            saveWeights(key, model.get_weights(), scaler)
+            print("Exported {}".format(key))
+
+# Compares Keras and NumPy probabilities for every exported buckle model on its test year
+def checkWeights(tolerance=1e-5):
+    from wserFeatures import buildFeatures
+    matches = True
+    for metadata in listModels():
+        key = metadata['key']
+        if key.startswith("buckle-") and hasWeights(key):
+            _, _, input_test, _ = buildFeatures(metadata['stations'], metadata.get('startTrain', 2016), metadata.get('endTrain', 2023), metadata.get('testYear', 2022))
+            kerasModel, kerasScaler, _ = loadModel(key)
+            expected = softmax(kerasModel.predict(kerasScaler.transform(input_test), verbose=0))
+            model, scaler, _ = loadNumpyModel(key)
+            actual = predictBuckle(model, scaler, input_test)
+            difference = np.abs(expected - actual).max()
+            matches = matches and difference <= tolerance
+            print("{}: max probability difference {:.2e} over {} runners".format(key, difference, len(input_test)))
+    return matches
+
+### BENCHMARK
+# Times loading an exported model and scoring single runners and a whole test year with the NumPy engine
+def benchmarkInference(key, matrix, repeats=1000):
+    start = time.perf_counter()
+    model, scaler, _ = loadNumpyModel(key)
+    loadSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(repeats):
+        predictBuckle(model, scaler, matrix[i % len(matrix)])
+    runnerSeconds = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats // 10):
+        predictBuckle(model, scaler, matrix)
+    batchSeconds = (time.perf_counter() - start) / (repeats // 10)
+    print("Load {:.2f} ms, one runner {:.1f} us, {} runners {:.3f} ms ({:.0f} runners/s)".format(
+        1000 * loadSeconds, 1e6 * runnerSeconds, len(matrix), 1000 * batchSeconds, len(matrix) / batchSeconds))
+    return loadSeconds, runnerSeconds, batchSeconds
+
+# Usage: python wserInference.py [--export] [--check] [--benchmark]
+if __name__ == "__main__":
+    if "--export" in sys.argv:
+        exportWeights()
+    if "--check" in sys.argv:
+        print("NumPy engine matches Keras: {}".format(checkWeights()))
+    if "--benchmark" in sys.argv:
+        from wserFeatures import buildFeatures
+        for metadata in listModels():
+            if metadata['key'].startswith("buckle-") and hasWeights(metadata['key']):
+                print(metadata['key'])
+                benchmarkInference(metadata['key'], buildFeatures(metadata['stations'])[2])
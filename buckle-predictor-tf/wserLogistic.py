@@ -0,0 +1,125 @@
+### IMPORTS
+import os
+import sys
+import time
+import numpy as np
+from wserFeatures import buildFeatures, allAidStations
+from wserModels import entryDirectory
+
+### GLOBAL VARIABLES
+standardCutoffs = [30.0, 24.0, 14.15, 15.48]        # bronze buckle, silver buckle, M1 and F1 course records
+logisticFile = "logistic.npz"
+
+### MODEL
+# Design matrix for feature matrices from wserFeatures, laid out like the estimator's linear model:
+# a bias column, one-hot Gender (M, F), then the standardized numeric columns
+def designMatrix(matrix, mean, scale):
+    gender = matrix[:, 0:1]
+    return np.hstack([np.ones_like(gender), gender, 1.0 - gender, (matrix[:, 1:] - mean) / scale])
+
+# Fits one logistic model per cutoff (label: finish time under the cutoff) with full-batch IRLS (Newton's method)
+# all cutoffs are solved together: one batched (cutoffs x features x features) Newton solve per iteration
+# a small ridge penalty keeps the solve well-posed when a feature separates the classes (i.e. no woman under a
+# course-record cutoff) and resolves the one-hot Gender columns against the bias
+def fitLogistic(matrix, finishHours, cutoffs=standardCutoffs, ridge=1e-3, iterations=50, tolerance=1e-8):
+    cutoffs = np.atleast_1d(np.asarray(cutoffs, dtype=float))
+    mean = matrix[:, 1:].mean(axis=0)
+    scale = matrix[:, 1:].std(axis=0)
+    scale[scale == 0] = 1.0
+    X = designMatrix(matrix, mean, scale)
+    labels = (finishHours[:, None] < cutoffs[None, :]).astype(float)             # rows x cutoffs
+    coefficients = np.zeros((len(cutoffs), X.shape[1]))
+
+    # A cutoff nobody (or everybody) in the training data beat has no decision boundary: it gets a constant,
+    # smoothed probability and stays out of the Newton iterations
+    positives = labels.sum(axis=0)
+    active = (positives > 0) & (positives < len(X))
+    constant = np.log((positives + 0.5) / (len(X) - positives + 0.5))
+    coefficients[~active, 0] = constant[~active]
+
+    penalty = ridge * len(X) * np.diag(np.r_[0.0, np.ones(X.shape[1] - 1)])       # every weight but the bias is penalized
+    fitted = coefficients[active]
+    iteration = 0
+    for iteration in range(iterations if active.any() else 0):
+        probabilities = 1.0 / (1.0 + np.exp(-np.clip(X @ fitted.T, -500, 500)))
+        weights = np.maximum(probabilities * (1.0 - probabilities), 1e-10)
+        gradient = (labels[:, active] - probabilities).T @ X - fitted @ penalty
+        hessian = np.stack([(X * weights[:, c:c + 1]).T @ X for c in range(len(fitted))]) + penalty
+        step = np.linalg.solve(hessian, gradient[:, :, None])[:, :, 0]
+        fitted = fitted + step
+        if np.abs(step).max() < tolerance:
+            break
+    coefficients[active] = fitted
+    return {'cutoffs': cutoffs, 'coefficients': coefficients, 'mean': mean, 'scale': scale, 'iterations': iteration + 1}
+
+# Probability of finishing under each cutoff, as a (runners x cutoffs) matrix (a single feature vector gives one row)
+def predictLogistic(model, matrix):
+    X = designMatrix(np.atleast_2d(np.asarray(matrix, dtype=float)), model['mean'], model['scale'])
+    return 1.0 / (1.0 + np.exp(-np.clip(X @ model['coefficients'].T, -500, 500)))
+
+# Column of a model's probability matrix for one cutoff
+def cutoffColumn(model, cutoff):
+    matches = np.flatnonzero(np.isclose(model['cutoffs'], cutoff))
+    if len(matches) == 0:
+        raise ValueError("Model was not fitted for a {} hour cutoff (fitted: {})".format(cutoff, list(model['cutoffs'])))
+    return matches[0]
+
+# Accuracy and row-normalized confusion matrix (rows: actual over/under, columns: predicted) for every cutoff
+def evaluateLogistic(model, matrix, finishHours):
+    probabilities = predictLogistic(model, matrix)
+    results = {}
+    for c, cutoff in enumerate(model['cutoffs']):
+        actual = (finishHours < cutoff).astype(int)
+        predicted = (probabilities[:, c] >= 0.5).astype(int)
+        counts = np.zeros((2, 2))
+        np.add.at(counts, (actual, predicted), 1)
+        results[float(cutoff)] = {'accuracy': float(np.mean(actual == predicted)),
+                                  'confusionMatrix': (counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)).tolist()}
+    return results
+
+### REGISTRY
+# Saves a fitted model into a registry entry
+def saveLogistic(key, model):
+    os.makedirs(entryDirectory(key), exist_ok=True)
+    np.savez(os.path.join(entryDirectory(key), logisticFile), cutoffs=model['cutoffs'], coefficients=model['coefficients'],
+             mean=model['mean'], scale=model['scale'])
+
+# Checks whether a registry entry holds a fitted logistic model
+def hasLogistic(key):
+    return os.path.exists(os.path.join(entryDirectory(key), logisticFile))
+
+# Loads a fitted model from a registry entry
+def loadLogistic(key):
+    with np.load(os.path.join(entryDirectory(key), logisticFile)) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+### BENCHMARK
+# Fits every standard cutoff in one call and reports time and test-year accuracy (against sklearn's solver if installed)
+def benchmarkLogistic(aidStationNames, cutoffs=standardCutoffs, repeats=20):
+    input_train, time_train, input_test, time_test = buildFeatures(aidStationNames, dashIsMissing=True)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model = fitLogistic(input_train, time_train, cutoffs)
+    elapsed = (time.perf_counter() - start) / repeats
+    print("IRLS: {} cutoffs on {} runners in {:.1f} ms ({} iterations)".format(len(cutoffs), len(input_train), 1000 * elapsed, model['iterations']))
+    results = evaluateLogistic(model, input_test, time_test)
+    try:
+        from sklearn.linear_model import LogisticRegression
+    except ImportError:
+        LogisticRegression = None
+    for c, cutoff in enumerate(model['cutoffs']):
+        line = "  Sub-{:<6} accuracy {:.3f}".format(cutoff, results[float(cutoff)]['accuracy'])
+        if LogisticRegression is not None and 0 < np.sum(time_train < cutoff) < len(time_train):
+            X = designMatrix(input_train, model['mean'], model['scale'])
+            X[:, 0] *= 1e3                # sklearn penalizes every column: scale the bias column so its penalty vanishes
+            reference = LogisticRegression(C=1.0 / (1e-3 * len(X)), fit_intercept=False, max_iter=20000).fit(X, time_train < cutoff)
+            test = designMatrix(input_test, model['mean'], model['scale'])
+            test[:, 0] *= 1e3
+            agreement = np.mean(reference.predict(test) == (predictLogistic(model, input_test)[:, c] >= 0.5))
+            line += ", agrees with sklearn on {:.1%} of test runners".format(agreement)
+        print(line)
+    return model, results
+
+# Usage: python wserLogistic.py [K]  (benchmarks the allAidStations[0:K] feature set, detailed model by default)
+if __name__ == "__main__":
+    benchmarkLogistic(allAidStations[0:int(sys.argv[1]) if len(sys.argv) > 1 else 11])
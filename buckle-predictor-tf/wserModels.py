@@ -0,0 +1,109 @@
+### IMPORTS
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+import numpy as np
+from wserFeatures import featureKey, trainingYears, moduleDirectory
+
+### GLOBAL VARIABLES
+registryDirectory = os.path.join(moduleDirectory, "model-registry")     # one sub-directory per trained model
+registryVersion = 1                                                     # bump when saved models stop being compatible
+
+### FUNCTIONS
+# Registry key: model type and configuration (neurons, epochs, cutoff, ...) plus the feature key,
+# which already covers the training years, aid station list, test year and the hash of every splits file
+def modelKey(modelType, aidStationNames, startTrain=2016, endTrain=2023, testYear=2022, dashIsMissing=False, **config):
+    years = trainingYears(startTrain, endTrain, testYear)
+    description = {
+        "version": registryVersion,
+        "modelType": modelType,
+        "config": config,
+        "features": featureKey(years, aidStationNames, testYear, dashIsMissing)
+    }
+    return "{}-{}".format(modelType, hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:24])
+
+# Directory holding one registered model
+def entryDirectory(key):
+    return os.path.join(registryDirectory, key)
+
+# Checks whether a trained model is registered under a key
+def isRegistered(key):
+    return os.path.exists(os.path.join(entryDirectory(key), "metadata.json"))
+
+# Saves a trained model: the Keras model, the fitted scaler and metadata (stations, features, accuracy, ...)
+# models that write their own files into entryDirectory(key) (i.e. wserLogistic) only pass metadata
+def saveModel(key, metadata, model=None, scaler=None):
+    directory = entryDirectory(key)
+    os.makedirs(directory, exist_ok=True)
+    if model is not None:
+        model.save(os.path.join(directory, "model.keras"))
+    if scaler is not None:
+        with open(os.path.join(directory, "scaler.pkl"), 'wb') as scalerFile:
+            pickle.dump(scaler, scalerFile)
+    if model is not None and scaler is not None:
+        saveWeights(key, model.get_weights(), scaler)
+    metadata = dict(metadata, key=key, savedAt=time.strftime("%Y-%m-%d %H:%M:%S"))
+    with open(os.path.join(directory, "metadata.json"), 'w') as metadataFile:      # written last: marks the entry complete
+        json.dump(metadata, metadataFile, indent=2)
+
+# Writes dense-layer weights (kernel, bias per layer) and the scaler's mean/scale as plain arrays,
+# so wserInference can score the model without TensorFlow
+def saveWeights(key, weights, scaler):
+    arrays = {'mean': scaler.mean_, 'scale': scaler.scale_}
+    for layer in range(0, len(weights) // 2):
+        arrays['kernel_{}'.format(layer)] = weights[2 * layer]
+        arrays['bias_{}'.format(layer)] = weights[2 * layer + 1]
+    np.savez(os.path.join(entryDirectory(key), "weights.npz"), **arrays)
+
+# Loads a registered model as (model, scaler, metadata); model and scaler are None if the entry has none
+def loadModel(key):
+    directory = entryDirectory(key)
+    with open(os.path.join(directory, "metadata.json")) as metadataFile:
+        metadata = json.load(metadataFile)
+    model = None
+    if os.path.exists(os.path.join(directory, "model.keras")):
+        import tensorflow as tf
+        model = tf.keras.models.load_model(os.path.join(directory, "model.keras"))
+    scaler = None
+    if os.path.exists(os.path.join(directory, "scaler.pkl")):
+        with open(os.path.join(directory, "scaler.pkl"), 'rb') as scalerFile:
+            scaler = pickle.load(scalerFile)
+    return model, scaler, metadata
+
+# Deletes a registered model (i.e. before retraining it)
+def removeModel(key):
+    shutil.rmtree(entryDirectory(key), ignore_errors=True)
+
+# Metadata of every registered model
+def listModels():
+    models = []
+    if os.path.isdir(registryDirectory):
+        for key in sorted(os.listdir(registryDirectory)):
+            if isRegistered(key):
+                with open(os.path.join(entryDirectory(key), "metadata.json")) as metadataFile:
+                    models.append(json.load(metadataFile))
+    return models
+
+# Key of the newest registered model of a type trained on exactly these aid stations, with matching metadata values
+# (i.e. neurons=11) and accepted by an optional test on its metadata; None if there is none
+def findModel(modelType, aidStationNames, accept=None, **details):
+    matches = [metadata for metadata in listModels()
+               if metadata['key'].startswith(modelType + "-") and metadata['stations'] == list(aidStationNames)
+               and all(metadata.get(name) == value for name, value in details.items())
+               and (accept is None or accept(metadata))]
+    return max(matches, key=lambda metadata: metadata['savedAt'])['key'] if matches else None
+
+# Usage: python wserModels.py [--clear]
+if __name__ == "__main__":
+    if "--clear" in sys.argv:
+        shutil.rmtree(registryDirectory, ignore_errors=True)
+    for metadata in listModels():
+        if 'results' in metadata:         # one accuracy per cutoff
+            accuracy = ", ".join("sub-{} {:.3f}".format(cutoff, result['accuracy']) for cutoff, result in metadata['results'].items())
+        else:
+            accuracy = "{:.3f}".format(metadata['accuracy'])
+        print("{}  {}  stations: {}  accuracy: {}".format(metadata['key'], metadata['savedAt'], ", ".join(metadata['stations']), accuracy))
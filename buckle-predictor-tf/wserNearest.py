@@ -0,0 +1,236 @@
+### IMPORTS
+import hashlib
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from wserFeatures import temps, moduleDirectory
+from wserSplitMatrix import openArchive, stationMiles, splitsDirectory, archiveDirectory
+
+### GLOBAL VARIABLES
+indexDirectory = os.path.join(moduleDirectory, "nearest-index")        # saved indexes (.npz), one per archive content
+indexVersion = 2                                                        # bump when the index is built differently
+splitStations = [station for station in stationMiles if station != 'Finish']   # stations a partial split vector can cover
+attributeColumns = ['gender', 'age', 'maxTemp', 'minTemp']
+indexArrays = ['features', 'present', 'mean', 'scale', 'finishHours', 'year', 'bib', 'name', 'age']
+attributeWeight = 0.5           # weight of each runner/weather attribute relative to one station's split in the distance
+buckleOutcomes = [(24.0, 'silver'), (30.0, 'bronze')]                   # finish under these hours; anything else is 'no buckle'
+loadedIndexes = {}              # index path -> arrays, kept after the first load
+
+### INDEX
+# Index key: the version plus the source hash of every year's split matrix and the race-day temperatures used
+def indexKey(archive):
+    description = {
+        "version": indexVersion,
+        "years": {str(year): matrix.source.get('sha256') for year, matrix in archive.items()},
+        "temps": {str(year): temps[year] for year in archive}
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+# Builds the index arrays from split matrices (years without race-day temperatures and runners who are not M/F are left out)
+# features: elapsed hours at every split station then the attributes, standardized over the archive (0 where missing)
+# age: each runner's age as in the split matrix (-1 where missing), for reporting
+def buildIndex(archive):
+    columns, present, finishHours, years, bibs, names, ages = [], [], [], [], [], [], []
+    for year, matrix in sorted(archive.items()):
+        if year not in temps:
+            continue
+        rows = np.flatnonzero(np.isin(matrix.runners.gender, ['M', 'F']))
+        hours = matrix.hours(rows)
+        age = np.asarray(matrix.runners.age[rows], dtype=float)
+        attributes = np.column_stack([matrix.runners.gender[rows] == 'M', np.where(age < 0, np.nan, age),
+                                      np.full(len(rows), temps[year][0]), np.full(len(rows), temps[year][1])])
+        yearColumns = np.column_stack([hours[:, [matrix.station(station) for station in splitStations]], attributes])
+        columns.append(yearColumns)
+        present.append(~np.isnan(yearColumns))
+        finishHours.append(hours[:, matrix.station('Finish')])
+        years.append(np.full(len(rows), year, dtype=np.int16))
+        bibs.append(np.asarray(matrix.runners.bib[rows]))
+        ages.append(np.asarray(matrix.runners.age[rows], dtype=np.int16))
+        names.append(np.char.add(np.char.add(np.asarray(matrix.runners.firstName[rows]), " "), np.asarray(matrix.runners.lastName[rows])))
+    columns = np.concatenate(columns)
+    mean = np.nanmean(columns, axis=0)
+    scale = np.nanstd(columns, axis=0)
+    scale = np.where(scale > 0, scale, 1.0)
+    features = np.nan_to_num((columns - mean) / scale).astype(np.float32)
+    return {'features': features, 'present': np.concatenate(present), 'mean': mean, 'scale': scale,
+            'finishHours': np.concatenate(finishHours).astype(np.float32), 'year': np.concatenate(years),
+            'bib': np.concatenate(bibs).astype(str), 'name': np.concatenate(names).astype(str), 'age': np.concatenate(ages)}
+
+# Adds what queries compute with: the features column by column (a query reads only the columns it uses, each one
+# contiguous) and one presence bit per column for every runner
+def prepareIndex(index):
+    index['columns'] = np.ascontiguousarray(index['features'].T)
+    index['presentBits'] = index['present'].astype(np.int64) @ (1 << np.arange(index['present'].shape[1], dtype=np.int64))
+    return index
+
+# Loads the index for the current archive, building and saving it when the archive changed since it was last built
+# splits/archive: where the splits files and their split matrices are (i.e. a synthetic archive)
+def loadIndex(splits=splitsDirectory, archive=archiveDirectory, directory=indexDirectory):
+    start = time.perf_counter()
+    matrices = openArchive(splits=splits, directory=archive)
+    path = os.path.join(directory, "index-{}.npz".format(indexKey(matrices)[:24]))
+    if path in loadedIndexes:
+        return loadedIndexes[path]
+    if os.path.exists(path):
+        with np.load(path) as saved:
+            index = prepareIndex({name: saved[name] for name in indexArrays})
+        print("Loaded nearest-runner index ({} runners) in {:.1f} ms".format(len(index['year']), 1000 * (time.perf_counter() - start)))
+    else:
+        index = buildIndex(matrices)
+        os.makedirs(directory, exist_ok=True)
+        partialPath = path + ".partial"
+        with open(partialPath, 'wb') as indexFile:          # written under another name first so a crash never leaves a broken index
+            np.savez(indexFile, **index)
+        os.replace(partialPath, path)
+        prepareIndex(index)
+        print("Built nearest-runner index ({} runners) in {:.1f} ms".format(len(index['year']), 1000 * (time.perf_counter() - start)))
+    loadedIndexes[path] = index
+    return index
+
+### QUERIES
+# Elapsed hours from "h:mm:ss"/"h:mm" strings or numbers of hours (None or "" = no split)
+def splitHours(value):
+    if value is None or (isinstance(value, str) and value.strip() in ("", "--:--")):
+        return np.nan
+    if isinstance(value, str):
+        parts = [float(part) for part in value.strip().split(":")]
+        return parts[0] + parts[1] / 60.0 + (parts[2] / 3600.0 if len(parts) > 2 else 0.0)
+    return float(value)
+
+# Buckle a finish time earned ('silver', 'bronze' or 'no buckle' for a DNF)
+def outcome(finishHours):
+    for limit, name in buckleOutcomes:
+        if finishHours < limit:
+            return name
+    return 'no buckle'
+
+# The k historical runners whose pacing is most like a partial split vector, nearest first
+# splits: elapsed times in course order from Lyon Ridge (a prefix; None for a station without a split), or
+#         {station: time} with splitStations names; gender ('M'/'F'), age and temperatures ([high, low]) are optional
+#         and only count when given
+# Distance: root mean square difference over the given columns in archive standard deviations (attributes weighted by
+# attributeWeight); only runners with a split at every given station are compared. exclude: (year, bib) to leave out
+# Raises ValueError when the query gives nothing to compare (no split, gender, age or temperatures)
+def similarRunners(splits, gender=None, age=None, temperatures=None, k=10, index=None, exclude=None, weight=attributeWeight):
+    index = loadIndex() if index is None else index
+    query = np.full(len(splitStations) + len(attributeColumns), np.nan)
+    if isinstance(splits, dict):
+        for station, value in splits.items():
+            query[splitStations.index(station)] = splitHours(value)
+    else:
+        query[:len(splits)] = [splitHours(value) for value in splits]
+    query[len(splitStations):] = [np.nan if gender is None else float(gender == 'M'), np.nan if age is None else age,
+                                  np.nan if temperatures is None else temperatures[0], np.nan if temperatures is None else temperatures[1]]
+    used = ~np.isnan(query)
+    if not used.any():
+        raise ValueError("Nothing to compare: give at least one split, the gender, the age or the temperatures")
+    weights = np.where(used, 1.0, 0.0)
+    weights[len(splitStations):] *= weight
+    weights = weights / weights.sum()
+    target = (query - index['mean']) / index['scale']
+
+    # Weighted squared distance accumulated one used column at a time, in place
+    squaredDistance = np.zeros(len(index['year']), dtype=np.float32)
+    buffer = np.empty(len(index['year']), dtype=np.float32)
+    for column in np.flatnonzero(used):
+        np.subtract(index['columns'][column], np.float32(target[column]), out=buffer)
+        np.multiply(buffer, buffer, out=buffer)
+        np.multiply(buffer, np.float32(weights[column]), out=buffer)
+        np.add(squaredDistance, buffer, out=squaredDistance)
+    distance = np.sqrt(squaredDistance)
+    usedBits = int(used.astype(np.int64) @ (1 << np.arange(len(used), dtype=np.int64)))
+    comparable = (index['presentBits'] & usedBits) == usedBits
+    if exclude is not None:
+        comparable &= ~((index['year'] == exclude[0]) & (index['bib'] == str(exclude[1])))
+    distance = np.where(comparable, distance, np.inf)
+    k = min(k, int(comparable.sum()))
+    nearest = np.argpartition(distance, k - 1)[:k] if k > 0 else np.empty(0, dtype=int)
+    nearest = nearest[np.argsort(distance[nearest])]
+
+    finishHours = index['finishHours'][nearest].astype(float)
+    runners = pd.DataFrame({'year': index['year'][nearest], 'bib': index['bib'][nearest], 'name': index['name'][nearest],
+                            'gender': np.where(index['features'][nearest, len(splitStations)] * index['scale'][len(splitStations)]
+                                               + index['mean'][len(splitStations)] > 0.5, 'M', 'F'),
+                            'age': pd.array([int(age) if age >= 0 else None for age in index['age'][nearest]], dtype='Int64'),
+                            'distance': distance[nearest], 'finishHours': finishHours})
+    runners['outcome'] = [outcome(hours) if not np.isnan(hours) else 'no buckle' for hours in finishHours]
+    return runners
+
+# One-line summary of how the neighbours finished
+def summarize(runners):
+    finished = runners['finishHours'].dropna()
+    counts = runners['outcome'].value_counts()
+    return "{} similar runners: {} silver, {} bronze, {} no buckle; median finish {}".format(
+        len(runners), counts.get('silver', 0), counts.get('bronze', 0), counts.get('no buckle', 0),
+        "{:.2f} h".format(finished.median()) if len(finished) > 0 else "n/a")
+
+# A historical runner's own query: their splits through a station plus gender, age and race-day temperatures
+def runnerQuery(index, year, bib, through):
+    row = np.flatnonzero((index['year'] == year) & (index['bib'] == str(bib)))
+    if len(row) == 0:
+        return None
+    values = index['features'][row[0]] * index['scale'] + index['mean']
+    values = np.where(index['present'][row[0]], values, np.nan)
+    stop = splitStations.index(through) + 1
+    return {'splits': [None if np.isnan(value) else value for value in values[:stop]],
+            'gender': 'M' if values[len(splitStations)] > 0.5 else 'F', 'age': int(index['age'][row[0]]) if index['age'][row[0]] >= 0 else None,
+            'temperatures': [values[len(splitStations) + 2], values[len(splitStations) + 3]]}
+
+### BENCHMARK
+# Query latency through each station, over the archive's index repeated (with jitter) up to `count` runners
+def benchmarkQueries(count=None, repeats=200, seed=0):
+    index = loadIndex()
+    if count is not None and count > len(index['year']):
+        generator = np.random.default_rng(seed)
+        copies = int(np.ceil(count / len(index['year'])))
+        index = {name: np.concatenate([values] * copies)[:count] if values.ndim > 0 and len(values) == len(index['year']) else values
+                 for name, values in index.items()}
+        index['features'] = index['features'] + generator.normal(0, 0.05, index['features'].shape).astype(np.float32)
+        index = prepareIndex(index)
+    generator = np.random.default_rng(seed + 1)
+    picks = generator.integers(0, len(index['year']), size=repeats)
+    print("{} runners in the index".format(len(index['year'])))
+    for through in ['RobinsonFlat', 'MichiganBluff', 'RuckyChucky', 'RobiePoint']:
+        queries = [runnerQuery(index, index['year'][i], index['bib'][i], through) for i in picks[:20]]
+        seconds = []
+        for query in queries * (repeats // len(queries)):
+            start = time.perf_counter()
+            similarRunners(query['splits'], query['gender'], query['age'], query['temperatures'], index=index)
+            seconds.append(time.perf_counter() - start)
+        print("through {:<14} median {:>7.2f} ms  p99 {:>7.2f} ms".format(through, 1000 * np.median(seconds), 1000 * np.percentile(seconds, 99)))
+
+# Usage: python wserNearest.py --runner YEAR BIB [--through STATION] [--k 10]   (runners like a historical runner, themselves left out)
+#        python wserNearest.py GENDER AGE TIME [TIME ...] [--temps HIGH LOW] [--k 10]   (splits in course order from Lyon Ridge)
+#        python wserNearest.py --benchmark [RUNNERS]
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    option = lambda name, count=1: arguments[arguments.index(name) + 1:arguments.index(name) + 1 + count] if name in arguments else None
+    k = int(option("--k")[0]) if option("--k") else 10
+    if "--benchmark" in arguments:
+        count = option("--benchmark")
+        benchmarkQueries(int(count[0]) if count and count[0].isdigit() else None)
+    elif "--runner" in arguments:
+        year, bib = option("--runner", 2)
+        through = option("--through")[0] if option("--through") else 'MichiganBluff'
+        index = loadIndex()
+        query = runnerQuery(index, int(year), bib, through)
+        if query is None:
+            print("No runner with bib {} in {}".format(bib, year))
+            sys.exit(1)
+        runners = similarRunners(query['splits'], query['gender'], query['age'], query['temperatures'], k, index, exclude=(int(year), bib))
+        print(runners.round(3).to_string(index=False))
+        print(summarize(runners))
+    else:
+        temperatures = [float(value) for value in option("--temps", 2)] if option("--temps") else None
+        flagged = {"--k", "--temps"}
+        values = [value for i, value in enumerate(arguments) if value not in flagged and not any(
+            arguments[j] in flagged and i - j <= (2 if arguments[j] == "--temps" else 1) for j in range(max(0, i - 2), i))]
+        if len(values) < 3:
+            print("Usage: python wserNearest.py GENDER AGE TIME [TIME ...] [--temps HIGH LOW] [--k 10]  or  --runner YEAR BIB  or  --benchmark")
+            sys.exit(2)
+        runners = similarRunners(values[2:], values[0], float(values[1]), temperatures, k)
+        print(runners.round(3).to_string(index=False))
+        print(summarize(runners))
@@ -0,0 +1,247 @@
+### IMPORTS
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+
+### GLOBAL VARIABLES
+moduleDirectory = os.path.dirname(os.path.abspath(__file__))
+splitsDirectory = os.path.join(moduleDirectory, "splits")               # wserYYYY.csv files
+archiveDirectory = os.path.join(moduleDirectory, "split-matrices")     # one sub-directory of .npy arrays per year
+archiveVersion = 2                                                      # bump when the saved arrays change
+missingHours = 30.0                                                     # hours of a missing split in predictor features (wserTimes)
+
+# Mile marker of every aid station, in course order (the station axis of every split matrix; visualizations-2023 uses it as aidStationDetails)
+stationMiles = {
+    "LyonRidge": 10.3,
+    "RedStarRidge": 15.8,
+    "DuncanCanyon": 24.4,
+    "RobinsonFlat": 30.3,
+    "MillersDefeat": 34.4,
+    "DustyCorners": 38,
+    "LastChance": 43.3,
+    "DevilsThumb": 47.8,
+    "ElDoradoCreek": 52.9,
+    "MichiganBluff": 55.7,
+    "Foresthill": 62,
+    "Peachstone": 70.7,
+    "FordsBar": 73,
+    "RuckyChucky": 78,
+    "GreenGate": 79.8,
+    "AuburnLakeTrails": 85.2,
+    "QuarryRd": 90.7,
+    "PointedRocks": 94.3,
+    "RobiePoint": 98.9,
+    "Finish": 100.2
+}
+matrixArrays = ['seconds', 'missing', 'places']                         # runners x stations
+runnerColumns = {'bib': str, 'firstName': str, 'lastName': str, 'gender': str, 'age': np.int16,
+                 'city': str, 'state': str, 'country': str, 'overallPlace': np.int32}
+resultsColumns = {'bib': 'Bib', 'firstName': 'FirstName', 'lastName': 'LastName', 'gender': 'Gender', 'age': 'Age',
+                  'city': 'City', 'state': 'State', 'country': 'Country', 'overallPlace': 'OverallPlace'}
+
+### DATA STRUCTURES
+# Runner metadata of one year, one array per column (strings are fixed-width so every column can be memory mapped;
+# missing text is "", a missing age or overall place is -1)
+class RunnerTable:
+    __slots__ = tuple(runnerColumns)
+
+    def __init__(self, **columns):
+        for name in runnerColumns:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.bib)
+
+    # One runner as a dict of plain values
+    def row(self, i):
+        return {name: getattr(self, name)[i].item() for name in runnerColumns}
+
+    # Row number of every bib
+    def bibRows(self):
+        return {bib: i for i, bib in enumerate(self.bib.tolist())}
+
+# One race year: runners x stations elapsed seconds (int32, 0 where missing) with a missing mask, int32 positions
+# at each station (-1 where missing) and the runner table; the station axis is stationMiles
+class SplitMatrix:
+    __slots__ = ('year', 'stations', 'miles', 'seconds', 'missing', 'places', 'runners', 'source')
+
+    def __init__(self, year, seconds, missing, places, runners, stations=None, source=None):
+        self.year = year
+        self.stations = list(stations or stationMiles)
+        self.miles = np.array([stationMiles[station] for station in self.stations], dtype=float)
+        self.seconds = seconds
+        self.missing = missing
+        self.places = places
+        self.runners = runners
+        self.source = source or {}          # file name and SHA-256 of the splits file it was built from
+
+    def __len__(self):
+        return len(self.seconds)
+
+    # Elapsed hours as floats with NaN where there is no split (optionally only some runners, by row numbers or mask)
+    def hours(self, rows=None):
+        seconds, missing = (self.seconds, self.missing) if rows is None else (self.seconds[rows], self.missing[rows])
+        return np.where(missing, np.nan, seconds / 3600.0)
+
+    # Column number of a station
+    def station(self, name):
+        return self.stations.index(name)
+
+    # Rows of runners with a finish time
+    def finishers(self):
+        return ~self.missing[:, self.station('Finish')]
+
+### BUILDING
+# (parsing needs pandas and wserSplits, which are only imported when a year is built, so opening a saved archive stays light)
+# Builds a year's split matrix from a splits/wserYYYY.csv file read by readSplitsFile (splits in seconds) or a frame in
+# the visualizations-2023/wser2023.csv layout (h:mm:ss cells); the Finish column falls back to the overall time when a
+# file has none
+def buildSplitMatrix(results, year, source=None):
+    from wserTimes import columnSeconds
+    count = len(results)
+    seconds = np.zeros((count, len(stationMiles)), dtype=np.int32)
+    missing = np.ones((count, len(stationMiles)), dtype=bool)
+    places = np.full((count, len(stationMiles)), -1, dtype=np.int32)    # fields can outgrow int16
+    for j, station in enumerate(stationMiles):
+        if station not in results:
+            continue
+        elapsed, isMissing = columnSeconds(results[station])
+        if station == 'Finish' and 'Time' in results:
+            overall, overallMissing = columnSeconds(results['Time'])
+            elapsed = np.where(isMissing, overall, elapsed)
+            isMissing = isMissing & overallMissing
+        seconds[:, j] = np.where(isMissing, 0, elapsed)
+        missing[:, j] = isMissing
+        if station + 'Position' in results:
+            position = results[station + 'Position'].to_numpy(dtype=float, na_value=np.nan)
+            places[:, j] = np.where(isMissing | np.isnan(position), -1, np.nan_to_num(position, nan=-1))
+    columns = {}
+    for name, cast in runnerColumns.items():
+        values = results[resultsColumns[name]] if resultsColumns[name] in results else [None] * count
+        if cast is str:
+            columns[name] = np.array(["" if value is None or value != value else str(value) for value in values], dtype=str)
+        else:
+            columns[name] = np.array([-1 if value is None or value != value else int(value) for value in values], dtype=cast)
+    return SplitMatrix(year, seconds, missing, places, RunnerTable(**columns), source=source)
+
+# Builds a year's split matrix straight from its splits file
+def splitMatrixFromFile(path):
+    from wserFeatures import fileHash
+    from wserSplits import readSplitsFile, splitsFileYear
+    return buildSplitMatrix(readSplitsFile(path), splitsFileYear(path),
+                            source={'file': os.path.basename(path), 'sha256': fileHash(path)})
+
+### SAVING AND LOADING
+# Directory of one year in an archive
+def yearDirectory(year, directory=archiveDirectory):
+    return os.path.join(directory, str(year))
+
+# Saves a split matrix as plain .npy arrays plus metadata (written to a temporary directory that then replaces the year's)
+def saveSplitMatrix(matrix, directory=archiveDirectory):
+    target = yearDirectory(matrix.year, directory)
+    partial = target + ".partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    for name in matrixArrays:
+        np.save(os.path.join(partial, name + ".npy"), getattr(matrix, name))
+    for name in runnerColumns:
+        np.save(os.path.join(partial, "runner-" + name + ".npy"), getattr(matrix.runners, name))
+    metadata = {'version': archiveVersion, 'year': matrix.year, 'stations': matrix.stations, 'runners': len(matrix),
+                'source': matrix.source}
+    with open(os.path.join(partial, "metadata.json"), 'w') as metadataFile:
+        json.dump(metadata, metadataFile, indent=2)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(partial, target)
+
+# Metadata of a saved year, or None if it was never saved (or by an incompatible version)
+def savedMetadata(year, directory=archiveDirectory):
+    path = os.path.join(yearDirectory(year, directory), "metadata.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as metadataFile:
+        metadata = json.load(metadataFile)
+    return metadata if metadata.get('version') == archiveVersion else None
+
+# Opens a saved year with every array memory mapped (nothing is read until it is used)
+def loadSplitMatrix(year, directory=archiveDirectory, mmapMode='r'):
+    metadata = savedMetadata(year, directory)
+    if metadata is None:
+        return None
+    path = yearDirectory(year, directory)
+    arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmapMode) for name in matrixArrays}
+    runners = RunnerTable(**{name: np.load(os.path.join(path, "runner-" + name + ".npy"), mmap_mode=mmapMode) for name in runnerColumns})
+    return SplitMatrix(metadata['year'], arrays['seconds'], arrays['missing'], arrays['places'], runners,
+                       metadata['stations'], metadata['source'])
+
+# Opens every saved year (or some years) of an archive as {year: SplitMatrix}, without looking at the splits files
+def loadArchive(years=None, directory=archiveDirectory):
+    if years is None:
+        years = sorted(int(name) for name in os.listdir(directory) if name.isdigit()) if os.path.isdir(directory) else []
+    archive = {year: loadSplitMatrix(year, directory) for year in years}
+    return {year: matrix for year, matrix in archive.items() if matrix is not None}
+
+# Opens every splits file's year from the archive, (re)building the years whose file is new or changed since it was saved
+# returns {year: SplitMatrix} (years without a splits file are left out); check=False trusts the saved years without
+# hashing their splits files; verbose=False reports only the years it had to build
+def openArchive(years=None, splits=splitsDirectory, directory=archiveDirectory, check=True, verbose=True):
+    from wserFeatures import fileHash
+    from wserSplits import splitsFileYear
+    start = time.perf_counter()
+    paths = {splitsFileYear(path): path for path in sorted(glob.glob(os.path.join(splits, "wser*.csv")))}
+    archive = {}
+    built = []
+    for year in sorted(paths if years is None else set(years) & set(paths)):
+        metadata = savedMetadata(year, directory)
+        if metadata is None or (check and metadata['source'].get('sha256') != fileHash(paths[year])):
+            saveSplitMatrix(splitMatrixFromFile(paths[year]), directory)
+            built.append(year)
+        archive[year] = loadSplitMatrix(year, directory)
+    if verbose or built:
+        print("Opened {} year(s) of split matrices in {:.1f} ms{}".format(len(archive), 1000 * (time.perf_counter() - start),
+              " (built {})".format(built) if built else ""))
+    return archive
+
+# Deletes every saved split matrix
+def clearArchive(directory=archiveDirectory):
+    shutil.rmtree(directory, ignore_errors=True)
+
+### CONSUMERS
+# Predictor feature matrix (wserFeatures layout: Gender, Age, MinTemp, MaxTemp, then hours at each of aidStationNames,
+# missing = 30 hours) and finish hours for the M/F runners of a split matrix; aidStationNames use the predictors' names
+def matrixFeatures(matrix, aidStationNames, temperatures):
+    from wserSplits import stationAliases
+    rows = np.flatnonzero(np.isin(matrix.runners.gender, ['M', 'F']))
+    columns = [matrix.station(stationAliases[name]) for name in aidStationNames] + [matrix.station('Finish')]
+    hours = np.nan_to_num(matrix.hours(rows)[:, columns], nan=missingHours)
+    features = np.empty((len(rows), 4 + len(aidStationNames)))
+    features[:, 0] = matrix.runners.gender[rows] == 'M'
+    features[:, 1] = matrix.runners.age[rows]
+    features[:, 2] = temperatures[1]
+    features[:, 3] = temperatures[0]
+    features[:, 4:] = hours[:, :-1]
+    return features, hours[:, -1]
+
+# Usage: python wserSplitMatrix.py [--rebuild]
+# builds or refreshes the archive, reopens it, then compares each year's matrix features with wserFeatures (parsed from CSV)
+if __name__ == "__main__":
+    from wserFeatures import frameFeatures, readSplits, allAidStations, temps
+    if "--rebuild" in sys.argv:
+        clearArchive()
+    archive = openArchive()
+    archive = openArchive()
+    totalBytes = 0
+    for year, matrix in archive.items():
+        totalBytes += sum(getattr(matrix, name).nbytes for name in matrixArrays) + sum(getattr(matrix.runners, name).nbytes for name in runnerColumns)
+        if year in temps:
+            fromMatrix, finishFromMatrix = matrixFeatures(matrix, allAidStations[0:11], temps[year])
+            frame = readSplits(year)
+            frame = frame[~frame['Bib'].astype(str).duplicated()]         # the split matrix keeps one runner per bib, like the database
+            fromCsv, finishFromCsv = frameFeatures(frame, allAidStations[0:11], temps[year])
+            same = fromMatrix.shape == fromCsv.shape and np.isclose(fromMatrix, fromCsv, atol=1e-6).all(axis=1)
+            print("{}: {} runners, {} finishers; features match wserFeatures for {:.1%} of runners".format(
+                year, len(matrix), int(matrix.finishers().sum()), np.mean(same) if fromMatrix.shape == fromCsv.shape else 0.0))
+    print("{:.1f} KiB on disk for {} years".format(totalBytes / 1024, len(archive)))
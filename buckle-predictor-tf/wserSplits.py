@@ -0,0 +1,123 @@
+### IMPORTS
+import csv
+import numpy as np
+import pandas as pd
+from wserTimes import parseClockSeconds
+
+### GLOBAL VARIABLES
+# Participant columns as they appear across years -> camel-case names used by visualizations-2023/wser2023.csv
+participantColumns = {
+    "Overall Place": "OverallPlace",
+    "Time": "Time",
+    "Elapsed Time": "Time",
+    "Bib": "Bib",
+    "First Name": "FirstName",
+    "Last Name": "LastName",
+    "Gender": "Gender",
+    "Gen": "Gender",
+    "Age": "Age",
+    "City": "City",
+    "State": "State",
+    "Country": "Country",
+    "State or Country": "Country"
+}
+
+# Aid station names as they appear across years -> camel-case station names (same order as aidStationDetails)
+# stations that only exist in some years (Escarpment, Talbot Creek, Mosquito Ridge, Dardanelles, Brown's Bar, ...) are dropped
+stationAliases = {
+    "Lyon Ridge": "LyonRidge",
+    "Red Star Ridge": "RedStarRidge",
+    "Duncan Canyon": "DuncanCanyon",
+    "Robinson Flat": "RobinsonFlat",
+    "Miller's Defeat": "MillersDefeat",
+    "Millers Defeat": "MillersDefeat",
+    "Dusty Corners": "DustyCorners",
+    "Last Chance": "LastChance",
+    "Devil's Thumb": "DevilsThumb",
+    "Devils Thumb": "DevilsThumb",
+    "El Dorado Creek": "ElDoradoCreek",
+    "Michigan Bluff": "MichiganBluff",
+    "Foresthill": "Foresthill",
+    "Foresthill School": "Foresthill",
+    "Peachstone (Cal-2)": "Peachstone",
+    "Peachstone (Cal 2)": "Peachstone",
+    "Ford's Bar (Cal-3)": "FordsBar",
+    "Rucky Chucky": "RuckyChucky",
+    "Rucky Chucky (near)": "RuckyChucky",
+    "Green Gate": "GreenGate",
+    "Auburn Lake Trails": "AuburnLakeTrails",
+    "Quarry Road": "QuarryRd",
+    "Pointed Rocks": "PointedRocks",
+    "Robie Point": "RobiePoint",
+    "Finish": "Finish",
+    "Auburn Finish Line": "Finish"
+}
+stations = list(dict.fromkeys(stationAliases.values()))
+positionHeaders = {"", "Place", "Pos", "Position", "Finish Place"}   # position column that follows a split
+
+### FUNCTIONS
+# Year of a splits file named wserYYYY.csv
+def splitsFileYear(path):
+    name = str(path).replace("\\", "/").split("/")[-1]
+    return int(name[4:8])
+
+# Parses split columns (in course order) into elapsed seconds, one vectorized pass per column
+# 12-hour clock cells are moved forward by whole days until they are not earlier than the runner's previous split
+# returns [(seconds, isMissing)] per column
+def columnsSeconds(columns):
+    previous = np.zeros(len(columns[0]), dtype=np.int64)
+    parsed = []
+    for column in columns:
+        seconds, isClock, isMissing = parseClockSeconds(column.str.strip())
+        behind = isClock & (seconds < previous)
+        seconds = np.where(behind, seconds - 86400 * ((seconds - previous) // 86400), seconds)
+        previous = np.where(isMissing, previous, seconds)
+        parsed.append((seconds, isMissing))
+    return parsed
+
+# Reads a splits/wserYYYY.csv file (any year's layout) into the visualizations-2023/wser2023.csv layout, except that
+# the splits and Time are elapsed seconds (Int64, <NA> = missing) rather than h:mm:ss cells
+def readSplitsFile(path):
+    with open(path, newline="", encoding="utf-8-sig") as splitsFile:
+        header = next(csv.reader(splitsFile))
+    raw = pd.read_csv(path, header=None, skiprows=1, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+
+    # Map raw columns by position (names repeat, i.e. "Position", "Pos", "")
+    participantIdx = {}
+    stationIdx = {}
+    positionIdx = {}
+    for i, name in enumerate(header):
+        name = name.strip()
+        if name in participantColumns and participantColumns[name] not in participantIdx:
+            participantIdx[participantColumns[name]] = i
+        elif name in stationAliases and stationAliases[name] not in stationIdx:
+            stationIdx[stationAliases[name]] = i
+            if i + 1 < len(header) and header[i + 1].strip() in positionHeaders:
+                positionIdx[stationAliases[name]] = i + 1
+
+    results = pd.DataFrame(index=raw.index)
+    for column in ["OverallPlace", "Time", "Bib", "FirstName", "LastName", "Gender", "Age", "City", "State", "Country"]:
+        results[column] = raw[participantIdx[column]].str.strip() if column in participantIdx else np.nan
+    results["OverallPlace"] = pd.to_numeric(results["OverallPlace"], errors="coerce")
+    results["Age"] = pd.to_numeric(results["Age"], errors="coerce")
+    results = results.replace("", np.nan)
+
+    # Splits in course order, with the finish time last
+    columns = [raw[stationIdx[station]] if station in stationIdx else pd.Series("", index=raw.index) for station in stations]
+    columns.append(raw[participantIdx["Time"]] if "Time" in participantIdx else pd.Series("", index=raw.index))
+    parsed = columnsSeconds(columns)
+    for j, station in enumerate(stations):
+        seconds, isMissing = parsed[j]
+        results[station] = pd.arrays.IntegerArray(seconds, isMissing)
+        if station in positionIdx:
+            results[station + "Position"] = pd.to_numeric(raw[positionIdx[station]], errors="coerce")
+        else:
+            results[station + "Position"] = np.nan
+        results.loc[isMissing, station + "Position"] = np.nan
+    seconds, isMissing = parsed[-1]
+    results["Time"] = pd.arrays.IntegerArray(seconds, isMissing)
+
+    # Drop sub-header rows ("Elapsed, Place") and repeated headers; bib is unique within a year
+    # (some years list several honorary bib 0 entries, only the first is kept)
+    results = results[results["Bib"].notna() & (results["Bib"] != "Bib")]
+    return results.drop_duplicates("Bib").reset_index(drop=True)
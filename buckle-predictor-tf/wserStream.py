@@ -0,0 +1,213 @@
+### IMPORTS
+import os
+import socket
+import sys
+import time
+import numpy as np
+import pandas as pd
+from wserTimes import parseClockHours, missingHours
+from wserFeatures import allAidStations, runnerFeatures, columnRenames, temps, splitsPath, frameFeatures
+from wserModels import findModel
+from wserInference import loadBuckleModel
+from wserBatch import buckleProbabilities, buckleNames
+
+### GLOBAL VARIABLES
+stationIndex = {station: k for k, station in enumerate(allAidStations)}
+defaultPort = 5055              # local socket the live predictor listens on
+pollInterval = 0.2              # seconds between checks of a tailed file
+
+### MODELS
+# Registered buckle models for every station prefix allAidStations[0:k] that has one, as {k: (model, scaler)}
+def loadPrefixModels():
+    models = {}
+    for k in range(1, len(allAidStations) + 1):
+        key = findModel('buckle', allAidStations[0:k])
+        if key is not None:
+            model, scaler, _ = loadBuckleModel(key)
+            models[k] = (model, scaler)
+    return models
+
+### RACE STATE
+# One feature vector per bib (Gender, Age, MinTemp, MaxTemp, then every station in allAidStations)
+# update() takes split events and re-scores only the runners they touch, each with the richest prefix model
+# that does not need a split beyond the runner's latest station; splits on a 12-hour clock are unwrapped as in
+# wserFeatures.frameFeatures, so live features match the ones the models were trained on
+class RaceState:
+    def __init__(self, runners, temperatures, models):
+        runners = runners.rename(columns=columnRenames)
+        self.bibs = runners['Bib'].astype(str).to_numpy()
+        self.names = (runners['First Name'].astype(str) + " " + runners['Last Name'].astype(str)).to_numpy() if 'First Name' in runners else self.bibs
+        self.rows = {bib: i for i, bib in enumerate(self.bibs)}
+        self.features = np.full((len(runners), len(runnerFeatures) + len(allAidStations)), missingHours)
+        self.features[:, 0] = (runners['Gender'] == 'M').astype(float)
+        self.features[:, 1] = runners['Age']
+        self.features[:, 2] = temperatures[1]
+        self.features[:, 3] = temperatures[0]
+        self.isClock = np.zeros((len(runners), len(allAidStations)), dtype=bool)     # split written on a 12-hour clock
+        self.latest = np.zeros(len(runners), dtype=int)                  # stations reached (latest station index + 1)
+        self.modelUsed = np.zeros(len(runners), dtype=int)
+        self.probabilities = np.full((len(runners), len(buckleNames)), np.nan)
+        self.models = models
+        # richest available model for each number of stations reached (0: no model yet)
+        self.modelFor = np.zeros(len(allAidStations) + 1, dtype=int)
+        for k in range(1, len(allAidStations) + 1):
+            self.modelFor[k] = k if k in models else self.modelFor[k - 1]
+
+    # Applies (bib, station, time) events and re-scores the runners they changed; returns the changed rows
+    def update(self, events):
+        known = [(self.rows[bib], stationIndex[station], split) for bib, station, split in events
+                 if bib in self.rows and station in stationIndex]
+        if len(known) == 0:
+            return np.zeros(0, dtype=int)
+        rows = np.array([row for row, _, _ in known])
+        stations = np.array([k for _, k, _ in known])
+        hours, isClock, _ = parseClockHours([split for _, _, split in known])
+        self.features[rows, len(runnerFeatures) + stations] = hours
+        self.isClock[rows, stations] = isClock
+        np.maximum.at(self.latest, rows, stations + 1)
+        changed = np.unique(rows)
+        self.unwrapClockTimes(changed)
+        self.score(changed)
+        return changed
+
+    # Moves clock splits past midnight when they fall before the runner's previous split (in course order)
+    def unwrapClockTimes(self, rows):
+        previous = np.zeros(len(rows))
+        for k in range(len(allAidStations)):
+            column = len(runnerFeatures) + k
+            hours = self.features[rows, column]
+            clockHours = hours % 24.0
+            hours = np.where(self.isClock[rows, k], clockHours + 24.0 * (clockHours < previous), hours)
+            self.features[rows, column] = hours
+            previous = np.where(hours < missingHours, hours, previous)
+
+    # Scores runners with one predict call per station-prefix model
+    def score(self, rows):
+        prefixes = self.modelFor[self.latest[rows]]
+        for prefix in np.unique(prefixes):
+            if prefix == 0:
+                continue
+            group = rows[prefixes == prefix]
+            model, scaler = self.models[prefix]
+            self.probabilities[group] = buckleProbabilities(model, scaler, self.features[group, :len(runnerFeatures) + prefix])
+            self.modelUsed[group] = prefix
+
+    # Current prediction for some runners as a dataframe
+    def standings(self, rows=None):
+        rows = np.arange(len(self.bibs)) if rows is None else rows
+        scored = self.modelUsed[rows] > 0
+        standings = pd.DataFrame({'Bib': self.bibs[rows], 'Name': self.names[rows],
+                                  'LatestStation': [allAidStations[k - 1] if k > 0 else "" for k in self.latest[rows]],
+                                  'ModelStations': self.modelUsed[rows]})
+        for i, name in enumerate(buckleNames):
+            standings[name] = self.probabilities[rows, i]
+        standings['Expected'] = np.where(scored, np.array(buckleNames)[np.argmax(np.nan_to_num(self.probabilities[rows]), axis=1)], "")
+        return standings
+
+### EVENT SOURCES
+# Parses "bib,station,hh:mm:ss" lines into events (blank, header and malformed lines are skipped)
+def parseEvents(lines):
+    events = []
+    for line in lines:
+        fields = [field.strip() for field in line.split(",")]
+        if len(fields) == 3 and fields[1] in stationIndex:
+            events.append(tuple(fields))
+    return events
+
+# Follows a file like `tail -f`, yielding the lines appended since the last check
+def tailFile(path, fromStart=True):
+    with open(path) as eventFile:
+        if not fromStart:
+            eventFile.seek(0, os.SEEK_END)
+        pending = ""
+        while True:
+            pending += eventFile.read()
+            if "\n" in pending:
+                lines, _, pending = pending.rpartition("\n")
+                yield lines.split("\n")
+            else:
+                time.sleep(pollInterval)
+
+# Accepts connections on a local socket, yielding the lines each read returns
+def socketLines(port=defaultPort):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", port))
+    server.listen(1)
+    print("Listening for split events on 127.0.0.1:{}".format(port))
+    while True:
+        connection, _ = server.accept()
+        pending = ""
+        while True:
+            data = connection.recv(65536)
+            if not data:
+                break
+            pending += data.decode()
+            if "\n" in pending:
+                lines, _, pending = pending.rpartition("\n")
+                yield lines.split("\n")
+        connection.close()
+
+# Applies every batch of lines from a source to the race state and prints the runners whose prediction changed
+def runStream(source, state):
+    for lines in source:
+        changed = state.update(parseEvents(lines))
+        if len(changed) > 0:
+            print(state.standings(changed).to_string(index=False, header=False, float_format=lambda p: "{:5.2f}".format(p)))
+
+### REPLAY
+# Every recorded split in a results file as "bib,station,time" lines, in race-time order (elapsed hours as in
+# wserFeatures, i.e. 12-hour clock splits unwrapped)
+def replayLines(df):
+    df = df.rename(columns=columnRenames)
+    features, _ = frameFeatures(df, allAidStations, [0.0, 0.0])
+    events = []
+    for k, station in enumerate(allAidStations):
+        if station in df:
+            hours = features[:, len(runnerFeatures) + k]
+            for bib, split, elapsed in zip(df['Bib'].astype(str), df[station].astype(str), hours):
+                if elapsed < missingHours:
+                    events.append((elapsed, "{},{},{}".format(bib, station, split)))
+    events.sort(key=lambda event: event[0])
+    return [hours for hours, _ in events], [line for _, line in events]
+
+# Streams a historical year through the live predictor in race-time order, one tick of race time per update,
+# and reports the update latency (parse, state update and re-scoring) per tick
+def replayYear(year, tickMinutes=1.0, models=None):
+    df = pd.read_csv(splitsPath(year))
+    models = loadPrefixModels() if models is None else models
+    if len(models) == 0:
+        print("No station-prefix buckle models registered; train some with wser-buckle-predictor.py (Trail Nerd mode) first")
+        return None
+    state = RaceState(df, temps[year], models)
+    hours, lines = replayLines(df)
+    ticks = np.floor(np.array(hours) * 60.0 / tickMinutes).astype(int)
+    boundaries = np.flatnonzero(np.diff(ticks)) + 1
+    latencies = []
+    start = time.perf_counter()
+    for batch in np.split(np.arange(len(lines)), boundaries):
+        tickStart = time.perf_counter()
+        state.update(parseEvents([lines[i] for i in batch]))
+        latencies.append(time.perf_counter() - tickStart)
+    elapsed = time.perf_counter() - start
+    latencies = 1000 * np.array(latencies)
+    print("Replayed {} events for {} in {} updates ({:.2f} s, {:.0f} events/s), models for {} station prefixes".format(
+        len(lines), year, len(latencies), elapsed, len(lines) / elapsed, len(models)))
+    print("Update latency: p50 {:.2f} ms, p90 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(*np.percentile(latencies, [50, 90, 99]), latencies.max()))
+    return latencies
+
+# Usage: python wserStream.py --replay YEAR [--tick MINUTES]
+#        python wserStream.py runners.csv --temps HIGH LOW (--tail events.csv | --socket [PORT])
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    option = lambda name, count=1: arguments[arguments.index(name) + 1:arguments.index(name) + 1 + count] if name in arguments else None
+    if "--replay" in arguments:
+        tick = option("--tick")
+        replayYear(int(option("--replay")[0]), float(tick[0]) if tick else 1.0)
+    else:
+        state = RaceState(pd.read_csv(arguments[0]), [float(value) for value in option("--temps", 2)], loadPrefixModels())
+        if "--tail" in arguments:
+            runStream(tailFile(option("--tail")[0]), state)
+        else:
+            port = option("--socket")
+            runStream(socketLines(int(port[0]) if port and port[0].isdigit() else defaultPort), state)
@@ -0,0 +1,191 @@
+### IMPORTS
+import csv
+import importlib.util
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+import numpy as np
+import pandas as pd
+from wserFeatures import buildFeatures, allAidStations, moduleDirectory
+from wserLogistic import fitLogistic, evaluateLogistic, standardCutoffs
+
+### GLOBAL VARIABLES
+sweepYears = [year for year in range(2010, 2024) if year != 2020]      # every held-out year (the race was cancelled in 2020)
+resultsPath = os.path.join(moduleDirectory, "sweep-results.csv")
+resultColumns = ['model', 'stations', 'latestStation', 'testYear', 'cutoff', 'seed', 'accuracy', 'trainRunners', 'testRunners', 'seconds']
+# Thread pools read these when they start, so they are set before the workers are spawned
+threadVariables = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                   'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']
+epochs = 40                     # as in wser-buckle-predictor.py
+
+### JOBS
+# Every (model type, station prefix k, held-out year) training in the sweep
+def sweepJobs(modelType='buckle', years=sweepYears, prefixes=range(1, len(allAidStations) + 1)):
+    return [(modelType, k, year) for k in prefixes for year in years]
+
+# Seed derived from the job itself, so a job gives the same result whichever worker runs it and in whatever order
+def jobSeed(modelType, k, testYear):
+    return zlib.crc32("{}-{}-{}".format(modelType, k, testYear).encode()) & 0x7fffffff
+
+# Limits the BLAS, OpenMP and TensorFlow thread pools of processes started from now on
+def limitThreads(threads):
+    for name in threadVariables:
+        os.environ[name] = str(threads)
+
+# Worker start-up: feature building prints a line per job, which only clutters the sweep's own progress output
+def initWorker():
+    sys.stdout = open(os.devnull, 'w')
+
+# Trains the buckle model of wser-buckle-predictor.py (Trail Nerd sizing) and returns its test accuracy
+def trainBuckle(input_train, time_train, input_test, time_test, k, seed):
+    import tensorflow as tf
+    from sklearn.preprocessing import StandardScaler
+    threads = int(os.environ.get('TF_NUM_INTRAOP_THREADS', 1))
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    tf.keras.utils.set_random_seed(seed)
+    scaler = StandardScaler()
+    input_train = scaler.fit_transform(input_train)
+    input_test = scaler.transform(input_test)
+    neurons = 8 + int(np.ceil(k / 3.0))
+    model = tf.keras.Sequential([
+        tf.keras.layers.Dense(neurons, activation='relu'),
+        tf.keras.layers.Dense(3)
+    ])
+    model.compile(optimizer='adam',
+                  loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True),
+                  metrics=['accuracy'])
+    model.fit(input_train, np.digitize(time_train, [24, 30]), epochs=epochs, verbose=0)
+    _, accuracy = model.evaluate(input_test, np.digitize(time_test, [24, 30]), verbose=0)
+    return accuracy
+
+# Runs one job: trains on every sweep year but the held-out one and returns result rows
+# (one row for a buckle model, one per standard cutoff for a finish model)
+def runJob(job):
+    modelType, k, testYear = job
+    seed = jobSeed(modelType, k, testYear)
+    np.random.seed(seed)
+    start = time.perf_counter()
+    input_train, time_train, input_test, time_test = buildFeatures(allAidStations[0:k], sweepYears[0], sweepYears[-1], testYear,
+                                                                   dashIsMissing=modelType == 'finish')
+    if modelType == 'buckle':
+        accuracies = {'': trainBuckle(input_train, time_train, input_test, time_test, k, seed)}
+    else:
+        results = evaluateLogistic(fitLogistic(input_train, time_train, standardCutoffs), input_test, time_test)
+        accuracies = {cutoff: result['accuracy'] for cutoff, result in results.items()}
+    seconds = time.perf_counter() - start
+    return [{'model': modelType, 'stations': k, 'latestStation': allAidStations[k - 1], 'testYear': testYear, 'cutoff': cutoff,
+             'seed': seed, 'accuracy': float(accuracy), 'trainRunners': len(input_train), 'testRunners': len(input_test),
+             'seconds': round(seconds, 3)} for cutoff, accuracy in accuracies.items()]
+
+# Pool entry point: a failed job comes back as its error instead of stopping the sweep
+def tryJob(job):
+    try:
+        return job, runJob(job), None
+    except Exception as error:
+        return job, None, "{}: {}".format(type(error).__name__, error)
+
+### RESULTS
+# Jobs that already have rows in the results table
+def completedJobs(path=resultsPath):
+    if not os.path.exists(path):
+        return set()
+    done = pd.read_csv(path)
+    return set(zip(done['model'], done['stations'], done['testYear']))
+
+# Appends one job's rows to the results table (written as each job finishes, so an interrupted sweep loses at most the running jobs)
+def appendRows(rows, path=resultsPath):
+    exists = os.path.exists(path)
+    with open(path, 'a', newline='') as resultsFile:
+        writer = csv.DictWriter(resultsFile, fieldnames=resultColumns)
+        if not exists:
+            writer.writeheader()
+        writer.writerows(rows)
+
+# Accuracy against latest station: one row per prefix, one column per held-out year, plus the mean and spread
+def accuracyCurve(modelType='buckle', cutoff=30.0, path=resultsPath):
+    results = pd.read_csv(path)
+    results = results[results['model'] == modelType]
+    if modelType == 'finish':
+        results = results[np.isclose(results['cutoff'], cutoff)]
+    curve = results.pivot_table(index=['stations', 'latestStation'], columns='testYear', values='accuracy')
+    curve['mean'] = curve.mean(axis=1)
+    curve['std'] = curve.iloc[:, :-1].std(axis=1)
+    return curve.sort_index()
+
+### SWEEP
+# Runs every job not yet in the results table on a pool of worker processes (single-threaded by default)
+def runSweep(modelType='buckle', workers=None, path=resultsPath, years=sweepYears, prefixes=range(1, len(allAidStations) + 1), threads=1):
+    if modelType == 'buckle' and importlib.util.find_spec('tensorflow') is None:
+        print("The buckle sweep trains with TensorFlow, which is not installed (the finish sweep does not need it: --finish)")
+        return None
+    workers = workers or os.cpu_count()
+    done = completedJobs(path)
+    allJobs = sweepJobs(modelType, years, prefixes)
+    jobs = [job for job in allJobs if job not in done]
+    print("{} {} jobs to run ({} already in {}) on {} workers".format(len(jobs), modelType, len(allJobs) - len(jobs), path, workers))
+    if len(jobs) == 0:
+        return 0.0
+    limitThreads(threads)
+    start = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(workers, initializer=initWorker) as pool:
+        for finished, (job, rows, error) in enumerate(pool.imap_unordered(tryJob, jobs), start=1):
+            if error is not None:
+                print("[{}/{}] {} failed: {}".format(finished, len(jobs), job, error))
+                continue
+            if path is not None:
+                appendRows(rows, path)
+            print("[{}/{}] {} k={} held out {}: accuracy {:.3f} ({:.1f} s)".format(
+                finished, len(jobs), job[0], job[1], job[2], rows[0]['accuracy'], rows[0]['seconds']))
+    elapsed = time.perf_counter() - start
+    print("Sweep finished in {:.1f} s".format(elapsed))
+    return elapsed
+
+# Wall-clock time of the same jobs on 1, 2, 4, ... workers up to the core count (features are built once beforehand,
+# so every run does the same work, and nothing is written to the results table)
+def scalingReport(modelType='buckle', jobCount=26):
+    jobs = sweepJobs(modelType)[-jobCount:]
+    for _, k, year in jobs:
+        buildFeatures(allAidStations[0:k], sweepYears[0], sweepYears[-1], year, dashIsMissing=modelType == 'finish')
+    workerCounts = sorted(set([2 ** i for i in range(int(np.log2(os.cpu_count())) + 1)] + [os.cpu_count()]))
+    timings = {}
+    for workers in workerCounts:
+        limitThreads(1)
+        start = time.perf_counter()
+        with multiprocessing.get_context('spawn').Pool(workers, initializer=initWorker) as pool:
+            failures = [error for _, _, error in pool.imap_unordered(tryJob, jobs) if error is not None]
+        timings[workers] = time.perf_counter() - start
+        if failures:
+            print("{} of {} jobs failed ({})".format(len(failures), len(jobs), failures[0]))
+    print("{} {} jobs on {} cores".format(len(jobs), modelType, os.cpu_count()))
+    print("{:>8}  {:>8}  {:>8}  {:>10}".format("workers", "wall s", "speedup", "efficiency"))
+    for workers, seconds in timings.items():
+        speedup = timings[1] / seconds
+        print("{:>8}  {:>8.2f}  {:>8.2f}  {:>9.0%}".format(workers, seconds, speedup, speedup / workers))
+    return timings
+
+# Usage: python wserSweep.py [--finish] [--workers N] [--output results.csv]    (runs or resumes the sweep, then prints the curve)
+#        python wserSweep.py [--finish] --report [--cutoff HOURS]              (prints the accuracy curve of existing results)
+#        python wserSweep.py [--finish] --scaling [JOBS]                       (wall-clock scaling with the number of workers)
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    option = lambda name, count=1: arguments[arguments.index(name) + 1:arguments.index(name) + 1 + count] if name in arguments else None
+    modelType = 'finish' if "--finish" in arguments else 'buckle'
+    output = option("--output")
+    path = output[0] if output else resultsPath
+    if "--scaling" in arguments:
+        jobCount = option("--scaling")
+        scalingReport(modelType, int(jobCount[0]) if jobCount and jobCount[0].isdigit() else 26)
+    else:
+        if "--report" not in arguments:
+            workers = option("--workers")
+            runSweep(modelType, int(workers[0]) if workers else None, path)
+        cutoff = option("--cutoff")
+        curve = accuracyCurve(modelType, float(cutoff[0]) if cutoff else 30.0, path) if os.path.exists(path) else None
+        if curve is None or len(curve) == 0:
+            print("No {} results in {}".format(modelType, path))
+        else:
+            with pd.option_context('display.width', 250, 'display.max_columns', 20):
+                print(curve.round(3))
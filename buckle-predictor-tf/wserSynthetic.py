@@ -0,0 +1,260 @@
+### IMPORTS
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+### GLOBAL VARIABLES
+moduleDirectory = os.path.dirname(os.path.abspath(__file__))
+outputDirectory = os.path.join(moduleDirectory, "synthetic")        # <output>/splits/wserYYYY.csv and <output>/visualizations/wserYYYY.csv
+chunkSize = 100000                                                  # runners formatted and written at a time
+bibLength = 8                                                       # width of the bib column in the results database (wserSetup schemas)
+
+# Course in order: splits-file name, camel-case name (None: not in the visualizations layout), median fraction of the
+# finish time at that station (None: not timed, always "--:--"); fractions are 2023 finishers' medians
+course = [
+    ("Start", None, None),
+    ("Escarpment", None, None),
+    ("Lyon Ridge", "LyonRidge", 0.1057),
+    ("Red Star Ridge", "RedStarRidge", 0.1609),
+    ("Duncan Canyon", "DuncanCanyon", 0.2242),
+    ("Robinson Flat", "RobinsonFlat", 0.2864),
+    ("Miller's Defeat", "MillersDefeat", 0.3199),
+    ("Dusty Corners", "DustyCorners", 0.3466),
+    ("Last Chance", "LastChance", 0.3861),
+    ("Devil's Thumb", "DevilsThumb", 0.4416),
+    ("El Dorado Creek", "ElDoradoCreek", 0.4880),
+    ("Michigan Bluff", "MichiganBluff", 0.5280),
+    ("Foresthill", "Foresthill", 0.5921),
+    ("Dardanelles (Cal-1)", None, None),
+    ("Peachstone (Cal-2)", "Peachstone", 0.6771),
+    ("Ford's Bar (Cal-3)", "FordsBar", 0.7070),
+    ("Rucky Chucky", "RuckyChucky", 0.7533),
+    ("Green Gate", "GreenGate", 0.7804),
+    ("Auburn Lake Trails", "AuburnLakeTrails", 0.8391),
+    ("Quarry Road", "QuarryRd", 0.8960),
+    ("Pointed Rocks", "PointedRocks", 0.9397),
+    ("Robie Point", "RobiePoint", 0.9883),
+    ("Finish", "Finish", 1.0)
+]
+timedStations = [k for k, (_, _, fraction) in enumerate(course) if fraction is not None]
+profile = np.array([course[k][2] for k in timedStations])
+
+# Names some years' splits files use instead (each is picked per year); all of them are read back through columnRenames
+nameVariants = {"Devil's Thumb": "Devils Thumb", "Foresthill": "Foresthill School", "Miller's Defeat": "Millers Defeat",
+                "Rucky Chucky": "Rucky Chucky (near)", "Gender": "Gen", "Time": "Elapsed Time", "Start": "Squaw Valley (Start)"}
+positionHeaders = ["Position", "Pos", ""]                           # header of the place column after each station
+
+firstNames = {'M': ["Tom", "Tyler", "Jim", "Hayden", "Adam", "Dylan", "Matt", "Chris", "Jared", "Rod", "Kaz", "Ryan", "Cody", "Scott", "Dan"],
+              'F': ["Courtney", "Ruth", "Ida", "Katie", "Leah", "Fuzhao", "Marianne", "Emily", "Camille", "Hannah", "Kelly", "Abby", "Anne", "Sarah", "Jess"]}
+lastNames = ["Evans", "Green", "Walmsley", "Hawks", "Peterson", "Bowman", "Daniels", "Mackey", "Hazen", "Farvard", "Sharman", "Dauwalter",
+             "Croft", "Schide", "Nydegger", "Yingling", "Hogenkamp", "Kowalczyk", "Watson", "Walker", "Cooper", "Olson", "Krupicka", "Swanson"]
+places = [("Auburn", "CA", "USA"), ("Truckee", "CA", "USA"), ("Flagstaff", "AZ", "USA"), ("Boulder", "CO", "USA"), ("Portland", "OR", "USA"),
+          ("Salt Lake City", "UT", "USA"), ("Bend", "OR", "USA"), ("Chamonix", "Haute-Savoie", "FRA"), ("London", "GBR", "GBR"),
+          ("Stuttgart", "Baden-Wuerttemberg", "DEU"), ("Squamish", "BC", "CAN"), ("Hong Kong", "HKG", "HKG")]
+
+### GENERATION
+# One year's results: runner details and elapsed seconds at every timed station (-1: no split), in overall-place order
+# the year's random stream depends only on (seed, year), so a year comes out the same whichever other years are generated
+def generateYear(runners, year, seed=0):
+    generator = np.random.default_rng([seed, year])
+    gender = np.where(generator.random(runners) < 0.78, 'M', 'F')
+    age = np.clip(np.round(generator.normal(45, 9.5, runners)), 20, 75).astype(int)
+
+    # Potential finish time: left-skewed towards the 30 hour cutoff, slower for women and with age
+    potential = 14.3 + 17.3 * generator.beta(3.0, 1.4, runners) + 0.8 * (gender == 'F') + 0.03 * (age - 45)
+    potential = np.maximum(potential, 14.3)
+
+    # Cumulative splits: the median profile with multiplicative noise on every segment, rescaled to the potential time
+    segments = np.diff(np.r_[0.0, profile])[None, :] * np.exp(generator.normal(0.0, 0.12, (runners, len(profile))))
+    elapsed = np.cumsum(segments, axis=1)
+    elapsed = elapsed / elapsed[:, -1:] * potential[:, None] * 3600.0
+
+    # DNFs: pulled at the first station past a rolling cutoff (45 minutes behind 30-hour pace, 30 hours at the finish),
+    # or a random drop
+    behind = elapsed > (30.0 * profile + 0.75 * (profile < 1.0))[None, :] * 3600.0
+    stopped = np.where(behind.any(axis=1), np.argmax(behind, axis=1), len(profile))
+    drops = generator.random(runners) < 0.06
+    stopped[drops] = np.minimum(stopped[drops], generator.integers(1, len(profile), drops.sum()))
+    reached = np.arange(len(profile))[None, :] < stopped[:, None]
+
+    # Timing gaps ("--:--") at stations a runner did pass; the finish is always recorded
+    gaps = generator.random((runners, len(profile))) < 0.03
+    gaps[:, -1] = False
+    seconds = np.where(reached & ~gaps, np.round(elapsed), -1).astype(np.int64)
+
+    # Overall place: finishers by time, then DNFs by furthest station reached and their time there
+    finished = stopped == len(profile)
+    lastSeconds = np.round(elapsed[np.arange(runners), np.maximum(stopped - 1, 0)])
+    order = np.lexsort((lastSeconds, -stopped, ~finished))
+    seconds = seconds[order]
+    gender = gender[order]
+
+    # Bibs: M1-M10 and F1-F10 for the fastest potential times, numbers for everyone else
+    bibs = (generator.permutation(runners) + 1).astype(str).astype(object)
+    for g in ['M', 'F']:
+        fastest = np.flatnonzero(gender == g)[np.argsort(potential[order][gender == g])[:10]]
+        bibs[fastest] = ["{}{}".format(g, rank + 1) for rank in range(len(fastest))]
+
+    where = generator.integers(0, len(places), runners)
+    first = np.where(gender == 'M', np.array(firstNames['M'], dtype=object)[generator.integers(0, len(firstNames['M']), runners)],
+                     np.array(firstNames['F'], dtype=object)[generator.integers(0, len(firstNames['F']), runners)])
+    return {'year': year, 'overallPlace': np.arange(1, runners + 1), 'bib': bibs, 'firstName': first,
+            'lastName': np.array(lastNames, dtype=object)[generator.integers(0, len(lastNames), runners)],
+            'gender': gender, 'age': age[order], 'city': np.array([p[0] for p in places], dtype=object)[where],
+            'state': np.array([p[1] for p in places], dtype=object)[where], 'country': np.array([p[2] for p in places], dtype=object)[where],
+            'seconds': seconds, 'positions': stationPositions(seconds)}
+
+# Place of every runner at every station among the runners with a split there (0: no split)
+def stationPositions(seconds):
+    positions = np.zeros(seconds.shape, dtype=np.int64)
+    for k in range(seconds.shape[1]):
+        timed = np.flatnonzero(seconds[:, k] >= 0)
+        positions[timed[np.argsort(seconds[timed, k], kind='stable')], k] = np.arange(1, len(timed) + 1)
+    return positions
+
+# Per-year layout choices of the splits file: which name variants it uses and how its place columns are headed
+def yearLayout(year, seed=0):
+    generator = np.random.default_rng([seed, year, 1])
+    return {name: variant for name, variant in nameVariants.items() if generator.random() < 0.5}, positionHeaders[generator.integers(len(positionHeaders))]
+
+### FORMATTING
+hourStrings = np.array([str(hour) for hour in range(100)], dtype=object)
+minuteSecondStrings = np.array([":{:02d}:{:02d}".format(second // 60, second % 60) for second in range(3600)], dtype=object)
+
+# Elapsed seconds as "h:mm:ss" cells ("--:--" where there is no split), through lookup tables instead of per-cell formatting
+def formatCells(seconds, missing="--:--"):
+    cells = hourStrings[np.maximum(seconds, 0) // 3600] + minuteSecondStrings[np.maximum(seconds, 0) % 3600]
+    cells[seconds < 0] = missing
+    return cells
+
+# Integers as cells through a lookup table of their strings (0 is written as an empty cell)
+def numberStrings(count):
+    strings = np.arange(count + 1).astype(str).astype(object)
+    strings[0] = ""
+    return strings
+
+# Rows [start, stop) of a generated year as formatted cells: the runner columns, then (time, place) for every timed station
+def formatChunk(results, start, stop, numbers):
+    seconds = results['seconds'][start:stop]
+    runner = [numbers[results['overallPlace'][start:stop]], np.where(seconds[:, -1] >= 0, formatCells(seconds[:, -1]), ""),
+              results['bib'][start:stop], results['firstName'][start:stop], results['lastName'][start:stop],
+              results['gender'][start:stop].astype(object), numbers[results['age'][start:stop]], results['city'][start:stop],
+              results['state'][start:stop], results['country'][start:stop]]
+    stations = [(formatCells(seconds[:, j]), numbers[results['positions'][start:stop, j]]) for j in range(len(timedStations))]
+    return runner, stations
+
+# Writes columns of cells as CSV lines (generated cells never contain commas or quotes)
+def writeLines(resultsFile, columns):
+    resultsFile.write("\n".join(map(",".join, np.stack(columns, axis=1).tolist())) + "\n")
+
+### WRITERS
+# Header of the visualizations layout (visualizations-2023/wser2023.csv)
+def camelCaseHeader():
+    header = ['OverallPlace', 'Time', 'Bib', 'FirstName', 'LastName', 'Gender', 'Age', 'City', 'State', 'Country']
+    for k in timedStations:
+        header += [course[k][1], course[k][1] + 'Position']
+    return header
+
+# Header of the splits-file layout (buckle-predictor-tf/splits/wserYYYY.csv), with one year's name variants
+def splitsHeader(variants, positionHeader):
+    name = lambda column: variants.get(column, column)
+    header = ['Overall Place', name('Time'), 'Bib', 'First Name', 'Last Name', name('Gender'), 'Age', 'City', 'State', 'Country']
+    for stationName, _, _ in course:
+        header += [name(stationName), positionHeader]
+    return header
+
+# Writes a generated year in one or both layouts, a chunk of runners at a time (each chunk is formatted once for both)
+# returns the paths written
+def writeYear(results, directory=outputDirectory, formats=('splits', 'camel'), seed=0):
+    runners = len(results['bib'])
+    numbers = numberStrings(runners)
+    variants, positionHeader = yearLayout(results['year'], seed)
+    paths = {layout: os.path.join(directory, 'splits' if layout == 'splits' else 'visualizations', "wser{}.csv".format(results['year']))
+             for layout in formats}
+    files = {}
+    for layout, path in paths.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        files[layout] = open(path, 'w', newline='')
+        files[layout].write(",".join(camelCaseHeader() if layout == 'camel' else splitsHeader(variants, positionHeader)) + "\n")
+    for start in range(0, runners, chunkSize):
+        stop = min(start + chunkSize, runners)
+        runner, stations = formatChunk(results, start, stop, numbers)
+        if 'camel' in files:
+            writeLines(files['camel'], runner + [cells for station in stations for cells in station])
+        if 'splits' in files:
+            untimed = (np.full(stop - start, "--:--", dtype=object), np.full(stop - start, "", dtype=object))
+            timed = iter(stations)
+            writeLines(files['splits'], runner + [cells for _, _, fraction in course for cells in (untimed if fraction is None else next(timed))])
+    for resultsFile in files.values():
+        resultsFile.close()
+    return list(paths.values())
+
+# Generates and writes every year; returns {year: [paths]}
+def generateResults(runners, years, seed=0, directory=outputDirectory, formats=('splits', 'camel')):
+    if len(str(runners)) > bibLength:
+        print("Error: {} runners need bibs longer than the database's {} characters".format(runners, bibLength))
+        return {}
+    written = {}
+    for year in years:
+        start = time.perf_counter()
+        results = generateYear(runners, year, seed)
+        generated = time.perf_counter() - start
+        written[year] = writeYear(results, directory, formats, seed)
+        elapsed = time.perf_counter() - start
+        finishers = np.sum(results['seconds'][:, -1] >= 0)
+        print("{}: {} runners ({:.1%} finished) generated in {:.2f} s, written in {:.2f} s ({:.0f} runners/s)".format(
+            year, runners, finishers / runners, generated, elapsed - generated, runners / elapsed))
+    return written
+
+# Parses "2023", "2010-2023" or "2019 2021 2022" style year arguments (2020 is skipped in ranges: no race was held)
+def parseYears(values):
+    years = []
+    for value in values:
+        if "-" in value:
+            first, last = (int(part) for part in value.split("-"))
+            years += [year for year in range(first, last + 1) if year != 2020]
+        else:
+            years.append(int(value))
+    return years
+
+### SMOKE TEST
+# Loads a generated year too big for 16-bit places and 4-character bibs through createAndPopulateDatabase (embedded
+# SQLite) and buildSplitMatrix; returns True when both keep every runner whole
+def smokeTest(runners=40000, year=2023, seed=0):
+    sys.path.append(os.path.join(moduleDirectory, '..', 'visualizations-2023'))
+    import wserSetup
+    from wserSplitMatrix import splitMatrixFromFile
+    directory = tempfile.mkdtemp()
+    try:
+        splitsPath, camelPath = generateResults(runners, [year], seed, directory)[year]
+        wserSetup.useBackend('sqlite')
+        wserSetup.createAndPopulateDatabase(resultsFile=camelPath)
+        connection = wserSetup.createDatabaseConnection(wserSetup.hostName, wserSetup.userName, wserSetup.password, wserSetup.databaseName)
+        participants, longestBib = wserSetup.readQuery(connection, "SELECT COUNT(*), MAX(LENGTH(bib)) FROM participants")[0]
+        matrix = splitMatrixFromFile(splitsPath)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    checks = {"participants loaded": participants == runners, "bibs stored whole": longestBib == len(str(runners)),
+              "split matrix runners": len(matrix) == runners, "overall places": int(matrix.runners.overallPlace.max()) == runners,
+              "station places": bool((matrix.places.max(axis=0) == (~matrix.missing).sum(axis=0)).all())}
+    for name, passed in checks.items():
+        print("{:<22} {}".format(name, "ok" if passed else "FAILED"))
+    return all(checks.values())
+
+# Usage: python wserSynthetic.py --smoke-test [RUNNERS]   (default 40000, more than int16 places or 4-character bibs hold)
+#        python wserSynthetic.py RUNNERS [--years 2023 | 2010-2023 | 2019 2021 ...] [--seed N] [--output DIRECTORY] [--splits | --camel]
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    option = lambda name: arguments[arguments.index(name) + 1] if name in arguments else None
+    if "--smoke-test" in arguments:
+        count = arguments[arguments.index("--smoke-test") + 1:]
+        sys.exit(0 if smokeTest(int(count[0]) if count and count[0].isdigit() else 40000) else 1)
+    years = ["2023"]
+    if "--years" in arguments:
+        following = arguments[arguments.index("--years") + 1:]
+        years = following[:next((i for i, value in enumerate(following) if value.startswith("--")), len(following))]
+    formats = ('splits',) if "--splits" in arguments else ('camel',) if "--camel" in arguments else ('splits', 'camel')
+    generateResults(int(arguments[0]), parseYears(years), int(option("--seed") or 0), option("--output") or outputDirectory, formats)
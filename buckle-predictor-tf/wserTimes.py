@@ -0,0 +1,167 @@
+### IMPORTS
+import glob
+import os
+import time
+import numpy as np
+import pandas as pd
+
+### GLOBAL VARIABLES
+missingHours = 30.0        # hours assigned to a missing split (same convention as getHours)
+maxWidth = 24              # longest cell (in characters) the vectorized parser looks at
+
+### SCALAR PARSERS (reference implementations, one cell at a time)
+# Function to format times (buckle predictor): "-" starts an out-time or placeholder that is dropped
+def getHours(strTime):
+  if "-" in strTime:
+    strTime = strTime[0:str.find(strTime,"-")]
+  if " " in strTime:
+    strTime= strTime[0:str.find(strTime," ")]
+  if strTime == "nan" or len(strTime) == 0:
+      return 30.0
+  else:
+      strTime = str.split(strTime,':')
+      return float(strTime[0]) + float(strTime[1])/60.0 + float(strTime[2])/3600.0
+
+# Function to format times (finish predictor): any cell containing "-" counts as missing
+def getHoursDashMissing(strTime):
+    if " " in strTime:
+      strTime= strTime[0:str.find(strTime," ")]
+    if strTime == "nan" or "-" in strTime:
+        return 30.0
+    else:
+        strTime = str.split(strTime,':')
+        return float(strTime[0]) + float(strTime[1])/60.0 + float(strTime[2])/3600.0
+
+### VECTORIZED PARSERS
+# Parses a whole column of split cells into elapsed seconds in one pass
+# handles "h:mm:ss", "hh:mm:ss AM" (clock suffix ignored, as in getHours), "08:54:00-08:57:00" and "01:40:00---:--"
+# (time before the "-"), dated cells ("6/25/2023 5:04:00 AM"), "--:--", "nan" and empty cells (missing)
+# dashIsMissing: treat any cell whose time contains "-" as missing (getHoursDashMissing behaviour)
+# returns (seconds as int64, missing mask)
+def parseSeconds(column, dashIsMissing=False):
+    values = np.asarray(column)
+    try:
+        encoded = values.astype("S{}".format(maxWidth))          # one C-level conversion to fixed-width bytes
+    except UnicodeEncodeError:
+        encoded = np.char.encode(values.astype(str), "ascii", "replace").astype("S{}".format(maxWidth))
+    chars = encoded.view(np.uint8).reshape(len(encoded), maxWidth)
+
+    # Dated cells are rare: realign them by dropping the "m/d/yyyy " prefix
+    dated = np.flatnonzero((chars == ord("/")).any(axis=1))
+    if len(dated) > 0:
+        chars = chars.copy()
+        for i in dated:
+            cell = bytes(chars[i]).rstrip(b"\0")
+            cell = cell[cell.index(b" ") + 1:] if b" " in cell else cell
+            chars[i] = np.frombuffer(cell.ljust(maxWidth, b"\0"), dtype=np.uint8)
+
+    digits = chars.astype(np.int16) - ord("0")
+    isDigit = (digits >= 0) & (digits <= 9)
+    rows = np.arange(len(chars))
+
+    # "h:mm:ss" or "hh:mm:ss" (or "hhh:mm:ss") at the start of the cell
+    firstColon = np.argmax(chars == ord(":"), axis=1)
+    valid = (firstColon >= 1) & (firstColon <= 3) & (firstColon + 6 <= maxWidth)
+    firstColon = np.where(valid, firstColon, 1)
+    hours = np.zeros(len(chars), dtype=np.int64)
+    for width in (1, 2, 3):
+        hasWidth = valid & (firstColon == width)
+        value = np.zeros(len(chars), dtype=np.int64)
+        for k in range(width):
+            hasWidth &= isDigit[:, k]
+            value = value * 10 + digits[:, k]
+        hours = np.where(hasWidth, value, hours)
+        valid &= (firstColon != width) | hasWidth
+    at = lambda offset: (rows, firstColon + offset)
+    valid &= isDigit[at(1)] & isDigit[at(2)] & (chars[at(3)] == ord(":")) & isDigit[at(4)] & isDigit[at(5)]
+    minutes = digits[at(1)] * 10 + digits[at(2)]
+    seconds = digits[at(4)] * 10 + digits[at(5)]
+
+    if dashIsMissing:
+        isSpace = chars == ord(" ")
+        firstSpace = np.where(isSpace.any(axis=1), np.argmax(isSpace, axis=1), maxWidth)
+        valid &= ~((chars == ord("-")) & (np.arange(maxWidth) < firstSpace[:, None])).any(axis=1)
+    elapsed = np.where(valid, hours * 3600 + minutes * 60 + seconds, 0).astype(np.int64)
+    return elapsed, ~valid
+
+# Parses a whole column into fractional hours, with missing cells set to `missing` (getHours drop-in)
+def parseHours(column, missing=missingHours, dashIsMissing=False):
+    elapsed, isMissing = parseSeconds(column, dashIsMissing)
+    return np.where(isMissing, missing, elapsed / 3600.0)
+
+# Parses a whole column into seconds like parseSeconds, but reads 12-hour clock cells ("02:30:04 PM", which some years
+# use for elapsed times) on the 24-hour clock; returns (seconds, isClock, isMissing) so callers can unwrap times past midnight
+def parseClockSeconds(column, dashIsMissing=False):
+    elapsed, isMissing = parseSeconds(column, dashIsMissing)
+    text = pd.Series(np.asarray(column, dtype=object)).astype(str)
+    isPM = text.str.endswith(" PM").to_numpy()
+    isClock = (isPM | text.str.endswith(" AM").to_numpy()) & ~isMissing
+    return np.where(isClock, elapsed % (12 * 3600) + 12 * 3600 * isPM, elapsed), isClock, isMissing
+
+# Parses a whole column into hours like parseHours, with 12-hour clock cells read as parseClockSeconds does
+def parseClockHours(column, missing=missingHours, dashIsMissing=False):
+    elapsed, isClock, isMissing = parseClockSeconds(column, dashIsMissing)
+    return np.where(isMissing, missing, elapsed / 3600.0), isClock, isMissing
+
+# Elapsed seconds and missing mask of a column holding either split cells (parsed as parseSeconds does) or elapsed
+# seconds already (readSplitsFile's integer columns, NA = missing)
+def columnSeconds(column, dashIsMissing=False):
+    if pd.api.types.is_numeric_dtype(column):
+        isMissing = np.asarray(pd.isna(column))
+        return np.asarray(pd.Series(column).fillna(0), dtype=np.int64), isMissing
+    return parseSeconds(column, dashIsMissing)
+
+# Parses a whole column into hh, mm, ss integer arrays plus the missing mask (formatTime drop-in)
+def parseClock(column):
+    elapsed, isMissing = parseSeconds(column)
+    return elapsed // 3600, (elapsed // 60) % 60, elapsed % 60, isMissing
+
+### CHECKS AND BENCHMARK
+# Every split/time cell in splits/wserYYYY.csv, as the raw strings getHours sees (position columns are left out)
+def archiveCells(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), "splits")):
+    cells = []
+    for path in sorted(glob.glob(os.path.join(directory, "wser*.csv"))):
+        df = pd.read_csv(path)
+        for column in df.columns[1:]:
+            values = [str(x) for x in df[column]]
+            if any(":" in value for value in values):
+                cells.extend(values)
+    return pd.Series(cells, dtype=object)
+
+# Checks the vectorized parsers against getHours/getHoursDashMissing on every cell they can parse
+def checkEquivalence(cells=None):
+    cells = archiveCells() if cells is None else cells
+    for scalar, dashIsMissing in [(getHours, False), (getHoursDashMissing, True)]:
+        expected = []
+        for cell in cells:
+            try:
+                expected.append(scalar(str(cell)))
+            except (ValueError, IndexError):          # cells the scalar parser cannot handle (i.e. "DNF")
+                expected.append(np.nan)
+        expected = np.array(expected)
+        actual = parseHours(cells, dashIsMissing=dashIsMissing)
+        comparable = ~np.isnan(expected)
+        mismatches = np.flatnonzero(comparable & ~np.isclose(expected, actual))
+        print("{}: {} cells compared, {} mismatches".format(scalar.__name__, comparable.sum(), len(mismatches)))
+        for i in mismatches[:10]:
+            print("  {!r}: expected {}, got {}".format(cells.iloc[i], expected[i], actual[i]))
+    return len(mismatches) == 0
+
+# Times per-cell getHours (via DataFrame.apply) against the vectorized parser
+def benchmarkTimeParsing(repeats=5, cells=None):
+    cells = archiveCells() if cells is None else cells
+    timings = {}
+    cells = cells[cells.str.contains(":") | (cells == "nan")]        # cells getHours can parse
+    for name, parse in [("getHours apply", lambda: cells.apply(lambda x: getHours(str(x)))),
+                        ("parseHours", lambda: parseHours(cells))]:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            parse()
+        timings[name] = (time.perf_counter() - start) / repeats
+        print("{:<16} {:8.2f} ms  ({:,.0f} cells/s)".format(name, 1000 * timings[name], len(cells) / timings[name]))
+    print("Speedup: {:.1f}x over {} cells".format(timings["getHours apply"] / timings["parseHours"], len(cells)))
+    return timings
+
+if __name__ == "__main__":
+    checkEquivalence()
+    benchmarkTimeParsing()
@@ -1,11 +1,13 @@
 ### IMPORTS
-import mysql.connector
-from mysql.connector import Error
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 import pandas as pd
+import time
 from wserSetup import *
+from wserSearch import findParticipants
+from wserPercentiles import percentileRank, quantileSeconds, timeSeconds
 from cycler import cycler
 
 ### "HELPER" FUNCTIONS
@@ -13,12 +15,17 @@ from cycler import cycler
 # Checks that database exists
 def databaseSetup():
     connection = createServerConnection(hostName, userName, password)
-    dbExists = len(readQuery(connection, "SHOW DATABASES LIKE '{}'".format(databaseName)))
-    if dbExists == 0:
+    if not databaseExists(connection, databaseName):
         print("Database does not exist. Setting up...")
         createAndPopulateDatabase()
     else:
         print("Database already exists!")
+        dbConnection = createDatabaseConnection(hostName, userName, password, databaseName)
+        if getSchemaVersion(dbConnection) < schemaVersion:
+            migrateToLongSplits(dbConnection)
+        else:
+            createSplitViews(dbConnection)
+        dbConnection.close()
     connection.close()
 
 # Converts hh, mm, ss to fractional hours
@@ -29,6 +36,31 @@ def fractionalHours(hh, mm, ss):
 def calculatePace(miles, hours):
     return 60.0 * hours / miles
 
+# Calculates elapsed and split pace for a runners x stations array of elapsed hours (NaN = no split at that station)
+# fromPreviousSplit: measure each split from the runner's last station with a split (otherwise it is NaN unless
+# both neighbouring stations have splits)
+def paceMatrices(elapsedHours, mileMarkers, fromPreviousSplit=False):
+    miles = np.asarray(mileMarkers, dtype=float)
+    elapsedPace = calculatePace(miles, elapsedHours)
+    splitPace = np.empty_like(elapsedPace)
+    if fromPreviousSplit:
+        stations = np.arange(elapsedHours.shape[1])
+        lastSplit = np.maximum.accumulate(np.where(np.isnan(elapsedHours), -1, stations), axis=1)
+        previous = np.full_like(lastSplit, -1)
+        previous[:, 1:] = lastSplit[:, :-1]                                                 # -1: measured from the start
+        previousHours = np.where(previous >= 0, np.take_along_axis(elapsedHours, np.maximum(previous, 0), axis=1), 0.0)
+        previousMiles = np.where(previous >= 0, miles[np.maximum(previous, 0)], 0.0)
+        splitPace[:] = calculatePace(miles - previousMiles, elapsedHours - previousHours)
+        return elapsedPace, splitPace
+    splitPace[:, 0] = elapsedPace[:, 0]
+    splitPace[:, 1:] = calculatePace(np.diff(miles), np.diff(elapsedHours, axis=1))     # NaN unless both stations have splits
+    return elapsedPace, splitPace
+
+# Averages each column of a pace matrix over the runners that have a value there
+def columnAverage(paceMatrix):
+    hasValue = ~np.isnan(paceMatrix)
+    return np.divide(np.where(hasValue, paceMatrix, 0.0).sum(axis=0), hasValue.sum(axis=0))
+
 # Plot pacing over course of race
 def plotPaceDistribution(title, labels, x, y):
 
@@ -57,42 +89,107 @@ def plotPaceDistribution(title, labels, x, y):
     plt.legend(loc='best')
     plt.show()
 
-### ANALYSIS FUNCTIONS
-
-# Sorts finishers by 2-hr bins
-def finishTimeDistributionByBins():
-
-    print("Connecting to database")
-    connection = createDatabaseConnection(hostName, userName, password, databaseName)
-
-    # Query to get number of finish times within a bin
-    binFinishQuery = lambda gender, lowerBin, upperBin: """
-    SELECT COUNT(*)
-    FROM participants
-    JOIN split_finish
-        ON split_finish.bib LIKE participants.bib
-    WHERE participants.gender LIKE '{}'
-    AND split_finish.hours >= {}
-    AND split_finish.hours < {};""".format(gender, lowerBin, upperBin)
-
-    bins = [0,16,18,20,22,24,26,28,30]      # finish time markers
-    numBins = len(bins) - 1                   # number of bins
-    maleBins = np.zeros(numBins)              # number of male finishers in each bin
-    femaleBins = np.zeros(numBins)            # number of female finishers in each bin
-    binLabels = [None] * numBins              # bin labels
+# Fetches every participant's attributes and finish time in one query (finishSeconds is NULL for non-finishers)
+# searchParams: optional SQL "WHERE" clause on participants (i.e. "country LIKE 'USA'")
+# years: one year, an inclusive (first, last) range or a list of years (default raceYear), all served by one scan
+def fetchFinishRecords(connection, searchParams="", years=None):
+    if len(searchParams) > 0 and "WHERE" not in searchParams:
+        searchParams = "WHERE " + searchParams
+    searchParams = searchParams.replace("WHERE", "AND", 1)
+    recordsQuery = """
+        SELECT participants.year, participants.bib, gender, age, country, finish.elapsed_seconds
+        FROM participants
+        LEFT JOIN splits AS finish
+            ON finish.year = participants.year
+            AND finish.bib = participants.bib
+            AND finish.station_idx = {}
+        WHERE {} {};""".format(aidStations.index('Finish'), yearCondition(years), searchParams)
+    columns = ['year', 'bib', 'gender', 'age', 'country', 'finishSeconds']
+    records = pd.DataFrame(readQuery(connection, recordsQuery), columns=columns)
+    records['finishSeconds'] = records['finishSeconds'].astype(float)
+    records['finishHours'] = records['finishSeconds'] / 3600.0
+    return records
+
+# Labels for the bins defined by a list of edges
+def formatBinLabels(binEdges, inclusiveUpper=False):
+    offset = 1 if inclusiveUpper else 0
+    return ["{}-{}".format(binEdges[i], binEdges[i+1] - offset) for i in range(len(binEdges) - 1)]
+
+# Bins and aggregates finish records without further queries
+# binColumn/binEdges: column to bin and its bin edges (lower <= value < upper; values outside are dropped)
+# groupBy: extra grouping columns, either a column name ('gender', 'country', 'year') or a (column, edges) pair to bin it ('age', [20, 30, 40])
+# aggregates: 'count', 'mean', 'median' or percentiles 'pNN', computed over valueColumn (finishers only)
+def aggregateRecords(records, binColumn, binEdges, groupBy=(), aggregates=('count',), valueColumn='finishSeconds'):
+    records = records[records[valueColumn].notna()]
+    binEdges = np.asarray(binEdges)
+    numBins = len(binEdges) - 1
+
+    # integer key per record: bin index + one code per grouping column
+    binIdx = np.digitize(records[binColumn].to_numpy(dtype=float), binEdges) - 1
+    keep = (binIdx >= 0) & (binIdx < numBins)
+    keyColumns = [('bin', binIdx, formatBinLabels(list(binEdges)))]
+    for group in groupBy:
+        if isinstance(group, str):
+            groupValues, groupCodes = np.unique(records[group].astype(str).to_numpy(), return_inverse=True)
+            keyColumns.append((group, groupCodes, list(groupValues)))
+        else:
+            column, edges = group
+            codes = np.digitize(records[column].to_numpy(dtype=float), edges) - 1
+            keep &= (codes >= 0) & (codes < len(edges) - 1)
+            keyColumns.append((column + 'Bin', codes, formatBinLabels(list(edges), inclusiveUpper=True)))
+
+    sizes = [len(labels) for _, _, labels in keyColumns]
+    flatKey = np.ravel_multi_index([codes[keep] for _, codes, _ in keyColumns], sizes) if keep.any() else np.zeros(0, dtype=int)
+    values = records[valueColumn].to_numpy(dtype=float)[keep]
+    numKeys = int(np.prod(sizes))
+
+    # one row per (bin, group...) combination
+    grid = np.unravel_index(np.arange(numKeys), sizes)
+    table = pd.DataFrame({name: np.asarray(labels)[grid[i]] for i, (name, _, labels) in enumerate(keyColumns)})
+    table['binIdx'] = grid[0]
+    counts = np.bincount(flatKey, minlength=numKeys)
+    order = np.argsort(flatKey, kind='stable')
+    groupedValues = np.split(values[order], np.cumsum(counts)[:-1])
+    for aggregate in aggregates:
+        if aggregate == 'count':
+            table['count'] = counts
+        elif aggregate == 'mean':
+            table['mean'] = np.divide(np.bincount(flatKey, weights=values, minlength=numKeys), counts,
+                                      out=np.full(numKeys, np.nan), where=counts > 0)
+        else:
+            q = 50.0 if aggregate == 'median' else float(aggregate[1:])
+            table[aggregate] = [np.percentile(group, q) if len(group) else np.nan for group in groupedValues]
+    return table
+
+# Histogram/aggregation engine: one query, any number of bins, groups and aggregates
+def finishTimeHistogram(binColumn='finishHours', binEdges=(0, 16, 18, 20, 22, 24, 26, 28, 30), groupBy=('gender',),
+                        aggregates=('count',), searchParams="", years=None):
+    connection = getPooledConnection()
+    records = fetchFinishRecords(connection, searchParams, years)
+    connection.close()
+    return aggregateRecords(records, binColumn, binEdges, groupBy, aggregates)
 
-    for i in range(0, numBins):
+# Per-bin values of one aggregate for one group (bins with no match are filled)
+def binSeries(table, aggregate, fill=0, **groupValues):
+    selected = table
+    for column, value in groupValues.items():
+        selected = selected[selected[column] == value]
+    series = np.full(table['binIdx'].max() + 1, fill, dtype=float)
+    series[selected['binIdx'].to_numpy()] = selected[aggregate].fillna(fill).to_numpy()
+    return series
 
-        # upper and lower hourly limits of bin
-        lowerBin = bins[i]                  
-        upperBin = bins[i+1]
+### ANALYSIS FUNCTIONS
 
-        # get number of finishers within that time bin
-        maleBins[i] = readQuery(connection, binFinishQuery('M', lowerBin, upperBin))[0][0]
-        femaleBins[i] = readQuery(connection, binFinishQuery('F', lowerBin, upperBin))[0][0]
+# Sorts finishers by 2-hr bins
+# years: one year, a (first, last) range such as (2010, 2023) or a list of years
+def finishTimeDistributionByBins(bins=(0,16,18,20,22,24,26,28,30), years=None):
 
-        # display results
-        binLabels[i] = "{}-{}".format(lowerBin, upperBin)
+    # Number of finishers per (bin, gender) from one query
+    table = finishTimeHistogram('finishHours', bins, groupBy=['gender'], aggregates=['count'], years=years)
+    numBins = len(bins) - 1                   # number of bins
+    maleBins = binSeries(table, 'count', gender='M')      # number of male finishers in each bin
+    femaleBins = binSeries(table, 'count', gender='F')    # number of female finishers in each bin
+    binLabels = formatBinLabels(list(bins))   # bin labels
 
     # Plot results
     xAxis = np.arange(numBins)
@@ -101,88 +198,238 @@ def finishTimeDistributionByBins():
     plt.xticks(xAxis, binLabels)
     plt.xlabel('Finish Time (Hours)')
     plt.ylabel('Number of Finishers')
-    plt.title('WSER 2023 Finish Time Distribution')
+    plt.title('WSER {} Finish Time Distribution'.format(yearLabel(years)))
     plt.legend()
     plt.show()
 
+# Finds the participants for bibs, names (looked up like nameAndBibNumber, best match in `year`) and/or (year, bib) pairs
+# Returns (year, bib, firstName, lastName, searchTerm) per term found; terms that match nobody are reported and skipped
+def findRunners(searchTerms, year=None, connection=None):
+    runners = []
+    for searchTerm in searchTerms:
+        if isinstance(searchTerm, tuple):
+            matches = findParticipants(str(searchTerm[1]), int(searchTerm[0]), limit=1, connection=connection)
+        else:
+            matches = findParticipants(str(searchTerm), year or raceYear, limit=1, connection=connection)
+        if len(matches) == 0:
+            print("Participant not found using search terms: {}".format(searchTerm))
+            continue
+        runners.append(matches[0] + (searchTerm,))
+    return runners
+
+# runners x stations elapsed hours (NaN = no split at that station) of runners given as (year, bib, ...), from one query
+def elapsedHoursMatrix(connection, runners):
+    keys = [(runner[0], runner[1]) for runner in runners]
+    position = {key: i for i, key in enumerate(dict.fromkeys(keys))}
+    splits = readQuery(connection, splitMatrixQuery(position)) if len(position) > 0 else []
+    uniqueHours = np.full((len(position), len(aidStations)), np.nan)
+    if len(splits) > 0:
+        rows = np.array([position[(year, bib)] for year, bib, _, _ in splits])
+        stations = np.array([split[2] for split in splits])
+        uniqueHours[rows, stations] = np.array([split[3] for split in splits], dtype=float) / 3600.0
+    return uniqueHours[[position[key] for key in keys]].reshape(len(keys), len(aidStations))
+
+# Looks at pacing of many participants in one pass: one split query for all of them and vectorized pace math
+# searchTerms: bibs or names (best match in `year`, default raceYear) and/or (year, bib) pairs
+# Returns the runners found (DataFrame: year, bib, firstName, lastName, searchTerm), the mile markers and
+# runners x stations arrays of elapsed hours, elapsed pace and split pace (NaN = no split at that station;
+# split pace is measured from the runner's previous station with a split)
+def pacingParticipants(searchTerms, plotOutput=False, year=None):
+
+    connection = getPooledConnection()
+    runners = findRunners(searchTerms, year, connection)
+    elapsedHours = elapsedHoursMatrix(connection, runners)
     connection.close()
+    mileMarkers = list(aidStationDetails.values())
+    elapsedPace, splitPace = paceMatrices(elapsedHours, mileMarkers, fromPreviousSplit=True)
 
-# Looks at overall pacing distribution for a participant
-def pacingIndividualParticipant(searchTerm, plotOutput=False):
+    # Plot results (elapsed and split pace per runner, over the stations each has splits at)
+    if plotOutput and len(runners) > 0:
+        labels, xvals, yvals = [], [], []
+        miles = np.asarray(mileMarkers)
+        for i, (runnerYear, bib, firstName, lastName, _) in enumerate(runners):
+            hasSplit = ~np.isnan(elapsedHours[i])
+            for kind, pace in [('Elapsed', elapsedPace), ('Split', splitPace)]:
+                labels.append("{} {} ({}) - {}".format(firstName, lastName, runnerYear, kind))
+                xvals.append(miles[hasSplit])
+                yvals.append(pace[i][hasSplit])
+        plotPaceDistribution('WSER {} Pacing'.format(yearLabel(sorted(set(runner[0] for runner in runners)))), labels, xvals, yvals)
 
-    connection = createDatabaseConnection(hostName, userName, password, databaseName)
+    runners = pd.DataFrame(runners, columns=['year', 'bib', 'firstName', 'lastName', 'searchTerm'])
+    return runners, mileMarkers, elapsedHours, elapsedPace, splitPace
 
-    # Pre-allocate arrays
-    mileMarkers = []    # mile markers
-    overallTime = []    # elapsed time (hours) for the entire race at each mile marker
-    elapsedPace = []    # average pace (minutes) for entire race at each mile marker
-    splitPace   = []    # average pace (minutes) between mile markers
+# Looks at overall pacing distribution for a participant (one row of the batch arrays)
+def pacingIndividualParticipant(searchTerm, plotOutput=False, year=None):
+
+    connection = getPooledConnection()
 
     # Get some participant info
-    try:
-        firstName, lastName, bibNumber = nameAndBibNumber(searchTerm)
-    except TypeError:
+    runners = findRunners([searchTerm], year, connection)
+    if len(runners) == 0:
+        connection.close()
         return None     # participant is not found
+    _, bibNumber, firstName, lastName, _ = runners[0]
 
-    splitQuery = lambda aidStationName: """
-        SELECT hours, minutes, seconds
-        FROM split_{}
-        WHERE split_{}.bib LIKE '{}';""".format(aidStationName, aidStationName, bibNumber)
-
-    # Get split at each aid station
-    for i, aidStationName in enumerate(aidStations):
-
-        # Query for split at aid station
-        result = readQuery(connection, splitQuery(aidStationName))
-
-        if(len(result) != 0):       # check that a split was saved at that aid station
-
-            # Hours, minutes, second split at aid station
-            hh = result[0][0]
-            mm = result[0][1]
-            ss = result[0][2]
-
-            # Save data from that aid station
-            mileMarkers.append(aidStationDetails[aidStationName])
-            overallTime.append(fractionalHours(hh, mm, ss))
-            elapsedPace.append(calculatePace(mileMarkers[-1], overallTime[-1]))
-            if i == 0:
-                splitPace.append(elapsedPace[-1])
-            else:
-                splitPace.append(calculatePace(mileMarkers[-1] - mileMarkers[-2], overallTime[-1] - overallTime[-2]))
+    # Get full split vector in one query, keeping the aid stations the participant has splits at
+    elapsedHours = elapsedHoursMatrix(connection, runners)
+    connection.close()
+    elapsedPace, splitPace = paceMatrices(elapsedHours, list(aidStationDetails.values()), fromPreviousSplit=True)
+    hasSplit = ~np.isnan(elapsedHours[0])
+    mileMarkers = np.array(list(aidStationDetails.values()))[hasSplit].tolist()     # mile markers
+    elapsedPace = elapsedPace[0][hasSplit].tolist()     # average pace (minutes) for entire race at each mile marker
+    splitPace = splitPace[0][hasSplit].tolist()         # average pace (minutes) between mile markers
 
     # Plot results
     if plotOutput:
-        plotPaceDistribution('WSER 2023 Pacing\n Bib #{}: {} {}'.format(bibNumber, firstName, lastName),
-                             Elapsed=['Elapsed', mileMarkers,elapsedPace],
-                             Split=['Split', mileMarkers, splitPace])
-
-    connection.close()
+        plotPaceDistribution('WSER {} Pacing\n Bib #{}: {} {}'.format(yearLabel(year), bibNumber, firstName, lastName),
+                             labels=['Elapsed', 'Split'], x=[mileMarkers, mileMarkers], y=[elapsedPace, splitPace])
 
     # Return all data in case we want to use it
     return mileMarkers, elapsedPace, splitPace
 
 # Returns a subset of field as dataframe and plots pacing
 # searchParams: SQL "WHERE" clauses (i.e. ..."WHERE gender LIKE 'F'" or "WHERE hours < 24")
-def subsetOfField(searchParams, plotOutput=False):
+# years: one year, a (first, last) range or a list of years (default raceYear)
+def subsetOfField(searchParams, plotOutput=False, years=None):
 
-    print("Connecting to database")
-    connection = createDatabaseConnection(hostName, userName, password, databaseName)
+    connection = getPooledConnection()
 
     # Format queries
     if len(searchParams) > 0 and "WHERE" not in searchParams:
         searchParams = "WHERE " + searchParams
 
+    # Finishers and their full split vectors in one pivoted fetch
+    finishersQuery = """
+        SELECT participants.bib, firstName, lastName, age, gender, place, hours, minutes, seconds, {}
+        FROM participants
+        JOIN ({}) AS split_finish
+            ON split_finish.year = participants.year AND split_finish.bib = participants.bib
+        JOIN ({}) AS pivot
+            ON pivot.year = participants.year AND pivot.bib = participants.bib {}
+        """.format(", ".join("pivot.s{}".format(i) for i in range(len(aidStations))),
+                   finishSplitsQuery(years), splitPivotQuery(years), searchParams)
+
+    mileMarkers = list(aidStationDetails.values())          # mile markers of each aid station
+    numColumns = 9                                          # participant/finish columns ahead of the split vector
+
+    # get all finishers
+    finishers = readQuery(connection, finishersQuery)
+    finishersList = [list(finisher[:numColumns]) for finisher in finishers]
+
+    # runners x stations elapsed hours (None -> NaN for missing splits)
+    elapsedHours = np.array([finisher[numColumns:] for finisher in finishers], dtype=float).reshape(len(finishers), len(aidStations)) / 3600.0
+    for row, col in np.argwhere(np.isnan(elapsedHours)):
+        print("NOTE: Bib # {} has no results at {} (mile {}).".format(finishersList[row][0], aidStations[col], mileMarkers[col]))
+
+    # average pace of the field at each aid station, over runners with a split there
+    elapsedPace, splitPace = paceMatrices(elapsedHours, mileMarkers)
+    averageOverallPace = columnAverage(elapsedPace)
+    averageSplitPace = columnAverage(splitPace)
+
+    # Plot results
+    if (plotOutput):
+        title = 'WSER {} Pacing \n Field Subset: {}'.format(yearLabel(years), searchParams)
+        plotPaceDistribution(title, labels=['Elapsed', 'Split'], x=[mileMarkers, mileMarkers],
+                             y=[averageOverallPace, averageSplitPace])
+
+    connection.close()
+    columns = ['bib', 'firstName', 'lastName', 'age', 'gender', 'place', 'hours', 'minutes', 'seconds']
+    return pd.DataFrame(finishersList, columns=columns), mileMarkers, averageOverallPace, averageSplitPace
+
+# Average pacing of a year's finishers from a split matrix (wserSplitMatrix) instead of the database
+# selected: optional runner mask, i.e. matrix.runners.gender == 'F' (finishers outside it are left out)
+# Returns the same finishers table, mile markers and average paces as subsetOfField
+def subsetOfSplitMatrix(matrix, selected=None, plotOutput=False):
+    rows = matrix.finishers() if selected is None else matrix.finishers() & np.asarray(selected)
+    elapsedPace, splitPace = paceMatrices(matrix.hours(rows), matrix.miles)
+    averageOverallPace = columnAverage(elapsedPace)
+    averageSplitPace = columnAverage(splitPace)
+    mileMarkers = matrix.miles.tolist()
+    if plotOutput:
+        plotPaceDistribution('WSER {} Pacing \n Field Subset: {} runners'.format(matrix.year, int(rows.sum())), labels=['Elapsed', 'Split'],
+                             x=[mileMarkers, mileMarkers], y=[averageOverallPace, averageSplitPace])
+    finishSeconds = matrix.seconds[rows, matrix.station('Finish')]
+    finishers = pd.DataFrame({'bib': matrix.runners.bib[rows], 'firstName': matrix.runners.firstName[rows],
+                              'lastName': matrix.runners.lastName[rows], 'age': matrix.runners.age[rows],
+                              'gender': matrix.runners.gender[rows], 'place': matrix.runners.overallPlace[rows],
+                              'hours': finishSeconds // 3600, 'minutes': (finishSeconds // 60) % 60, 'seconds': finishSeconds % 60})
+    return finishers, mileMarkers, averageOverallPace, averageSplitPace
+
+# Where a time at an aid station ranks in a field subset, from the precomputed percentile tables (binary search per year)
+# elapsed: "h:mm[:ss]" or seconds; split=True ranks the time since the previous aid station instead of the elapsed time
+# gender: 'M'/'F'; age: a runner's age (ranks within that age decade); finish: 'finisher', 'silver' (sub-24), 'bronze' or 'dnf'
+# years: one year, a (first, last) range or a list of years (default raceYear)
+# Returns {'rank': 1 = fastest, 'count': runners with a time there, 'percentile': share of them the time beats} or None
+def percentileAtStation(station, elapsed, years=None, gender=None, age=None, finish=None, split=False):
+    return percentileRank(station, elapsed, years, gender, age, finish, 'split' if split else 'elapsed')
+
+# Split pace (minutes per mile from the previous aid station) at quantile q of a field subset, i.e. the median split pace
+# to RuckyChucky for sub-24 runners: splitPaceQuantile('RuckyChucky', 0.5, finish='silver'); None if nobody matches
+def splitPaceQuantile(station, q=0.5, years=None, gender=None, age=None, finish=None):
+    seconds = quantileSeconds(station, q, years, gender, age, finish, 'split')
+    if seconds is None:
+        return None
+    stationIdx = aidStations.index(station)
+    miles = aidStationDetails[station] - (aidStationDetails[aidStations[stationIdx - 1]] if stationIdx > 0 else 0.0)
+    return calculatePace(miles, seconds / 3600.0)
+
+# percentileAtStation computed from the raw splits on every call (no tables), kept for timing comparisons
+def percentileAtStationFromSplits(station, elapsed, years=None, gender=None, age=None, finish=None):
+    connection = getPooledConnection()
+    percentileQuery = """
+        SELECT station.elapsed_seconds, participants.gender, participants.age, finish.elapsed_seconds
+        FROM splits AS station
+        JOIN participants
+            ON participants.year = station.year AND participants.bib = station.bib
+        LEFT JOIN splits AS finish
+            ON finish.year = station.year AND finish.bib = station.bib AND finish.station_idx = {}
+        WHERE station.station_idx = {} AND {};""".format(aidStations.index('Finish'), aidStations.index(station),
+                                                       yearCondition(years, 'station.year'))
+    rows = readQuery(connection, percentileQuery)
+    connection.close()
+    times = np.array([row[0] for row in rows], dtype=float)
+    selected = np.ones(len(rows), dtype=bool)
+    if gender is not None:
+        selected &= np.array([row[1] == gender for row in rows], dtype=bool)
+    if age is not None:
+        low = min(int(age) // 10 * 10, 80)
+        ages = np.array([row[2] if row[2] is not None else -1 for row in rows])
+        selected &= (ages >= low) & ((ages < low + 10) | (low == 80))
+    if finish is not None:
+        finishHours = np.array([row[3] / 3600.0 if row[3] is not None else np.inf for row in rows])
+        selected &= {'finisher': finishHours < 30.0, 'silver': finishHours < 24.0,
+                     'bronze': (finishHours >= 24.0) & (finishHours < 30.0), 'dnf': finishHours == np.inf}[finish]
+    times = times[selected]
+    if len(times) == 0:
+        return None
+    seconds = timeSeconds(elapsed)
+    faster, tied = int((times < seconds).sum()), int((times == seconds).sum())
+    return {'rank': faster + 1, 'count': len(times), 'percentile': 100.0 * (len(times) - faster - tied + 0.5 * tied) / len(times)}
+
+# Original subsetOfField (one query per finisher per aid station), kept for timing comparisons
+# years: one year, a (first, last) range or a list of years (default raceYear; a schema v1 database holds raceYear only)
+def subsetOfFieldPerStation(searchParams, plotOutput=False, years=None):
+
+    connection = getPooledConnection()
+
+    # Format queries (in schema v2 the split_<station> views hold every year, so both sides are filtered on year)
+    if len(searchParams) > 0 and "WHERE" not in searchParams:
+        searchParams = "WHERE " + searchParams
+    v2 = getSchemaVersion(connection) >= 2
+    yearJoin = "AND split_finish.year = participants.year" if v2 else ""
+    yearFilter = "{} {}".format("AND" if len(searchParams) > 0 else "WHERE", yearCondition(years)) if v2 else ""
+
     finishersQuery = """
-        SELECT participants.bib, firstName, lastName, age, gender, place, hours, minutes, seconds
+        SELECT participants.bib, firstName, lastName, age, gender, place, hours, minutes, seconds, {}
         FROM participants
         JOIN split_finish
-            ON participants.bib LIKE split_finish.bib {}
-        """.format(searchParams)
-    splitQuery = lambda aidStationName, bibNumber: """
+            ON participants.bib LIKE split_finish.bib {} {} {}
+        """.format("participants.year" if v2 else raceYear, yearJoin, searchParams, yearFilter)
+    splitQuery = lambda aidStationName, bibNumber, year: """
         SELECT hours, minutes, seconds
         FROM split_{}
-        WHERE split_{}.bib LIKE '{}'""".format(aidStationName, aidStationName, bibNumber)
+        WHERE split_{}.bib LIKE '{}' {}""".format(aidStationName, aidStationName, bibNumber,
+                                                  "AND split_{}.year = {}".format(aidStationName, year) if v2 else "")
 
     # set up arrays
     mileMarkers = list(aidStationDetails.values())          # mile markers of each aid station
@@ -197,14 +444,14 @@ def subsetOfField(searchParams, plotOutput=False):
 
     # iterate through participants
     for finisher in finishers:
-        finishersList.append(list(finisher))
-        bib = finisher[0]
+        finishersList.append(list(finisher[:-1]))
+        bib, year = finisher[0], finisher[-1]
 
         # iterate through aid stations
         for i, aidStation in enumerate(aidStations):
 
             # get participant result at that aid station
-            currentSplitData = readQuery(connection, splitQuery(aidStation, bib))
+            currentSplitData = readQuery(connection, splitQuery(aidStation, bib, year))
 
             # if participant has non-null results at an aid station, add that to overall pacing
             if len(currentSplitData) != 0:
@@ -221,7 +468,7 @@ def subsetOfField(searchParams, plotOutput=False):
                     averageSplitPace[i] = averageSplitPace[i] + participantOverallPace
                     numDatapointsSplit[i] = numDatapointsSplit[i] + 1
                 else:
-                    previousSplitData = readQuery(connection, splitQuery(aidStations[i-1], bib))
+                    previousSplitData = readQuery(connection, splitQuery(aidStations[i-1], bib, year))
                     if len(previousSplitData) != 0:
                         hh_prev = previousSplitData[0][0]
                         mm_prev = previousSplitData[0][1]
@@ -240,51 +487,48 @@ def subsetOfField(searchParams, plotOutput=False):
 
     # Plot results
     if (plotOutput):
-        title = 'WSER 2023 Pacing \n Field Subset: {}'.format(searchParams)
-        plotPaceDistribution(title, Elapsed=['Elapsed', mileMarkers,averageOverallPace],
-                             Split=['Split', mileMarkers,averageSplitPace])
+        title = 'WSER {} Pacing \n Field Subset: {}'.format(yearLabel(years), searchParams)
+        plotPaceDistribution(title, labels=['Elapsed', 'Split'], x=[mileMarkers, mileMarkers],
+                             y=[averageOverallPace, averageSplitPace])
+    connection.close()
     columns = ['bib', 'firstName', 'lastName', 'age', 'gender', 'place', 'hours', 'minutes', 'seconds']
     return pd.DataFrame(finishersList, columns=columns), mileMarkers, averageOverallPace, averageSplitPace
 
+# Times subsetOfField against the original per-station implementation and checks they agree
+def compareSubsetOfField(searchParams="", repeats=3, years=None):
+    timings = {}
+    outputs = {}
+    for name, function in [("per-station", subsetOfFieldPerStation), ("pivoted", subsetOfField)]:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            outputs[name] = function(searchParams, years=years)
+        timings[name] = (time.perf_counter() - start) / repeats
+
+    _, _, legacyOverall, legacySplit = outputs["per-station"]
+    _, _, overall, split = outputs["pivoted"]
+    match = np.allclose(legacyOverall, overall, equal_nan=True) and np.allclose(legacySplit, split, equal_nan=True)
+    print("subsetOfField('{}'): per-station {:.3f} s, pivoted {:.3f} s ({:.1f}x), results match: {}".format(
+        searchParams, timings["per-station"], timings["pivoted"], timings["per-station"] / max(timings["pivoted"], 1e-9), match))
+    return timings
+
 # Distribution of finish times by age
-def distributionByAge(numBins=10):
+def distributionByAge(numBins=10, years=None):
 
-    print("Connecting to database")
-    connection = createDatabaseConnection(hostName, userName, password, databaseName)
+    connection = getPooledConnection()
+    records = fetchFinishRecords(connection, years=years)
+    connection.close()
 
     # Set up bins
-    minAge = readQuery(connection, "SELECT MIN(age) FROM participants")[0][0]
-    maxAge = readQuery(connection, "SELECT MAX(age) FROM participants")[0][0]
+    minAge = int(records['age'].min())
+    maxAge = int(records['age'].max())
     binSize = np.ceil((maxAge - minAge) / numBins)
-    binLimits = np.arange(minAge - np.floor(binSize/2), maxAge + np.ceil(binSize/2), binSize, dtype=int)     # age group bins
-    meanHrsM = np.zeros(numBins)                      # store average times (M finishers)
-    meanHrsW = np.zeros(numBins)                      # store average times (W finishers)
-    binLabels = [""] * numBins
-
-    # Get participants in each bin
-    queryByAgeAndGender = lambda min, max, gender: """
-        SELECT AVG(hours), AVG(minutes), AVG(seconds), COUNT(*)
-        FROM split_finish
-        JOIN participants
-            ON participants.bib LIKE split_finish.bib
-        WHERE participants.age >= {} AND participants.age < {} AND participants.gender LIKE '{}';
-    """.format(min, max, gender)
-
-    for i in range(0, numBins):
-        results_m = readQuery(connection, queryByAgeAndGender(binLimits[i], binLimits[i+1], 'M'))
-        results_w = readQuery(connection, queryByAgeAndGender(binLimits[i], binLimits[i+1], 'F'))
-        hm, mm, sm, cm = results_m[0][0], results_m[0][1], results_m[0][2], results_m[0][3]
-        hw, mw, sw, cw = results_w[0][0], results_w[0][1], results_w[0][2], results_w[0][3]
-
-        if float(cm) != 0:
-            meanHrsM[i] = fractionalHours(float(hm), float(mm), float(sm))
-        else:
-            meanHrsM[i] = 0
-        if float(cw) != 0:
-            meanHrsW[i] = fractionalHours(float(hw), float(mw), float(sw))
-        else:
-            meanHrsW[i] = 0
-        binLabels[i] = "{}-{}".format(binLimits[i], binLimits[i+1]-1)
+    binLimits = (minAge - np.floor(binSize/2) + binSize * np.arange(numBins + 1)).astype(int)              # numBins age group bins
+
+    # Mean finish time per (age bin, gender)
+    table = aggregateRecords(records, 'age', binLimits[:numBins+1], groupBy=['gender'], aggregates=['mean'], valueColumn='finishHours')
+    meanHrsM = binSeries(table, 'mean', gender='M')     # store average times (M finishers)
+    meanHrsW = binSeries(table, 'mean', gender='F')     # store average times (W finishers)
+    binLabels = ["{}-{}".format(binLimits[i], binLimits[i+1]-1) for i in range(0, numBins)]
 
     # Plot results
     xAxis = np.arange(numBins)
@@ -293,48 +537,37 @@ def distributionByAge(numBins=10):
     plt.xticks(xAxis, binLabels)
     plt.xlabel('Age')
     plt.ylabel('Mean Finish Time')
-    plt.title('WSER Finish Time By Age')
+    plt.title('WSER {} Finish Time By Age'.format(yearLabel(years)))
     plt.legend()
     plt.show()
 
-# Gets participant name and bib number from either bib, first name, or last name
-def nameAndBibNumber(searchTerm):
+# Gets participant name and bib number from either bib, first name, or last name (best match in the participant index)
+# connection: reuse the caller's connection (otherwise one is borrowed from the pool)
+# year: race year to search (default raceYear)
+def nameAndBibNumber(searchTerm, connection=None, year=None):
 
-    connection = createDatabaseConnection(hostName, userName, password, databaseName)
-    infoQuery = ""
-
-    # User entered a bib number if search term contains numeric digits 0 - 9; otherwise lookup by name
-    if not (" " in searchTerm) and not searchTerm.isalpha():
-        infoQuery = """
-            SELECT firstName, lastName, bib
-            FROM participants
-            WHERE participants.bib LIKE '{}'""".format(searchTerm)
-    else:
-        firstAndLast = searchTerm.split(" ")
-        if len(firstAndLast) == 2:
-            infoQuery = """
-            SELECT firstName, lastName, bib
-            FROM participants
-            WHERE participants.lastName LIKE '{}' 
-            AND participants.firstName LIKE '{}'""".format(str(firstAndLast[1]), str(firstAndLast[0]))
-        else:
-            infoQuery = """
-            SELECT firstName, lastName, bib
-            FROM participants
-            WHERE participants.lastName LIKE '{}' 
-            OR participants.firstName LIKE '{}'""".format(str(firstAndLast[0]), str(firstAndLast[0]))
-
-    # Get participant basic info
-    basicInfo = readQuery(connection, infoQuery)
-    connection.close()
-    if (len(basicInfo) != 0):
-        firstName = basicInfo[0][0]
-        lastName = basicInfo[0][1]
-        bibNumber = basicInfo[0][2]
+    matches = findParticipants(searchTerm, year or raceYear, limit=1, connection=connection)
+    if len(matches) != 0:
+        _, bibNumber, firstName, lastName = matches[0]
         return firstName, lastName, bibNumber
     else:
         return None     # participant not found
 
+# Asks the user which runner they meant when a search matches several (all years); returns (year, bib, first, last) or None
+def chooseParticipant(searchTerm, limit=20):
+    matches = findParticipants(searchTerm, limit=limit)
+    if len(matches) <= 1:
+        return matches[0] if matches else None
+    print("{} runners match {}:".format(len(matches) if len(matches) < limit else "{}+".format(limit), searchTerm))
+    for i, (year, bib, firstName, lastName) in enumerate(matches, start=1):
+        print("({}) {} {} - bib {}, {}".format(i, firstName, lastName, bib, year))
+    choice = str.strip(input("Select runner, or ENTER for (1) > "))
+    if choice == "":
+        return matches[0]
+    if choice.isdigit() and 1 <= int(choice) <= len(matches):
+        return matches[int(choice) - 1]
+    return None
+
 ### MAIN SCRIPT
 def main():
 
@@ -384,9 +617,9 @@ def main():
                         searchTerm = str.strip(input("Enter first name, last name, or bib number > "))
                         try:
 
-                            # get participant info
-                            miles, elapsed, splits = pacingIndividualParticipant(searchTerm)
-                            first, last, bib = nameAndBibNumber(searchTerm)
+                            # get participant info (several matching runners are listed to choose from)
+                            year, bib, first, last = chooseParticipant(searchTerm)
+                            miles, elapsed, splits = pacingIndividualParticipant(bib, year=year)
 
                             # save info for later plots
                             labels.append("{} {} - Elapsed".format(first, last))
@@ -444,6 +677,8 @@ def main():
             # Plot finish time distribution
             case "4":
                 print("Exiting program.")
+                printPoolStats()
+                printQueryCacheStats()
                 endProgram = True
 
             case _:
@@ -453,7 +688,15 @@ def main():
               "***")
 
 
-if __name__ == "main":
+# Usage: python wserAnalysis.py [--sqlite [path]] [--query-stats] [--slow-ms MS]   (default: MySQL server at hostName)
+#   --query-stats prints per-query-shape counts, latency histograms and callers on exit
+#   --slow-ms sets the threshold for the slow-query log (slow-queries.log)
+if __name__ == "__main__":
+    if "--sqlite" in sys.argv:
+        i = sys.argv.index("--sqlite")
+        useBackend('sqlite', sys.argv[i + 1] if i + 1 < len(sys.argv) and not sys.argv[i + 1].startswith("--") else ':memory:')
+    if "--query-stats" in sys.argv:
+        enableQuerySummary()
+    if "--slow-ms" in sys.argv:
+        setSlowQueryLog(float(sys.argv[sys.argv.index("--slow-ms") + 1]) / 1000.0)
     main()
-
-main()      # debug only
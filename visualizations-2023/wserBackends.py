@@ -0,0 +1,180 @@
+### IMPORTS
+import os
+import sqlite3
+try:
+    import mysql.connector
+    from mysql.connector import pooling
+except ImportError:         # the embedded backend runs without a MySQL client
+    mysql = None
+
+### BACKENDS
+# Each backend provides the same small interface used by wserSetup:
+#   serverConnection, databaseConnection, createDatabase, dropDatabase, databaseExists, tableExists,
+#   createPool, beginTransaction, formatParams, intDivide, tableOptions, errors, poolExhaustedError, alterPrimaryKey
+
+# MySQL server (original behaviour)
+class MySQLBackend:
+    name = "mysql"
+    errors = (mysql.connector.Error,) if mysql else ()
+    poolExhaustedError = mysql.connector.errors.PoolError if mysql else Exception
+    alterPrimaryKey = True          # ALTER TABLE can add columns anywhere and change the primary key in place
+
+    # Connects to the server
+    def serverConnection(self, hostName, userName, userPass):
+        if mysql is None:
+            raise ImportError("mysql-connector-python is required for the MySQL backend; use the sqlite backend instead")
+        return mysql.connector.connect(host=hostName, user=userName, passwd=userPass)
+
+    # Connects to one database on the server
+    def databaseConnection(self, hostName, userName, userPass, db):
+        return mysql.connector.connect(host=hostName, user=userName, passwd=userPass, database=db)
+
+    # Creates a database
+    def createDatabase(self, connection, databaseName):
+        cursor = connection.cursor()
+        cursor.execute("CREATE DATABASE " + databaseName)
+        cursor.close()
+
+    # Drops a database if it exists
+    def dropDatabase(self, connection, databaseName):
+        cursor = connection.cursor()
+        cursor.execute("DROP DATABASE IF EXISTS " + databaseName)
+        cursor.close()
+
+    # Checks whether a database exists on the server
+    def databaseExists(self, connection, databaseName):
+        cursor = connection.cursor(buffered=True)
+        cursor.execute("SHOW DATABASES LIKE '{}'".format(databaseName))
+        exists = len(cursor.fetchall()) != 0
+        cursor.close()
+        return exists
+
+    # Checks whether a table exists in the connected database
+    def tableExists(self, connection, tableName):
+        cursor = connection.cursor(buffered=True)
+        cursor.execute("SHOW TABLES LIKE '{}'".format(tableName))
+        exists = len(cursor.fetchall()) != 0
+        cursor.close()
+        return exists
+
+    # Creates a connection pool for one database
+    def createPool(self, size, hostName, userName, userPass, db):
+        return pooling.MySQLConnectionPool(pool_name="wser", pool_size=size, pool_reset_session=False,
+                                           host=hostName, user=userName, passwd=userPass, database=db)
+
+    # Starts a transaction unless one is already open
+    def beginTransaction(self, connection):
+        if not connection.in_transaction:
+            connection.start_transaction()
+
+    # Parameter placeholders are already in MySQL (%s) style
+    def formatParams(self, query):
+        return query
+
+    # Integer division in SQL
+    def intDivide(self, numerator, denominator):
+        return "{} DIV {}".format(numerator, denominator)
+
+    # Results tables are partitioned by year
+    def tableOptions(self):
+        return "PARTITION BY KEY(year) PARTITIONS 16"
+
+# SQLite connection that accepts mysql.connector-style cursor() arguments
+# shared connections ignore close() so an in-memory database survives between analysis functions
+class SQLiteConnection(sqlite3.Connection):
+    shared = False
+
+    def cursor(self, buffered=False):
+        return super().cursor()
+
+    def close(self):
+        if not self.shared:
+            super().close()
+
+    # Really closes a shared connection
+    def release(self):
+        super().close()
+
+# Embedded SQLite database, either a file or ':memory:'
+# there is no server, so the "server" and "database" connections are the same shared connection
+class SQLiteBackend:
+    name = "sqlite"
+    errors = (sqlite3.Error,)
+    poolExhaustedError = Exception
+    alterPrimaryKey = False         # ALTER TABLE only appends columns, so re-keying a table means rebuilding it
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.connection = None
+
+    # Opens (or reuses) the shared connection
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, factory=SQLiteConnection, check_same_thread=False)
+            self.connection.shared = True
+        return self.connection
+
+    def serverConnection(self, hostName, userName, userPass):
+        return self.connect()
+
+    def databaseConnection(self, hostName, userName, userPass, db):
+        return self.connect()
+
+    # A SQLite file/memory database always exists once opened
+    def createDatabase(self, connection, databaseName):
+        pass
+
+    # Starts over with an empty database (an in-memory database is discarded, a file is deleted)
+    def dropDatabase(self, connection, databaseName):
+        if self.connection is not None:
+            self.connection.release()
+            self.connection = None
+        if self.path != ":memory:" and os.path.exists(self.path):
+            os.remove(self.path)
+
+    # The database "exists" once it has been populated
+    def databaseExists(self, connection, databaseName):
+        return self.tableExists(connection, "participants")
+
+    def tableExists(self, connection, tableName):
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE name = ?", (tableName,))
+        exists = len(cursor.fetchall()) != 0
+        cursor.close()
+        return exists
+
+    # Every "pooled" connection is the shared connection
+    def createPool(self, size, hostName, userName, userPass, db):
+        return SQLitePool(self)
+
+    # Starts a transaction unless one is already open (sqlite3 only opens one by itself before INSERT/UPDATE/DELETE,
+    # so CREATE/ALTER/DROP would otherwise commit on their own)
+    def beginTransaction(self, connection):
+        if not connection.in_transaction:
+            connection.execute("BEGIN")
+
+    # sqlite3 uses qmark placeholders
+    def formatParams(self, query):
+        return query.replace("%s", "?")
+
+    # Integer division in SQL (both operands are integers)
+    def intDivide(self, numerator, denominator):
+        return "{} / {}".format(numerator, denominator)
+
+    # Results tables are clustered on their (year, ...) primary key, so each year is stored contiguously
+    def tableOptions(self):
+        return "WITHOUT ROWID"
+
+# Pool stand-in for the embedded backend
+class SQLitePool:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_connection(self):
+        return self.backend.connect()
+
+# Creates a backend by name
+def makeBackend(name, path=":memory:"):
+    if name == "sqlite":
+        return SQLiteBackend(path)
+    return MySQLBackend()
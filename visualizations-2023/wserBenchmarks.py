@@ -0,0 +1,287 @@
+### IMPORTS
+import contextlib
+import datetime
+import importlib.util
+import io
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')                 # the histogram cases draw their figures without opening windows
+import matplotlib.pyplot as plt
+from wserAnalysis import (createAndPopulateDatabase, useBackend, setQueryCache, pacingIndividualParticipant, pacingParticipants,
+                          subsetOfField, subsetOfSplitMatrix, percentileAtStation, percentileAtStationFromSplits,
+                          finishTimeDistributionByBins, distributionByAge)
+from wserSplitMatrix import openArchive, loadArchive
+from wserNearest import loadIndex, similarRunners
+from wserSearch import buildParticipantIndex, findParticipants
+from wserFeatures import buildFeatures, allAidStations
+from wserLogistic import fitLogistic, predictLogistic
+from wserDistribution import fitDistribution
+from wserInference import DenseModel, Standardizer, predictBuckle
+
+### GLOBAL VARIABLES
+moduleDirectory = os.path.dirname(os.path.abspath(__file__))
+resultsPath = os.path.join(moduleDirectory, "benchmark-results.json")
+defaultRepeats = 20
+defaultThreshold = 0.10           # a case is a regression when its median is more than 10% slower than the baseline's
+benchmarkBib = '14'               # runner used by the single-participant cases
+benchmarkTeam = 30                # runners compared by the batch pacing cases (the top finishers)
+stations = allAidStations[0:11]   # the detailed model's splits
+prepared = {}                     # data shared by the cases, built on first use
+
+### SETUP
+# Loads the bundled year into the benchmark database once
+def prepareDatabase():
+    if 'database' not in prepared:
+        createAndPopulateDatabase()
+        prepared['database'] = True
+
+# Detailed-model features (from the feature cache after the first build)
+def prepareFeatures():
+    if 'features' not in prepared:
+        prepared['features'] = buildFeatures(stations, dashIsMissing=True)
+    return prepared['features']
+
+# Buckle network with the detailed model's layer sizes and fixed random weights (scoring cost does not depend on the values)
+def prepareBuckleModel():
+    if 'buckle' not in prepared:
+        generator = np.random.default_rng(0)
+        sizes = [4 + len(stations), len(stations), 3]
+        kernels = [generator.normal(size=(sizes[i], sizes[i + 1])) for i in range(len(sizes) - 1)]
+        biases = [generator.normal(size=sizes[i + 1]) for i in range(len(sizes) - 1)]
+        input_train = prepareFeatures()[0]
+        prepared['buckle'] = (DenseModel(kernels, biases), Standardizer(input_train.mean(axis=0), input_train.std(axis=0) + 1e-9))
+    return prepared['buckle']
+
+### CASES
+# Each case prepares what it needs and returns the function to time; a case that cannot run here returns a reason (str)
+def caseIngestYear():
+    return lambda: createAndPopulateDatabase()
+
+def casePacingParticipant():
+    prepareDatabase()
+    return lambda: pacingIndividualParticipant(benchmarkBib)
+
+def casePacingTeamSequential():
+    prepareDatabase()
+    bibs = subsetOfField('WHERE place <= {}'.format(benchmarkTeam))[0]['bib'].tolist()
+    return lambda: [pacingIndividualParticipant(bib) for bib in bibs]
+
+def casePacingTeamBatch():
+    prepareDatabase()
+    bibs = subsetOfField('WHERE place <= {}'.format(benchmarkTeam))[0]['bib'].tolist()
+    return lambda: pacingParticipants(bibs)
+
+def caseSubsetOfField():
+    prepareDatabase()
+    return lambda: subsetOfField('')
+
+def caseSearchIndexBuild():
+    prepareDatabase()
+    return lambda: buildParticipantIndex()
+
+def caseSearchParticipant():
+    prepareDatabase()
+    return lambda: (findParticipants(benchmarkBib), findParticipants('tom'), findParticipants('dauwalter'), findParticipants('courtny'))
+
+def caseSplitMatrixOpen():
+    openArchive()
+    return lambda: loadArchive()
+
+def caseSubsetOfSplitMatrix():
+    matrix = openArchive([2023])[2023]
+    return lambda: subsetOfSplitMatrix(matrix)
+
+# percentile of a 16:00 at Rucky Chucky among male finishers in their 40s
+def casePercentileTable():
+    prepareDatabase()
+    return lambda: percentileAtStation('RuckyChucky', '16:00', gender='M', age=45, finish='finisher')
+
+def casePercentileFromSplits():
+    prepareDatabase()
+    return lambda: percentileAtStationFromSplits('RuckyChucky', '16:00', gender='M', age=45, finish='finisher')
+
+def caseNearestRunners():
+    index = loadIndex()
+    return lambda: similarRunners({'RobinsonFlat': '6:10', 'MichiganBluff': '11:40'}, 'M', 45, index=index)
+
+def caseFinishHistogram():
+    prepareDatabase()
+    return lambda: (finishTimeDistributionByBins(), plt.close('all'))
+
+def caseAgeHistogram():
+    prepareDatabase()
+    return lambda: (distributionByAge(), plt.close('all'))
+
+def caseFeatureBuild():
+    return lambda: buildFeatures(stations, dashIsMissing=True, cache=False)
+
+def caseFeatureCacheLoad():
+    prepareFeatures()
+    return lambda: buildFeatures(stations, dashIsMissing=True)
+
+def caseTrainFinish():
+    input_train, time_train, _, _ = prepareFeatures()
+    return lambda: fitLogistic(input_train, time_train)
+
+def caseTrainDistribution():
+    input_train, time_train, _, _ = prepareFeatures()
+    return lambda: fitDistribution(input_train, time_train)
+
+def caseTrainBuckle():
+    if importlib.util.find_spec('tensorflow') is None:
+        return "TensorFlow is not installed"
+    import tensorflow as tf
+    input_train, time_train, _, _ = buildFeatures(stations)
+    labels = np.digitize(time_train, [24, 30])
+    scaled = (input_train - input_train.mean(axis=0)) / (input_train.std(axis=0) + 1e-9)
+    def train():
+        tf.keras.utils.set_random_seed(0)
+        model = tf.keras.Sequential([tf.keras.layers.Dense(len(stations), activation='relu'), tf.keras.layers.Dense(3)])
+        model.compile(optimizer='adam', loss=tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True))
+        model.fit(scaled, labels, epochs=40, verbose=0)
+    return train
+
+def caseFinishInferenceSingle():
+    model = fitLogistic(*prepareFeatures()[0:2])
+    runner = prepareFeatures()[2][0]
+    return lambda: predictLogistic(model, runner)
+
+def caseFinishInferenceBatch():
+    model = fitLogistic(*prepareFeatures()[0:2])
+    input_test = prepareFeatures()[2]
+    return lambda: predictLogistic(model, input_test)
+
+def caseBuckleInferenceSingle():
+    model, scaler = prepareBuckleModel()
+    runner = prepareFeatures()[2][0]
+    return lambda: predictBuckle(model, scaler, runner)
+
+def caseBuckleInferenceBatch():
+    model, scaler = prepareBuckleModel()
+    input_test = prepareFeatures()[2]
+    return lambda: predictBuckle(model, scaler, input_test)
+
+# name: (case, repeats); repeats of None uses the suite's default
+# cases named *-cached run with the read cache on (repeats are then cache hits); every other case measures the database
+benchmarkCases = {
+    "ingest-year": (caseIngestYear, None),
+    "pacing-participant": (casePacingParticipant, 500),
+    "pacing-participant-cached": (casePacingParticipant, 500),
+    "pacing-team-sequential": (casePacingTeamSequential, None),
+    "pacing-team-batch": (casePacingTeamBatch, 200),
+    "subset-of-field": (caseSubsetOfField, None),
+    "subset-of-field-cached": (caseSubsetOfField, None),
+    "split-matrix-open": (caseSplitMatrixOpen, None),
+    "subset-of-split-matrix": (caseSubsetOfSplitMatrix, None),
+    "percentile-table": (casePercentileTable, 1000),
+    "percentile-from-splits": (casePercentileFromSplits, None),
+    "nearest-runners": (caseNearestRunners, 500),
+    "search-index-build": (caseSearchIndexBuild, None),
+    "search-participant": (caseSearchParticipant, 1000),
+    "histogram-finish-time": (caseFinishHistogram, None),
+    "histogram-age": (caseAgeHistogram, None),
+    "feature-build": (caseFeatureBuild, None),
+    "feature-cache-load": (caseFeatureCacheLoad, None),
+    "train-finish": (caseTrainFinish, None),
+    "train-distribution": (caseTrainDistribution, 5),
+    "train-buckle": (caseTrainBuckle, 3),
+    "inference-finish-single": (caseFinishInferenceSingle, 1000),
+    "inference-finish-batch": (caseFinishInferenceBatch, 200),
+    "inference-buckle-single": (caseBuckleInferenceSingle, 1000),
+    "inference-buckle-batch": (caseBuckleInferenceBatch, 200)
+}
+
+### RUNNING
+# Times one case: one untimed warm-up call, then `repeats` timed calls (the cases' own printing is discarded)
+def timeCase(name, repeats=None):
+    case, caseRepeats = benchmarkCases[name]
+    repeats = repeats or caseRepeats or defaultRepeats
+    setQueryCache(name.endswith("-cached"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        run = case()
+        if isinstance(run, str):
+            return {'skipped': run}
+        run()
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+    seconds = np.array(seconds)
+    return {'repeats': repeats, 'min': float(seconds.min()), 'median': float(np.median(seconds)),
+            'mean': float(seconds.mean()), 'max': float(seconds.max())}
+
+# Runs some or all cases on a fresh database of the chosen backend and returns the results document
+def runBenchmarks(names=None, repeats=None, backendName='sqlite'):
+    names = list(benchmarkCases) if names is None else names
+    useBackend(backendName)
+    prepared.clear()
+    results = {'created': datetime.datetime.now().isoformat(timespec='seconds'), 'machine': platform.node(),
+               'python': platform.python_version(), 'numpy': np.__version__, 'cpus': os.cpu_count(),
+               'backend': backendName, 'cases': {}}
+    for name in names:
+        results['cases'][name] = timeCase(name, repeats)
+        result = results['cases'][name]
+        if 'skipped' in result:
+            print("{:<26} skipped ({})".format(name, result['skipped']))
+        else:
+            print("{:<26} median {:>10.3f} ms  min {:>10.3f} ms  ({} runs)".format(name, 1000 * result['median'], 1000 * result['min'], result['repeats']))
+    return results
+
+# Compares the medians of two results documents; returns the names of the cases slower than baseline by more than threshold
+def compareResults(results, baseline, threshold=defaultThreshold):
+    regressions = []
+    print("{:<26} {:>12} {:>12} {:>9}".format("case", "baseline ms", "current ms", "change"))
+    for name, result in results['cases'].items():
+        before = baseline['cases'].get(name, {})
+        if 'median' not in result or 'median' not in before:
+            continue
+        change = result['median'] / before['median'] - 1.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print("{:<26} {:>12.3f} {:>12.3f} {:>+8.1%}{}".format(name, 1000 * before['median'], 1000 * result['median'], change, flag))
+    if baseline.get('machine') != results.get('machine') or baseline.get('backend') != results.get('backend'):
+        print("NOTE: baseline is from {} ({}), this run from {} ({})".format(
+            baseline.get('machine'), baseline.get('backend'), results.get('machine'), results.get('backend')))
+    print("{} regression(s) above {:.0%}".format(len(regressions), threshold))
+    return regressions
+
+# Writes a results document as JSON
+def saveResults(results, path=resultsPath):
+    with open(path, 'w') as resultsFile:
+        json.dump(results, resultsFile, indent=2)
+
+# Reads a results document
+def loadResults(path):
+    with open(path) as resultsFile:
+        return json.load(resultsFile)
+
+# Usage: python wserBenchmarks.py [--list] [--cases a,b,...] [--repeats N] [--backend sqlite|mysql]
+#                                 [--output results.json] [--baseline baseline.json] [--threshold 0.10]
+# exits with status 1 when a baseline is given and a case regressed
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    option = lambda name: arguments[arguments.index(name) + 1] if name in arguments else None
+    if "--list" in arguments:
+        print("\n".join(benchmarkCases))
+        sys.exit(0)
+    names = option("--cases").split(",") if option("--cases") else None
+    unknown = [name for name in names or [] if name not in benchmarkCases]
+    if unknown:
+        print("Unknown case(s): {} (see --list)".format(", ".join(unknown)))
+        sys.exit(2)
+    results = runBenchmarks(names, int(option("--repeats")) if option("--repeats") else None, option("--backend") or 'sqlite')
+    saveResults(results, option("--output") or resultsPath)
+    print("Saved results to {}".format(option("--output") or resultsPath))
+    if option("--baseline"):
+        regressions = compareResults(results, loadResults(option("--baseline")), float(option("--threshold") or defaultThreshold))
+        sys.exit(1 if regressions else 0)
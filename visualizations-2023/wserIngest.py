@@ -0,0 +1,105 @@
+### IMPORTS
+import glob
+import hashlib
+import os
+import sys
+import time
+from wserSetup import *
+
+# splits/wserYYYY.csv files live with the predictors (wserSetup puts their reader on the path)
+archiveDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'buckle-predictor-tf', 'splits')
+from wserSplits import readSplitsFile, splitsFileYear
+from wserSplitMatrix import buildSplitMatrix, saveSplitMatrix
+from wserPercentiles import refreshPercentileTable
+
+### GLOBAL VARIABLES
+createIngestedFilesTable = """
+    CREATE TABLE ingested_files (
+        year INT PRIMARY KEY,
+        fileName VARCHAR(255),
+        sha256 CHAR(64),
+        runners INT
+    );
+    """
+
+### FUNCTIONS
+# SHA-256 of a file's content
+def fileHash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as dataFile:
+        for block in iter(lambda: dataFile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Opens the results store, creating the schema and the ingestion log if needed
+def openArchive():
+    connection = createServerConnection(hostName, userName, password)
+    if not databaseExists(connection, databaseName):
+        createDatabase(connection, databaseName)
+        connection = createDatabaseConnection(hostName, userName, password, databaseName)
+        createTables(connection)
+    connection = createDatabaseConnection(hostName, userName, password, databaseName)
+    if getSchemaVersion(connection) < schemaVersion:
+        migrateToLongSplits(connection)
+    else:
+        createSplitViews(connection)
+    if not tableExists(connection, 'ingested_files'):
+        executeQuery(connection, createIngestedFilesTable)
+    return connection
+
+# Replaces one year's partition with the content of a splits file, and refreshes that year's split matrix and percentile tables
+# the year's rows are replaced and its ingested_files row written in one transaction, so a failed load keeps the
+# previous rows and hash (and the next ingestArchive tries the file again)
+def ingestYear(connection, path, year, digest):
+    results = readSplitsFile(path)
+    start = time.perf_counter()
+    participants, splits = participantRows(results, year), longSplitRows(results, year)
+    executeTransaction(connection, [
+        ("DELETE FROM splits WHERE year = %s", (year,)),
+        ("DELETE FROM participants WHERE year = %s", (year,)),
+        (insertIntoParticipantsV2, participants),
+        (insertIntoSplitsV2, splits),
+        ("DELETE FROM ingested_files WHERE year = %s", (year,)),
+        ("INSERT INTO ingested_files (year, fileName, sha256, runners) VALUES (%s, %s, %s, %s)",
+         (year, os.path.basename(path), digest, len(results)))])
+    elapsed = time.perf_counter() - start
+    print("Loaded {} rows in {:.3f} s ({:.0f} rows/s)".format(len(participants) + len(splits), elapsed,
+                                                             (len(participants) + len(splits)) / max(elapsed, 1e-9)))
+    matrix = buildSplitMatrix(results, year, source={'file': os.path.basename(path), 'sha256': digest})
+    saveSplitMatrix(matrix)
+    refreshPercentileTable(matrix)
+    return len(results)
+
+# Loads every splits/wserYYYY.csv into the store, partitioned by year
+# files whose content hash matches the last ingest are skipped (force=True reloads everything)
+def ingestArchive(directory=archiveDirectory, force=False):
+    start = time.perf_counter()
+    connection = openArchive()
+    ingested = dict(readQuery(connection, "SELECT year, sha256 FROM ingested_files"))
+    loaded, skipped = [], []
+    for path in sorted(glob.glob(os.path.join(directory, 'wser*.csv'))):
+        year = splitsFileYear(path)
+        digest = fileHash(path)
+        if not force and ingested.get(year) == digest:
+            skipped.append(year)
+            continue
+        print("Ingesting {} ({})".format(year, os.path.basename(path)))
+        ingestYear(connection, path, year, digest)
+        loaded.append(year)
+    connection.close()
+    print("Ingested {} year(s) {}, skipped {} unchanged in {:.2f} s".format(len(loaded), loaded, len(skipped), time.perf_counter() - start))
+    return loaded
+
+# Years currently in the store
+def archiveYears():
+    connection = createDatabaseConnection(hostName, userName, password, databaseName)
+    years = [row[0] for row in readQuery(connection, "SELECT DISTINCT year FROM participants ORDER BY year")]
+    connection.close()
+    return years
+
+# Usage: python wserIngest.py [--force] [--sqlite [path]]
+if __name__ == "__main__":
+    if "--sqlite" in sys.argv:
+        i = sys.argv.index("--sqlite")
+        useBackend('sqlite', sys.argv[i + 1] if i + 1 < len(sys.argv) and not sys.argv[i + 1].startswith("--") else ':memory:')
+    ingestArchive(force="--force" in sys.argv)
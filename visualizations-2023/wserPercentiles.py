@@ -0,0 +1,226 @@
+### IMPORTS
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+from wserSetup import raceYear
+from wserSplitMatrix import openArchive, stationMiles
+
+### GLOBAL VARIABLES
+tablesDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "percentile-tables")     # one sub-directory per year
+tablesVersion = 1                                   # bump when the tables are built differently
+kinds = ['elapsed', 'split']                        # elapsed time at a station, or time since the previous station
+genderGroups = [None, 'M', 'F']                     # None = everybody
+ageGroups = [None, 10, 20, 30, 40, 50, 60, 70, 80]  # decade an age falls in (80 = 80 and over)
+finishGroups = [None, 'finisher', 'silver', 'bronze', 'dnf']    # silver: under 24 hours, bronze: 24 to 30 hours
+quantileGrid = np.array([0.0, 0.05, 0.10, 0.25, 0.50, 0.75, 0.90, 0.95, 1.0])
+percentileTables = {}                               # year -> PercentileTable, loaded on first use
+unavailableYears = set()                            # years asked for that have no splits file (i.e. 2020), not looked up again
+
+### TABLES
+# Sorted times of every (kind, station, gender, age group, finish group) of one year, laid end to end in `values`;
+# offsets[kind, station, gender, age, finish] holds the start and end of each group's slice and quantiles its summary
+class PercentileTable:
+    def __init__(self, year, values, offsets, quantiles, source=None):
+        self.year = year
+        self.values = values
+        self.offsets = offsets
+        self.quantiles = quantiles
+        self.source = source or {}          # source of the split matrix it was built from (file name, SHA-256)
+
+    # Sorted seconds of one group
+    def group(self, kind, station, gender=None, age=None, finish=None):
+        start, end = self.offsets[groupIndex(kind, station, gender, age, finish)]
+        return self.values[start:end]
+
+# Values at quantiles qs of an already sorted array (linear interpolation, as np.quantile)
+def sortedQuantiles(values, qs):
+    position = np.asarray(qs, dtype=float) * (len(values) - 1)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, len(values) - 1)
+    below = np.asarray(values[lower], dtype=float)
+    return below + (position - lower) * (np.asarray(values[upper], dtype=float) - below)
+
+# Position of a group in the offsets and quantiles arrays; age is a runner's age (or None for every age)
+def groupIndex(kind, station, gender=None, age=None, finish=None):
+    ageGroup = None if age is None else min(int(age) // 10 * 10, ageGroups[-1])
+    return (kinds.index(kind), list(stationMiles).index(station), genderGroups.index(gender), ageGroups.index(ageGroup),
+            finishGroups.index(finish))
+
+# Builds a year's tables from its split matrix (wserSplitMatrix): every station column is sorted once and each group
+# keeps its runners in that order
+def buildPercentileTable(matrix):
+    seconds = np.asarray(matrix.seconds, dtype=np.int64)
+    missing = np.asarray(matrix.missing)
+    finish = matrix.station('Finish')
+    splits = seconds.copy()
+    splits[:, 1:] = seconds[:, 1:] - seconds[:, :-1]
+    hasSplit = ~missing.copy()
+    hasSplit[:, 1:] &= ~missing[:, :-1]
+    byKind = {'elapsed': (seconds, ~missing), 'split': (splits, hasSplit)}
+
+    # Runners in every group value
+    gender = np.asarray(matrix.runners.gender)
+    age = np.asarray(matrix.runners.age)
+    finishHours = np.where(missing[:, finish], np.inf, seconds[:, finish] / 3600.0)
+    everybody = np.ones(len(matrix), dtype=bool)
+    genderMasks = [everybody] + [gender == value for value in genderGroups[1:]]
+    ageMasks = [everybody] + [(age >= low) & ((age < low + 10) | (low == ageGroups[-1])) for low in ageGroups[1:]]
+    finishMasks = [everybody, finishHours < 30.0, finishHours < 24.0, (finishHours >= 24.0) & (finishHours < 30.0), finishHours == np.inf]
+
+    shape = (len(kinds), len(stationMiles), len(genderGroups), len(ageGroups), len(finishGroups))
+    offsets = np.zeros(shape + (2,), dtype=np.int64)
+    quantiles = np.full(shape + (len(quantileGrid),), np.nan, dtype=np.float32)
+    slices = []
+    position = 0
+    for k, kind in enumerate(kinds):
+        values, valid = byKind[kind]
+        for j in range(len(stationMiles)):
+            rows = np.flatnonzero(valid[:, j])
+            rows = rows[np.argsort(values[rows, j], kind='stable')]
+            for g, genderMask in enumerate(genderMasks):
+                for a, ageMask in enumerate(ageMasks):
+                    inGroup = rows[genderMask[rows] & ageMask[rows]]
+                    for f, finishMask in enumerate(finishMasks):
+                        groupValues = values[inGroup[finishMask[inGroup]], j]
+                        offsets[k, j, g, a, f] = (position, position + len(groupValues))
+                        if len(groupValues) > 0:
+                            quantiles[k, j, g, a, f] = sortedQuantiles(groupValues, quantileGrid)
+                            slices.append(groupValues)
+                            position += len(groupValues)
+    values = np.concatenate(slices).astype(np.int32) if slices else np.empty(0, dtype=np.int32)
+    return PercentileTable(matrix.year, values, offsets, quantiles, matrix.source)
+
+### SAVING AND LOADING
+# Saves a year's tables as .npy arrays plus metadata (written to a temporary directory that then replaces the year's)
+def savePercentileTable(table, directory=tablesDirectory):
+    target = os.path.join(directory, str(table.year))
+    partial = target + ".partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    for name in ['values', 'offsets', 'quantiles']:
+        np.save(os.path.join(partial, name + ".npy"), getattr(table, name))
+    with open(os.path.join(partial, "metadata.json"), 'w') as metadataFile:
+        json.dump({'version': tablesVersion, 'year': table.year, 'source': table.source}, metadataFile, indent=2)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(partial, target)
+
+# Opens a saved year's tables memory mapped, or None if they were never saved (or by an incompatible version)
+def loadPercentileTable(year, directory=tablesDirectory):
+    path = os.path.join(directory, str(year))
+    if not os.path.exists(os.path.join(path, "metadata.json")):
+        return None
+    with open(os.path.join(path, "metadata.json")) as metadataFile:
+        metadata = json.load(metadataFile)
+    if metadata.get('version') != tablesVersion:
+        return None
+    arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode='r') for name in ['values', 'offsets', 'quantiles']]
+    return PercentileTable(metadata['year'], *arrays, source=metadata['source'])
+
+# Saves a freshly built split matrix's tables and replaces the loaded ones (called when a year is ingested)
+def refreshPercentileTable(matrix, directory=tablesDirectory):
+    table = buildPercentileTable(matrix)
+    savePercentileTable(table, directory)
+    percentileTables[matrix.year] = table
+    unavailableYears.discard(matrix.year)
+    return table
+
+# Loads the tables of some years (default every year in the splits archive), building only the years that are new
+# or whose splits file changed since their tables were saved; verbose=False reports only the years it had to build
+def refreshPercentileTables(years=None, directory=tablesDirectory, verbose=True):
+    start = time.perf_counter()
+    built = []
+    for year, matrix in openArchive(years, verbose=verbose).items():
+        table = loadPercentileTable(year, directory)
+        if table is None or table.source.get('sha256') != matrix.source.get('sha256'):
+            table = refreshPercentileTable(matrix, directory)
+            built.append(year)
+        percentileTables[year] = table
+    if verbose or built:
+        print("Percentile tables for {} year(s) ready in {:.1f} ms{}".format(len(percentileTables), 1000 * (time.perf_counter() - start),
+              " (built {})".format(built) if built else ""))
+    return percentileTables
+
+# Tables of the selected years (one year, a (first, last) range or a list; default raceYear); the selected years that
+# are not loaded yet are loaded (and rebuilt if stale) on first use, whatever other years are already loaded
+def selectedTables(years=None):
+    if years is None:
+        years = raceYear
+    if isinstance(years, int):
+        years = [years]
+    elif isinstance(years, tuple) and len(years) == 2:
+        years = list(range(years[0], years[1] + 1))
+    missing = [year for year in years if year not in percentileTables and year not in unavailableYears]
+    if missing:
+        refreshPercentileTables(missing, verbose=False)
+        unavailableYears.update(year for year in missing if year not in percentileTables)
+    return [percentileTables[year] for year in years if year in percentileTables]
+
+### QUERIES
+# Elapsed time as seconds from "h:mm", "h:mm:ss" or a number of seconds
+def timeSeconds(elapsed):
+    if isinstance(elapsed, str):
+        parts = [float(part) for part in elapsed.strip().split(":")]
+        return int(round(parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)))
+    return int(elapsed)
+
+# Rank (1 = fastest) and percentile (share of the group the time beats, ties counting half) of a time at a station,
+# by binary search in each selected year's sorted group; kind 'split' ranks the time since the previous station
+def percentileRank(station, elapsed, years=None, gender=None, age=None, finish=None, kind='elapsed'):
+    seconds = timeSeconds(elapsed)
+    faster, tied, count = 0, 0, 0
+    for table in selectedTables(years):
+        group = table.group(kind, station, gender, age, finish)
+        below = int(np.searchsorted(group, seconds, 'left'))
+        faster += below
+        tied += int(np.searchsorted(group, seconds, 'right')) - below
+        count += len(group)
+    if count == 0:
+        return None
+    return {'rank': faster + 1, 'count': count, 'percentile': 100.0 * (count - faster - tied + 0.5 * tied) / count}
+
+# Time (seconds) at quantile q (0 = fastest, 1 = slowest) of a group at a station; a single year is read straight
+# from its sorted slice, several years are merged first
+def quantileSeconds(station, q, years=None, gender=None, age=None, finish=None, kind='elapsed'):
+    groups = [table.group(kind, station, gender, age, finish) for table in selectedTables(years)]
+    group = groups[0] if len(groups) == 1 else np.sort(np.concatenate(groups)) if groups else np.empty(0)
+    if len(group) == 0:
+        return None
+    return float(sortedQuantiles(group, q))
+
+# Saved quantile summary (quantileGrid -> seconds) of a group in one year
+def quantileSummary(station, year=None, gender=None, age=None, finish=None, kind='elapsed'):
+    tables = selectedTables(year)
+    if not tables:
+        return None
+    return dict(zip(quantileGrid.tolist(), tables[0].quantiles[groupIndex(kind, station, gender, age, finish)].tolist()))
+
+### CHECKS
+# Checks that selecting years loads exactly the ones not loaded yet: one year refreshed first (as ingestYear does) must
+# not hide the other years of a range, and a year without a race (2020) is left out; returns True when it holds
+def checkSelectedTables():
+    percentileTables.clear()
+    unavailableYears.clear()
+    refreshPercentileTable(openArchive([2019])[2019])
+    checks = {"range after one refreshed year": [table.year for table in selectedTables((2015, 2019))] == [2015, 2016, 2017, 2018, 2019],
+              "year without a race left out": [table.year for table in selectedTables((2019, 2021))] == [2019, 2021],
+              "single year": [table.year for table in selectedTables(2010)] == [2010]}
+    for name, passed in checks.items():
+        print("{:<32} {}".format(name, "ok" if passed else "FAILED"))
+    return all(checks.values())
+
+# Usage: python wserPercentiles.py [--rebuild]    (builds or refreshes every year's tables, then answers a few examples)
+#        python wserPercentiles.py --check        (checks which years selectedTables loads)
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        sys.exit(0 if checkSelectedTables() else 1)
+    if "--rebuild" in sys.argv:
+        shutil.rmtree(tablesDirectory, ignore_errors=True)
+    refreshPercentileTables()
+    result = percentileRank('Foresthill', '9:05', years=(2010, 2023))
+    print("9:05 at Foresthill, 2010-2023: rank {} of {}, percentile {:.1f}".format(result['rank'], result['count'], result['percentile']))
+    seconds = quantileSeconds('RuckyChucky', 0.5, finish='silver', kind='split')
+    miles = stationMiles['RuckyChucky'] - stationMiles['FordsBar']
+    print("Median split to Rucky Chucky for sub-24 runners in {}: {:.0f} s ({:.2f} min/mile)".format(raceYear, seconds, seconds / 60.0 / miles))
@@ -0,0 +1,227 @@
+### IMPORTS
+import bisect
+import functools
+import re
+import sys
+import time
+import unicodedata
+import numpy as np
+import wserSetup
+from wserSetup import getPooledConnection, readQuery, getSchemaVersion, raceYear
+
+### GLOBAL VARIABLES
+minimumPrefix = 2           # shorter name fragments only match whole names
+minimumTypo = 4             # shorter name fragments are not matched with a typo
+exactScore = 3              # per search word: whole name, name prefix, one typo away
+prefixScore = 2
+typoScore = 1
+participantIndex = None     # built on first search, rebuilt after any write to the database
+separatorPattern = re.compile(r"[\s\-]+")
+apostrophePattern = re.compile(r"['’]")
+
+### NAMES
+# Lower-case name with accents, apostrophes and periods removed ("Ågren" -> "agren", "O'Neil" -> "oneil")
+@functools.lru_cache(maxsize=65536)
+def foldName(name):
+    name = unicodedata.normalize('NFKD', str(name or ""))
+    name = "".join(character for character in name if not unicodedata.combining(character))
+    return name.lower().replace("'", "").replace("’", "").replace(".", "")
+
+# Words of a folded name (hyphenated and multi-part names give one word per part)
+@functools.lru_cache(maxsize=65536)
+def nameTokens(name):
+    return tuple(token for token in separatorPattern.split(foldName(name)) if token)
+
+# Words a name is indexed under: its words plus, when it has an apostrophe, the parts on either side of it
+# ("O'Neil" -> oneil, o, neil), so "O'Neil", "oneil" and "o neil" all find it
+@functools.lru_cache(maxsize=65536)
+def indexTokens(name):
+    tokens = nameTokens(name)
+    if not apostrophePattern.search(str(name or "")):
+        return tokens
+    return tokens + tuple(token for token in nameTokens(apostrophePattern.sub(" ", str(name))) if token not in tokens)
+
+# A word and every variant with one character deleted; two words sharing a variant are at most one edit
+# (insertion, deletion, substitution or swap of neighbours) apart
+def deletionVariants(token):
+    return {token} | {token[:i] + token[i + 1:] for i in range(len(token))}
+
+### INDEX
+# In-memory index of every participant in the database: exact bib lookup, and prefix, token and one-typo
+# search on first and last names; rows are (year, bib, firstName, lastName), kept most recent year first so that
+# equally good matches rank by row number
+class ParticipantIndex:
+    def __init__(self, rows, generation=None):
+        self.rows = [(int(year), str(bib), firstName or "", lastName or "") for year, bib, firstName, lastName in rows]
+        self.rows.sort(key=lambda row: (-row[0], foldName(row[3]), foldName(row[2]), row[1]))
+        self.generation = generation
+        self.years = np.array([row[0] for row in self.rows], dtype=np.int32)
+        self.byBib = {}         # upper-case bib -> row numbers
+        byToken = {}            # folded name word -> row numbers
+        for row, (year, bib, firstName, lastName) in enumerate(self.rows):
+            self.byBib.setdefault(bib.strip().upper(), []).append(row)
+            for token in set(indexTokens(firstName) + indexTokens(lastName)):
+                byToken.setdefault(token, []).append(row)
+        # Postings of every word laid end to end in word order, so the rows of all words with a prefix are one slice
+        self.tokens = sorted(byToken)
+        self.tokenNumber = {token: t for t, token in enumerate(self.tokens)}
+        counts = np.array([len(byToken[token]) for token in self.tokens], dtype=np.int64)
+        self.postingStart = np.concatenate(([0], np.cumsum(counts)))
+        self.postings = np.array([row for token in self.tokens for row in byToken[token]], dtype=np.int64)
+        self.byVariant = {}     # one-deletion variant -> word numbers
+        for t, token in enumerate(self.tokens):
+            if len(token) >= minimumTypo:
+                for variant in deletionVariants(token):
+                    self.byVariant.setdefault(variant, []).append(t)
+
+    # Rows of the words numbered first..last-1
+    def postingRows(self, first, last):
+        return self.postings[self.postingStart[first]:self.postingStart[last]]
+
+    # Rows matching one search word and their score (whole word beats prefix beats typo), as sorted unique rows
+    def matchToken(self, word):
+        rows, scores = [], []
+        t = self.tokenNumber.get(word)
+        if t is not None:
+            rows.append(self.postingRows(t, t + 1))
+            scores.append(exactScore)
+        if len(word) >= minimumPrefix:
+            first = bisect.bisect_right(self.tokens, word)
+            last = bisect.bisect_left(self.tokens, word + "\uffff")
+            rows.append(self.postingRows(first, last))
+            scores.append(prefixScore)
+        if len(word) >= minimumTypo:
+            for t in set(number for variant in deletionVariants(word) for number in self.byVariant.get(variant, ())):
+                rows.append(self.postingRows(t, t + 1))
+                scores.append(typoScore)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        scores = np.repeat(scores, [len(part) for part in rows])
+        rows = np.concatenate(rows)
+        order = np.lexsort((-scores, rows))
+        rows, scores = rows[order], scores[order]
+        best = np.ones(len(rows), dtype=bool)
+        best[1:] = rows[1:] != rows[:-1]
+        return rows[best], scores[best]
+
+    # Every participant matching a bib or a name, best match first (ties: most recent year, then by name)
+    # searchTerm: a bib (any term with a digit and no space) or one or more (partial) first/last names, in any order
+    # years: one year, a (first, last) range or a list of years (default every year); limit: most matches returned
+    def search(self, searchTerm, years=None, limit=None):
+        searchTerm = searchTerm.strip()
+        if " " not in searchTerm and any(character.isdigit() for character in searchTerm):
+            rows = np.array(self.byBib.get(searchTerm.upper(), []), dtype=np.int64)
+            scores = np.full(len(rows), exactScore)
+        else:
+            words = sorted(set(nameTokens(searchTerm)), key=len, reverse=True)
+            if not words:
+                return []
+            rows, scores = self.matchToken(words[0])
+            for word in words[1:]:
+                if len(rows) == 0:
+                    break
+                wordRows, wordScores = self.matchToken(word)
+                rows, kept, wordKept = np.intersect1d(rows, wordRows, assume_unique=True, return_indices=True)
+                scores = scores[kept] + wordScores[wordKept]
+        if years is not None:
+            if isinstance(years, int):
+                selected = self.years[rows] == years
+            elif isinstance(years, tuple) and len(years) == 2:
+                selected = (self.years[rows] >= years[0]) & (self.years[rows] <= years[1])
+            else:
+                selected = np.isin(self.years[rows], list(years))
+            rows, scores = rows[selected], scores[selected]
+        rank = (scores.max(initial=0) - scores) * len(self.rows) + rows
+        if limit is not None and limit < len(rank):
+            rank = rank[np.argpartition(rank, limit)[:limit]]
+        return [self.rows[row] for row in np.sort(rank) % len(self.rows)]
+
+    def __len__(self):
+        return len(self.rows)
+
+### DATABASE
+# Builds the index from the participants table (schema version 1 holds raceYear only)
+def buildParticipantIndex(connection=None):
+    ownConnection = connection is None
+    if ownConnection:
+        connection = getPooledConnection()
+    generation = wserSetup.writeGeneration
+    if getSchemaVersion(connection) >= 2:
+        rows = readQuery(connection, "SELECT year, bib, firstName, lastName FROM participants")
+    else:
+        rows = [(raceYear,) + tuple(row) for row in readQuery(connection, "SELECT bib, firstName, lastName FROM participants")]
+    if ownConnection:
+        connection.close()
+    return ParticipantIndex(rows, generation)
+
+# The shared index, built on first use and again whenever the database was written since it was built
+def getParticipantIndex(connection=None):
+    global participantIndex
+    if participantIndex is None or participantIndex.generation != wserSetup.writeGeneration:
+        participantIndex = buildParticipantIndex(connection)
+    return participantIndex
+
+# Every participant matching a bib or name as (year, bib, firstName, lastName), best match first
+def findParticipants(searchTerm, years=None, limit=None, connection=None):
+    return getParticipantIndex(connection).search(searchTerm, years, limit)
+
+### BENCHMARK
+# Random syllable names (plus some accented ones) for sizing the index beyond the real field
+def syntheticParticipants(count, seed=0):
+    generator = np.random.default_rng(seed)
+    syllables = ["an", "bel", "cor", "da", "el", "fen", "gar", "hol", "is", "jo", "ka", "lin", "mar", "nor", "o", "per",
+                 "quin", "ros", "sa", "tor", "u", "ver", "wen", "xa", "yo", "zel", "ré", "mü", "ñez", "å"]
+    def names(parts):
+        pieces = generator.integers(0, len(syllables), size=(count, parts))
+        return ["".join(syllables[p] for p in piece).capitalize() for piece in pieces]
+    firstNames, lastNames = names(2), names(3)
+    years = generator.integers(1974, 2024, size=count)
+    return [(int(years[i]), str(i), firstNames[i], lastNames[i]) for i in range(count)]
+
+# Build time and lookup latency (bib, prefix, full name, typo) of an index over `count` synthetic participants
+# limit: matches returned per lookup (the menu shows 20); the target counts as found when it is among them
+def benchmarkSearch(count=100000, repeats=2000, seed=0, limit=20):
+    rows = syntheticParticipants(count, seed)
+    start = time.perf_counter()
+    index = ParticipantIndex(rows)
+    print("Indexed {} participants in {:.2f} s ({} name words)".format(len(index), time.perf_counter() - start, len(index.tokens)))
+    generator = np.random.default_rng(seed + 1)
+    picks = [rows[i] for i in generator.integers(0, count, size=repeats)]
+    lookups = {
+        "bib": lambda row: row[1],
+        "last name prefix": lambda row: row[3][0:4],
+        "first and last name": lambda row: "{} {}".format(row[2], row[3]),
+        "last name, one typo": lambda row: row[3][:2] + row[3][3:],
+    }
+    timings = {}
+    for name, term in lookups.items():
+        terms = [term(row) for row in picks]
+        seconds, found = [], 0
+        for searchTerm, row in zip(terms, picks):
+            lookupStart = time.perf_counter()
+            matches = index.search(searchTerm, limit=limit)
+            seconds.append(time.perf_counter() - lookupStart)
+            found += row in matches
+        timings[name] = np.array(seconds)
+        print("{:<22} median {:>8.1f} us  p99 {:>8.1f} us  (target in the first {} matches {:.1%})".format(
+            name, 1e6 * np.median(seconds), 1e6 * np.percentile(seconds, 99), limit, found / len(picks)))
+    return timings
+
+# Usage: python wserSearch.py TERM [--year YEAR]      (searches the bundled year loaded into an in-memory SQLite database)
+#        python wserSearch.py --benchmark [COUNT]     (index build time and lookup latency at COUNT synthetic participants)
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    if "--benchmark" in arguments:
+        i = arguments.index("--benchmark")
+        benchmarkSearch(int(arguments[i + 1]) if i + 1 < len(arguments) else 100000)
+    elif arguments:
+        wserSetup.useBackend('sqlite')
+        wserSetup.createAndPopulateDatabase()
+        year = None
+        if "--year" in arguments:
+            i = arguments.index("--year")
+            year = int(arguments[i + 1])
+            arguments = arguments[:i] + arguments[i + 2:]
+        searchTerm = " ".join(arguments)
+        for year, bib, firstName, lastName in findParticipants(searchTerm, year, limit=20):
+            print("{}  bib {:>5}  {} {}".format(year, bib, firstName, lastName))
@@ -1,98 +1,400 @@
 ### IMPORTS
-import mysql.connector
-from mysql.connector import Error
+import atexit
+import collections
+import functools
+import os
+import re
+import sys
+import numpy as np
 import pandas as pd
+import time
+import weakref
+from wserBackends import makeBackend
+
+# Shared parsing modules (wserTimes, wserSplits, wserSplitMatrix) live with the predictors
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'buckle-predictor-tf'))
+from wserTimes import columnSeconds
+from wserSplitMatrix import stationMiles
 
 ### GLOBAL VARIABLES
 hostName = 'localhost'
 userName = 'root'
 password = 'password123'
 databaseName = 'WesternStatesEnduranceRun2023'   # name of overall database
-aidStationDetails = {
-    "LyonRidge": 10.3,
-    "RedStarRidge": 15.8,
-    "DuncanCanyon": 24.4,
-    "RobinsonFlat": 30.3,
-    "MillersDefeat": 34.4,
-    "DustyCorners": 38,
-    "LastChance": 43.3,
-    "DevilsThumb": 47.8,
-    "ElDoradoCreek": 52.9,
-    "MichiganBluff": 55.7,
-    "Foresthill": 62,
-    "Peachstone": 70.7,
-    "FordsBar": 73,
-    "RuckyChucky": 78,
-    "GreenGate": 79.8,
-    "AuburnLakeTrails": 85.2,
-    "QuarryRd": 90.7,
-    "PointedRocks": 94.3,
-    "RobiePoint": 98.9,
-    "Finish": 100.2
-}
+raceYear = 2023                                    # year loaded from the bundled CSV
+poolSize = 4                                       # connections shared by the analysis functions
+schemaVersion = 2                                  # 1 = one split_<station> table per aid station, 2 = single long-format splits table
+aidStationDetails = dict(stationMiles)             # mile marker of each aid station (shared with the predictors' split matrices)
 aidStations = list(aidStationDetails.keys())
+backend = makeBackend('mysql')                     # storage backend, see useBackend()
+Error = backend.errors                             # exception types raised by the active backend
+connectionPool = None                              # shared pool, created on first use
+poolStore = None                                   # (backend, host, database) the pool connects to
+connectionStores = weakref.WeakKeyDictionary()     # connection -> (backend, host, database) it reads, see tagConnection()
+poolStats = {"hits": 0, "misses": 0, "waitSeconds": 0.0, "maxWaitSeconds": 0.0}
+instrumentQueries = True                           # record every query's time, rows and caller in queryStats
+queryStats = {}                                    # per normalized query shape, see recordQuery()
+latencyBuckets = [0.0001, 0.001, 0.01, 0.1, 1.0]   # upper edges (seconds) of the latency histogram; the last bucket is open
+slowQuerySeconds = 0.25                            # queries at least this slow are appended to slowQueryLog
+slowQueryLog = os.path.join(os.path.dirname(os.path.abspath(__file__)), "slow-queries.log")
+cacheQueries = True                                # serve repeated reads from queryCache
+queryCacheEntries = 256                            # most results kept (least recently used are evicted first)
+queryCacheBytes = 64 * 1024 * 1024                 # most memory (estimated) the cached results may take
+queryCacheSeconds = 300.0                          # results older than this are read again
+queryCache = collections.OrderedDict()             # (store, shape, literals, params) -> (generation, storedAt, result, bytes)
+writeGeneration = 0                                # bumped by every write, so cached reads from before it are never served
+cacheStats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0, "bytes": 0}
 
 ### FUNCTIONS
-# Creates to MySQL server
+# Selects the storage backend: 'mysql' (server at hostName) or 'sqlite' (embedded file or ':memory:')
+def useBackend(name, path=':memory:'):
+    global backend, Error
+    backend = makeBackend(name, path)
+    Error = backend.errors
+    closeConnectionPool()
+    invalidateQueryCache()
+    return backend
+
+# Connects to the database server (the embedded backend has no server, so this opens its database)
 def createServerConnection(hostName, userName, userPass):
     connection = None
     try: 
-        connection = mysql.connector.connect(
-            host=hostName,
-            user=userName,
-            passwd=userPass
-        )
+        connection = backend.serverConnection(hostName, userName, userPass)
     except Error as err:
         print(f"Error connecting to server: '{err}'")
 
-    return connection
+    return tagConnection(connection, hostName, None)
 
 # Creates a database
 def createDatabase(connection, databaseName):
-    cursor = connection.cursor()
+    invalidateQueryCache()
     try:
-        cursor.execute("CREATE DATABASE " + databaseName)
+        backend.createDatabase(connection, databaseName)
         print("Database created successfully")
     except Error as err:
         print(f"Error creating database: '{err}'")
-    cursor.close()
 
-# Connects to MySQL server (specific database)
+# Drops a database if it exists
+def dropDatabase(connection, databaseName):
+    invalidateQueryCache()
+    try:
+        backend.dropDatabase(connection, databaseName)
+    except Error as err:
+        print(f"Error dropping database: '{err}'")
+
+# Checks whether a database exists
+def databaseExists(connection, databaseName):
+    try:
+        return backend.databaseExists(connection, databaseName)
+    except Error as err:
+        print(f"Error checking database: '{err}'")
+        return False
+
+# Checks whether a table exists in the connected database
+def tableExists(connection, tableName):
+    try:
+        return backend.tableExists(connection, tableName)
+    except Error as err:
+        print(f"Error checking table: '{err}'")
+        return False
+
+# Connects to a specific database
 def createDatabaseConnection(hostName, userName, userPass, db):
     connection = None
     try: 
-        connection = mysql.connector.connect(
-            host=hostName,
-            user=userName,
-            passwd=userPass,
-            database=db
-        )
+        connection = backend.databaseConnection(hostName, userName, userPass, db)
     except Error as err:
         print(f"Error connecting to database: '{err}'")
 
+    return tagConnection(connection, hostName, db)
+
+# Creates the shared connection pool for the analysis database
+def createConnectionPool(size=None):
+    global connectionPool, poolStore
+    connectionPool = None
+    try:
+        connectionPool = backend.createPool(size if size is not None else poolSize,
+                                            hostName, userName, password, databaseName)
+        poolStore = (backend, hostName, databaseName)
+    except Error as err:
+        print(f"Error creating connection pool: '{err}'")
+    return connectionPool
+
+# Drops the shared connection pool (i.e. after the database is recreated)
+def closeConnectionPool():
+    global connectionPool
+    connectionPool = None
+
+# Gets a connection from the shared pool; close() hands it back to the pool
+# hit = a connection was free, miss = the pool was exhausted and we waited for one
+def getPooledConnection(timeout=10.0):
+    if connectionPool is None and createConnectionPool() is None:
+        return None
+    start = time.perf_counter()
+    waited = False
+    while True:
+        try:
+            connection = connectionPool.get_connection()
+            break
+        except backend.poolExhaustedError:
+            if not waited:
+                poolStats["misses"] += 1
+                waited = True
+            if time.perf_counter() - start > timeout:
+                print("Error getting pooled connection: pool exhausted")
+                return None
+            time.sleep(0.001)
+    wait = time.perf_counter() - start
+    if not waited:
+        poolStats["hits"] += 1
+    poolStats["waitSeconds"] += wait
+    poolStats["maxWaitSeconds"] = max(poolStats["maxWaitSeconds"], wait)
+    connectionStores[connection] = poolStore
     return connection
 
+# Remembers which backend, host and database a connection reads; cached results are only shared between connections
+# to the same store, and reads through connections opened elsewhere are not cached
+def tagConnection(connection, host, db):
+    if connection is not None:
+        connectionStores[connection] = (backend, host, db)
+    return connection
+
+# Prints pool hit/miss and wait-time counters
+def printPoolStats():
+    requests = poolStats["hits"] + poolStats["misses"]
+    print("Connection pool: {} requests, {} hits, {} misses, {:.3f} ms mean wait, {:.3f} ms max wait".format(
+        requests, poolStats["hits"], poolStats["misses"],
+        1000 * poolStats["waitSeconds"] / max(requests, 1), 1000 * poolStats["maxWaitSeconds"]))
+
+### QUERY INSTRUMENTATION
+# Splits a query into its shape and its literals: quoted strings and numbers become ?, split_<station> becomes split_?,
+# IN lists collapse and whitespace is squeezed, so the same query for another bib, year or aid station has the same shape
+literalPattern = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\b\d+(?:\.\d+)?\b|\bsplit_(\w+)")
+
+@functools.lru_cache(maxsize=4096)
+def parameterizeQuery(query):
+    literals = []
+    def strip(match):
+        literals.append(match.group(0))
+        return "split_?" if match.group(1) else "?"
+    shape = literalPattern.sub(strip, query)
+    shape = re.sub(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", "IN (?)", shape, flags=re.IGNORECASE)
+    return re.sub(r"\s+", " ", shape).strip(), tuple(literals)
+
+# Query shape (the query without its literals), used to group query statistics
+def normalizeQuery(query):
+    return parameterizeQuery(query)[0]
+
+# Name (module.function) of the first caller outside this module, i.e. the analysis function that issued the query
+def queryCaller():
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    return "{}.{}".format(os.path.splitext(os.path.basename(frame.f_code.co_filename))[0], frame.f_code.co_name)
+
+# Records one query: count, total/max time, rows and latency histogram per shape, and who called it
+def recordQuery(query, seconds, rows):
+    if not instrumentQueries:
+        return
+    shape = normalizeQuery(query)
+    caller = queryCaller()
+    stats = queryStats.get(shape)
+    if stats is None:
+        stats = queryStats[shape] = {"count": 0, "seconds": 0.0, "maxSeconds": 0.0, "rows": 0,
+                                     "histogram": [0] * (len(latencyBuckets) + 1), "callers": {}}
+    stats["count"] += 1
+    stats["seconds"] += seconds
+    stats["maxSeconds"] = max(stats["maxSeconds"], seconds)
+    stats["rows"] += rows
+    stats["histogram"][next((i for i, edge in enumerate(latencyBuckets) if seconds <= edge), len(latencyBuckets))] += 1
+    stats["callers"][caller] = stats["callers"].get(caller, 0) + 1
+    if slowQueryLog is not None and seconds >= slowQuerySeconds:
+        with open(slowQueryLog, 'a') as logFile:
+            logFile.write("{} {:.1f} ms {} rows {}: {}\n".format(time.strftime("%Y-%m-%d %H:%M:%S"), 1000 * seconds, rows, caller,
+                                                                  re.sub(r"\s+", " ", query).strip()))
+
+# Prints the query shapes that took the most total time, with their latency histograms and callers
+def printQueryStats(top=15):
+    if len(queryStats) == 0:
+        return
+    labels = ["<={}ms".format(1000 * edge if edge < 0.001 else int(1000 * edge)) for edge in latencyBuckets] + [">{}ms".format(int(1000 * latencyBuckets[-1]))]
+    totalCount = sum(stats["count"] for stats in queryStats.values())
+    totalSeconds = sum(stats["seconds"] for stats in queryStats.values())
+    print("Queries: {} in {} shapes, {:.3f} s total (slow-query threshold {:.0f} ms)".format(
+        totalCount, len(queryStats), totalSeconds, 1000 * slowQuerySeconds))
+    for shape, stats in sorted(queryStats.items(), key=lambda item: item[1]["seconds"], reverse=True)[:top]:
+        print("{:>7} x {:>9.3f} ms mean {:>9.3f} ms max {:>8} rows  {}".format(
+            stats["count"], 1000 * stats["seconds"] / stats["count"], 1000 * stats["maxSeconds"], stats["rows"], shape[:110]))
+        print("          latency: {}".format("  ".join("{} {}".format(label, count) for label, count in zip(labels, stats["histogram"]) if count)))
+        print("          callers: {}".format(", ".join("{} ({})".format(name, count) for name, count in sorted(stats["callers"].items(), key=lambda item: -item[1]))))
+
+# Sets the slow-query threshold (seconds) and log file (None: no log)
+def setSlowQueryLog(seconds, path=slowQueryLog):
+    global slowQuerySeconds, slowQueryLog
+    slowQuerySeconds = seconds
+    slowQueryLog = path
+
+# Clears the recorded query statistics
+def resetQueryStats():
+    queryStats.clear()
+
+# Prints the query summary when the program exits
+def enableQuerySummary(top=15):
+    atexit.unregister(printQueryStats)
+    atexit.register(printQueryStats, top)
+
+### QUERY CACHE
+# Marks every cached result as stale (called on any write and whenever the database itself is replaced)
+def invalidateQueryCache():
+    global writeGeneration
+    writeGeneration += 1
+    if len(queryCache) > 0:
+        cacheStats["invalidations"] += 1
+    queryCache.clear()
+    cacheStats["bytes"] = 0
+
+# Estimated memory of a query result (a list of row tuples)
+def resultBytes(result):
+    return sys.getsizeof(result) + sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in result)
+
+# Cached result of a read, or None; results from another write generation or older than queryCacheSeconds are dropped
+def cachedResult(key):
+    entry = queryCache.get(key)
+    if entry is None:
+        return None
+    generation, storedAt, result, size = entry
+    if generation != writeGeneration or time.monotonic() - storedAt > queryCacheSeconds:
+        del queryCache[key]
+        cacheStats["bytes"] -= size
+        cacheStats["expired"] += 1
+        return None
+    queryCache.move_to_end(key)
+    return result
+
+# Stores a read's result unless a write happened while it ran, then evicts least recently used results over the limits
+def storeResult(key, result, generation):
+    if generation != writeGeneration:
+        return
+    size = resultBytes(result)
+    if size > queryCacheBytes:
+        return
+    if key in queryCache:
+        cacheStats["bytes"] -= queryCache.pop(key)[3]
+    queryCache[key] = (generation, time.monotonic(), result, size)
+    cacheStats["bytes"] += size
+    while len(queryCache) > queryCacheEntries or cacheStats["bytes"] > queryCacheBytes:
+        _, (_, _, _, evicted) = queryCache.popitem(last=False)
+        cacheStats["bytes"] -= evicted
+        cacheStats["evictions"] += 1
+
+# Turns the read cache on or off and sets its limits (entries, bytes, seconds); turning it off empties it
+def setQueryCache(enabled=True, entries=None, maxBytes=None, seconds=None):
+    global cacheQueries, queryCacheEntries, queryCacheBytes, queryCacheSeconds
+    cacheQueries = enabled
+    queryCacheEntries = entries if entries is not None else queryCacheEntries
+    queryCacheBytes = maxBytes if maxBytes is not None else queryCacheBytes
+    queryCacheSeconds = seconds if seconds is not None else queryCacheSeconds
+    if not enabled:
+        queryCache.clear()
+        cacheStats["bytes"] = 0
+
+# Prints read-cache hit rate and memory use
+def printQueryCacheStats():
+    lookups = cacheStats["hits"] + cacheStats["misses"]
+    print("Query cache: {} lookups, {:.1%} hits, {} entries, {:.1f} KiB, {} evicted, {} expired, {} invalidations (generation {})".format(
+        lookups, cacheStats["hits"] / max(lookups, 1), len(queryCache), cacheStats["bytes"] / 1024.0,
+        cacheStats["evictions"], cacheStats["expired"], cacheStats["invalidations"], writeGeneration))
+
 # Executes a query
 def executeQuery(connection, query):
     cursor = connection.cursor(buffered=True)
+    queryStart = time.perf_counter()
     try:
         cursor.execute(query)
         connection.commit()
     except Error as err:
         print(f"Error executing query: '{err}'")
+    invalidateQueryCache()
+    recordQuery(query, time.perf_counter() - queryStart, max(cursor.rowcount, 0))
+    cursor.close()
+
+# Executes a parameterized query for many rows as a single transaction
+def executeManyQuery(connection, query, rows, batchSize=1000):
+    cursor = connection.cursor(buffered=True)
+    queryStart = time.perf_counter()
+    try:
+        for start in range(0, len(rows), batchSize):
+            cursor.executemany(backend.formatParams(query), rows[start:start + batchSize])    # connector rewrites each batch as one multi-row INSERT
+        connection.commit()
+    except Error as err:
+        connection.rollback()
+        print(f"Error executing query: '{err}'")
+    invalidateQueryCache()
+    recordQuery(query, time.perf_counter() - queryStart, len(rows))
     cursor.close()
 
-# Reads a query
-def readQuery(connection, query):
+# Executes statements as one transaction; each is (query, params) where params is None, one row of values for the %s
+# placeholders or a list of rows (executemany); the first failure rolls the transaction back and is raised
+# (MySQL commits every CREATE/ALTER/DROP on its own, so there only the data statements are rolled back)
+def executeTransaction(connection, statements, batchSize=1000):
+    cursor = connection.cursor(buffered=True)
+    try:
+        backend.beginTransaction(connection)
+        for query, params in statements:
+            queryStart = time.perf_counter()
+            if params is None:
+                cursor.execute(query)
+                rows = max(cursor.rowcount, 0)
+            elif isinstance(params, list):
+                for start in range(0, len(params), batchSize):
+                    cursor.executemany(backend.formatParams(query), params[start:start + batchSize])
+                rows = len(params)
+            else:
+                cursor.execute(backend.formatParams(query), params)
+                rows = max(cursor.rowcount, 0)
+            recordQuery(query, time.perf_counter() - queryStart, rows)
+        connection.commit()
+    except Error as err:
+        connection.rollback()
+        print(f"Error executing transaction: '{err}'")
+        raise
+    finally:
+        invalidateQueryCache()
+        cursor.close()
+
+# Reads a query (params: values for %s placeholders); repeated reads of the same store are served from the cache until
+# the next write
+def readQuery(connection, query, params=None):
+    store = connectionStores.get(connection)
+    cached = cacheQueries and store is not None
+    if cached:
+        shape, literals = parameterizeQuery(query)
+        key = (store, shape, literals, tuple(params) if params is not None else ())
+        result = cachedResult(key)
+        if result is not None:
+            cacheStats["hits"] += 1
+            return list(result)
+        cacheStats["misses"] += 1
+    generation = writeGeneration
     cursor = connection.cursor(buffered=True)
     result = None
+    queryStart = time.perf_counter()
     try:
-        cursor.execute(query)
+        if params is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(backend.formatParams(query), params)
         result = cursor.fetchall()
-        return result
     except Error as err:
         print(f"Error reading query: '{err}'")
+    recordQuery(query, time.perf_counter() - queryStart, len(result) if result is not None else 0)
     cursor.close()
+    if cached and result is not None:
+        storeResult(key, result, generation)
+        return list(result)
+    return result
 
 # Splits a time (as a string) into hh, mm, ss integers
 def formatTime(timeStr):
@@ -105,22 +407,68 @@ def formatTime(timeStr):
     except:
         print(timeStr)
 
-# Creates & populates database
-def createAndPopulateDatabase():
-    print("Creating and populating database...")
+# Converts a dataframe column to python values, with NaN as NULL
+def sqlValues(column, cast):
+    return [None if pd.isna(value) else cast(value) for value in column]
 
-    # Create database
-    connection = createServerConnection(hostName, userName, password)      # connect to mySQL server
-    executeQuery(connection, "DROP DATABASE IF EXISTS " + databaseName)     # housekeeping/debugging: clear database if it already exists
-    createDatabase(connection, databaseName)                                # create a new database/clean slate
-    
-    connection = createDatabaseConnection(hostName, userName, password, databaseName)  # connect to new database
+# Converts a time string to elapsed seconds
+def elapsedSeconds(timeStr):
+    [hh, mm, ss] = formatTime(timeStr)
+    return int(hh) * 3600 + int(mm) * 60 + int(ss)
 
-    # Create tables
-    createParticipantTable = """
+# Prepares participant rows for a batched insert
+def participantRows(results, year=None):
+    columns = [sqlValues(results['OverallPlace'], int),
+               sqlValues(results['Bib'], str),
+               sqlValues(results['FirstName'], str),
+               sqlValues(results['LastName'], str),
+               sqlValues(results['Gender'], str),
+               sqlValues(results['Age'], int),
+               sqlValues(results['City'], str),
+               sqlValues(results['State'], str),
+               sqlValues(results['Country'], str)]
+    if year is not None:
+        columns.insert(0, [year] * len(results))
+    return list(zip(*columns))
+
+# Prepares split rows for a batched insert into one split table (schema v1)
+def splitRows(results, station):
+    rows = []
+    bibs = sqlValues(results['Bib'], str)
+    places = sqlValues(results[station + 'Position'], int)
+    for bib, place, split in zip(bibs, places, results[station].astype(str)):
+        if '--:--' not in split:                # make sure split data is available from that aid station
+            [hh, mm, ss] = formatTime(split)
+            rows.append((place, bib, station, int(hh), int(mm), int(ss)))
+    return rows
+
+# Prepares long-format split rows (year, bib, station_idx, place, elapsed_seconds) for every aid station (schema v2)
+# station columns are h:mm:ss cells (wser2023.csv) or elapsed seconds (readSplitsFile), read a whole column at once
+def longSplitRows(results, year):
+    rows = []
+    bibs = np.array(sqlValues(results['Bib'], str), dtype=object)
+    for stationIdx, station in enumerate(aidStations):
+        places = np.array(sqlValues(results[station + 'Position'], int), dtype=object)
+        elapsed, missing = columnSeconds(results[station])
+        timed = np.flatnonzero(~missing)
+        rows.extend(zip([year] * len(timed), bibs[timed].tolist(), [stationIdx] * len(timed), places[timed].tolist(),
+                        elapsed[timed].tolist()))
+    return rows
+
+# Inserts prepared rows into a table and reports throughput
+def bulkInsert(connection, query, rows, tableName):
+    start = time.perf_counter()
+    executeManyQuery(connection, query, rows)
+    elapsed = time.perf_counter() - start
+    print("Loaded {} rows into {} in {:.3f} s ({:.0f} rows/s)".format(len(rows), tableName, elapsed, len(rows) / max(elapsed, 1e-9)))
+    return len(rows), elapsed
+
+### SCHEMA
+# Schema v1: participants keyed by bib, one split_<station> table per aid station
+createParticipantTableV1 = """
     CREATE TABLE participants (
         overallplace INT,
-        bib VARCHAR(4) PRIMARY KEY,
+        bib VARCHAR(8) PRIMARY KEY,
         firstName VARCHAR(40),
         lastName VARCHAR(40),
         gender VARCHAR(2),
@@ -130,19 +478,252 @@ def createAndPopulateDatabase():
         country VARCHAR(40)
     );
     """
-    createSplitTable = lambda splitName: """
+createSplitTableV1 = lambda splitName: """
     CREATE TABLE split_{} (
         place INT NOT NULL,
-        bib VARCHAR(4) PRIMARY KEY,
+        bib VARCHAR(8) PRIMARY KEY,
         location VARCHAR(40),
         hours INT,
         minutes INT,
         seconds INT
     );
     """.format(splitName)
-    executeQuery(connection, createParticipantTable) 
+
+# Schema v2: participants keyed by (year, bib), all splits in one long-format table, both partitioned/clustered by year
+createParticipantTableV2 = lambda tableName='participants': """
+    CREATE TABLE {} (
+        year INT NOT NULL,
+        overallplace INT,
+        bib VARCHAR(8) NOT NULL,
+        firstName VARCHAR(40),
+        lastName VARCHAR(40),
+        gender VARCHAR(2),
+        age INT,
+        city VARCHAR(40),
+        state VARCHAR(40),
+        country VARCHAR(40),
+        PRIMARY KEY (year, bib)
+    ) {};
+    """.format(tableName, backend.tableOptions())
+createSplitsTableV2 = lambda tableName='splits': """
+    CREATE TABLE {} (
+        year INT NOT NULL,
+        bib VARCHAR(8) NOT NULL,
+        station_idx TINYINT NOT NULL,
+        place INT,
+        elapsed_seconds INT NOT NULL,
+        PRIMARY KEY (year, bib, station_idx)
+    ) {};
+    """.format(tableName, backend.tableOptions())
+# PRIMARY KEY serves a runner's full split vector; this index covers a whole station column (bib rides along from the PK)
+createSplitsIndexesV2 = lambda splitsTable='splits': [
+    "CREATE INDEX splits_by_station ON {} (year, station_idx, elapsed_seconds, place);".format(splitsTable),
+    "CREATE INDEX participants_by_gender_age ON participants (year, gender, age);"
+]
+
+# Parameterized inserts of one participant / one split (schema v2)
+insertIntoParticipantsV2 = """
+    INSERT INTO participants (year, overallplace, bib, firstName, lastName, gender, age, city, state, country)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+insertIntoSplitsV2 = """
+    INSERT INTO splits (year, bib, station_idx, place, elapsed_seconds)
+    VALUES (%s, %s, %s, %s, %s)"""
+
+# Legacy split_<station> layout as a view over the long table, so existing queries keep working
+# every year is in the view (the year column follows the legacy ones): queries filter on year, i.e. with yearCondition
+createSplitViewV2 = lambda splitName, stationIdx: """
+    CREATE VIEW split_{} AS
+    SELECT place, bib, '{}' AS location,
+        {} AS hours,
+        ({}) % 60 AS minutes,
+        elapsed_seconds % 60 AS seconds,
+        year
+    FROM splits
+    WHERE station_idx = {};
+    """.format(splitName, splitName, backend.intDivide('elapsed_seconds', 3600),
+               backend.intDivide('elapsed_seconds', 60), stationIdx)
+
+# SQL condition selecting one year (int), an inclusive range of years (first, last) or a list of years
+def yearCondition(years=None, column='participants.year'):
+    if years is None:
+        years = raceYear
+    if isinstance(years, int):
+        return "{} = {}".format(column, years)
+    if isinstance(years, tuple) and len(years) == 2:
+        return "{} BETWEEN {} AND {}".format(column, years[0], years[1])
+    return "{} IN ({})".format(column, ", ".join(str(year) for year in years))
+
+# Human-readable label for a year selection
+def yearLabel(years=None):
+    if years is None:
+        years = raceYear
+    if isinstance(years, int):
+        return str(years)
+    if isinstance(years, tuple) and len(years) == 2:
+        return "{}-{}".format(years[0], years[1])
+    return ", ".join(str(year) for year in years)
+
+# Finish splits for the selected years in the legacy split_finish column layout (join on year and bib)
+def finishSplitsQuery(years=None):
+    return """
+        SELECT year, bib, place,
+            {} AS hours,
+            ({}) % 60 AS minutes,
+            elapsed_seconds % 60 AS seconds
+        FROM splits
+        WHERE {} AND station_idx = {}""".format(backend.intDivide('elapsed_seconds', 3600), backend.intDivide('elapsed_seconds', 60),
+                                             yearCondition(years, 'year'), aidStations.index('Finish'))
+
+# Query for a runner's full split vector, in course order (one indexed range scan)
+def splitVectorQuery(bibNumber, year=raceYear):
+    return """
+        SELECT station_idx, place, elapsed_seconds
+        FROM splits
+        WHERE year = {} AND bib = '{}'
+        ORDER BY station_idx;""".format(year, bibNumber)
+
+# Query for the split vectors of many runners at once, given as (year, bib) pairs (one primary key range per runner)
+def splitMatrixQuery(runners):
+    bibsByYear = {}
+    for year, bib in runners:
+        bibsByYear.setdefault(int(year), []).append("'{}'".format(bib))
+    conditions = " OR ".join("(year = {} AND bib IN ({}))".format(year, ", ".join(bibs)) for year, bibs in sorted(bibsByYear.items()))
+    return """
+        SELECT year, bib, station_idx, elapsed_seconds
+        FROM splits
+        WHERE {};""".format(conditions or "1 = 0")
+
+# Query for one aid station's splits across the whole field (one indexed range scan)
+def stationColumnQuery(station, year=raceYear):
+    return """
+        SELECT bib, place, elapsed_seconds
+        FROM splits
+        WHERE year = {} AND station_idx = {}
+        ORDER BY elapsed_seconds;""".format(year, aidStations.index(station))
+
+# Query for every runner's split vector pivoted to one row (year, bib, s0 ... sN elapsed seconds, NULL = no split)
+def splitPivotQuery(years=None):
+    pivotColumns = ",\n            ".join("MAX(CASE WHEN station_idx = {} THEN elapsed_seconds END) AS s{}".format(i, i)
+                                          for i in range(len(aidStations)))
+    return """
+        SELECT year, bib,
+            {}
+        FROM splits
+        WHERE {}
+        GROUP BY year, bib""".format(pivotColumns, yearCondition(years, 'year'))
+
+# Creates tables for the requested schema version
+def createTables(connection, schema=schemaVersion):
+    if schema == 1:
+        executeQuery(connection, createParticipantTableV1)
+        for station in aidStations:
+            executeQuery(connection, createSplitTableV1(station))
+    else:
+        executeQuery(connection, createParticipantTableV2())
+        executeQuery(connection, createSplitsTableV2())
+        for query in createSplitsIndexesV2():
+            executeQuery(connection, query)
+        createSplitViews(connection)
+
+# (Re)creates the legacy split_<station> views of a schema v2 database (databases from before the views had a year
+# column get the current ones)
+def createSplitViews(connection):
+    for stationIdx, station in enumerate(aidStations):
+        executeQuery(connection, "DROP VIEW IF EXISTS split_{}".format(station))
+        executeQuery(connection, createSplitViewV2(station, stationIdx))
+
+# Detects the schema version of the connected database
+def getSchemaVersion(connection):
+    return 2 if tableExists(connection, 'splits') else 1
+
+# Migrates a schema v1 database (split_<station> tables) to schema v2 (long-format splits table)
+# stops at the first failed statement; splits are copied into splits_migrating and the v1 tables are only dropped once
+# every station is copied and participants are re-keyed, so a failed migration still reads as schema v1 and can be rerun
+def migrateToLongSplits(connection, year=raceYear):
+    print("Migrating split tables to long-format splits table...")
+    statements = ["DROP TABLE IF EXISTS splits_migrating", createSplitsTableV2('splits_migrating')]
+    for stationIdx, station in enumerate(aidStations):
+        statements.append("""
+            INSERT INTO splits_migrating (year, bib, station_idx, place, elapsed_seconds)
+            SELECT {}, bib, {}, place, hours * 3600 + minutes * 60 + seconds
+            FROM split_{};""".format(year, stationIdx, station))
+    if backend.alterPrimaryKey:
+        statements.append("ALTER TABLE participants ADD COLUMN year INT NOT NULL DEFAULT {} FIRST, "
+                          "DROP PRIMARY KEY, ADD PRIMARY KEY (year, bib)".format(year))     # one statement: all of it or nothing
+    else:
+        # No in-place re-keying (SQLite): participants is copied into a v2 table that then takes its name
+        columns = "overallplace, bib, firstName, lastName, gender, age, city, state, country"
+        statements += ["DROP TABLE IF EXISTS participants_migrating", createParticipantTableV2('participants_migrating'),
+                       "INSERT INTO participants_migrating (year, {}) SELECT {}, {} FROM participants".format(columns, year, columns),
+                       "DROP TABLE participants",
+                       "ALTER TABLE participants_migrating RENAME TO participants"]
+    statements += createSplitsIndexesV2('splits_migrating')
+    statements.append("ALTER TABLE splits_migrating RENAME TO splits")
+    for stationIdx, station in enumerate(aidStations):
+        statements.append("DROP TABLE split_{}".format(station))
+        statements.append(createSplitViewV2(station, stationIdx))
+    executeTransaction(connection, [(query, None) for query in statements])
+
+# Creates & populates database
+# bulk: insert each table as batched parameterized rows in one transaction (False = original per-row loader, schema v1 only)
+def createAndPopulateDatabase(bulk=True, resultsFile='wser2023.csv', schema=schemaVersion):
+    print("Creating and populating database...")
+    loadStart = time.perf_counter()
+    closeConnectionPool()                                                   # pooled connections point at the database being dropped
+    if not bulk:
+        schema = 1
+
+    # Create database
+    connection = createServerConnection(hostName, userName, password)      # connect to mySQL server
+    dropDatabase(connection, databaseName)                                  # housekeeping/debugging: clear database if it already exists
+    createDatabase(connection, databaseName)                                # create a new database/clean slate
+    
+    connection = createDatabaseConnection(hostName, userName, password, databaseName)  # connect to new database
+
+    # Create tables
+    createTables(connection, schema)
+
+    # Populate tables from CSV
+    wser2023 = pd.read_csv(resultsFile)                                    # Read WSER data
+    if not bulk:
+        populateTablesPerRow(connection, wser2023)
+    elif schema == 1:
+        populateTablesBulk(connection, wser2023)
+    else:
+        populateLongTablesBulk(connection, wser2023, raceYear)
+
+    elapsed = time.perf_counter() - loadStart
+    print("Database populated in {:.2f} s".format(elapsed))
+
+    ### CLEANUP
+    connection.close()
+    return elapsed
+
+# Populates schema v2 tables with one batched, parameterized insert (and one commit) per table
+def populateLongTablesBulk(connection, results, year):
+    participantCount, participantTime = bulkInsert(connection, insertIntoParticipantsV2, participantRows(results, year), 'participants')
+    splitCount, splitTime = bulkInsert(connection, insertIntoSplitsV2, longSplitRows(results, year), 'splits')
+    totalRows, totalTime = participantCount + splitCount, participantTime + splitTime
+    print("Bulk load: {} rows in {:.3f} s ({:.0f} rows/s)".format(totalRows, totalTime, totalRows / max(totalTime, 1e-9)))
+
+# Populates schema v1 tables with one batched, parameterized insert (and one commit) per table
+def populateTablesBulk(connection, results):
+    insertIntoParticipants = """
+    INSERT INTO participants (overallplace, bib, firstName, lastName, gender, age, city, state, country)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+
+    insertIntoSplits = lambda splitName: """
+    INSERT INTO split_{} (place, bib, location, hours, minutes, seconds)
+    VALUES (%s, %s, %s, %s, %s, %s)""".format(splitName)
+
+    totalRows, totalTime = bulkInsert(connection, insertIntoParticipants, participantRows(results), 'participants')
     for station in aidStations:
-        executeQuery(connection, createSplitTable(station))
+        rows, elapsed = bulkInsert(connection, insertIntoSplits(station), splitRows(results, station), 'split_' + station)
+        totalRows, totalTime = totalRows + rows, totalTime + elapsed
+    print("Bulk load: {} rows in {:.3f} s ({:.0f} rows/s)".format(totalRows, totalTime, totalRows / max(totalTime, 1e-9)))
+
+# Populates tables with one INSERT + commit per participant and per split (original loader, kept for comparison)
+def populateTablesPerRow(connection, wser2023):
 
     # Queries to populate tables
     insertIntoParticipants = lambda data: """
@@ -153,8 +734,8 @@ def createAndPopulateDatabase():
     INSERT INTO split_{} (place, bib, location, hours, minutes, seconds)
     VALUES ({})""".format(splitName, data)
 
-    # Populate tables from CSV
-    wser2023 = pd.read_csv('wser2023.csv')                                  # Read WSER data
+    numRows = 0
+    start = time.perf_counter()
     for i, row in wser2023.iterrows():
 
         # Populate participant data
@@ -168,6 +749,7 @@ def createAndPopulateDatabase():
                                     '"' + str(row['State']) + '"',
                                     '"' + str(row['Country']) + '"'])
         executeQuery(connection, insertIntoParticipants(participantData))
+        numRows = numRows + 1
 
         # Populate splits
         for station in aidStations:
@@ -180,5 +762,40 @@ def createAndPopulateDatabase():
                                     str(mm),
                                     str(ss)])
                 executeQuery(connection, insertIntoSplits(station, splitdata))
-    ### CLEANUP
-    connection.close()
+                numRows = numRows + 1
+    elapsed = time.perf_counter() - start
+    print("Per-row load: {} rows in {:.3f} s ({:.0f} rows/s)".format(numRows, elapsed, numRows / max(elapsed, 1e-9)))
+
+# Compares the per-row loader against the bulk loader on the same CSV
+def compareLoaders(resultsFile='wser2023.csv'):
+    perRow = createAndPopulateDatabase(bulk=False, resultsFile=resultsFile)
+    bulk = createAndPopulateDatabase(bulk=True, resultsFile=resultsFile)
+    print("Bulk loader speedup: {:.1f}x".format(perRow / max(bulk, 1e-9)))
+    return perRow, bulk
+
+# Compares per-query latency of the storage backends on the same data
+def benchmarkBackends(backends=('mysql', 'sqlite'), repeats=100, resultsFile='wser2023.csv'):
+    queries = {
+        "split vector": splitVectorQuery('14'),
+        "station column": stationColumnQuery('Foresthill'),
+        "finish view": "SELECT COUNT(*) FROM split_Finish WHERE hours < 24",
+        "split pivot": splitPivotQuery()
+    }
+    latencies = {}
+    setQueryCache(False)                # every repeat goes to the database
+    for name in backends:
+        useBackend(name)
+        createAndPopulateDatabase(resultsFile=resultsFile)
+        connection = getPooledConnection()
+        for label, query in queries.items():
+            start = time.perf_counter()
+            for _ in range(repeats):
+                readQuery(connection, query)
+            latencies[(name, label)] = (time.perf_counter() - start) / repeats
+        connection.close()
+    setQueryCache(True)
+
+    print("{:<16}".format("query") + "".join("{:>12}".format(name) for name in backends))
+    for label in queries:
+        print("{:<16}".format(label) + "".join("{:>10.3f}ms".format(1000 * latencies[(name, label)]) for name in backends))
+    return latencies